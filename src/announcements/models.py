@@ -1,12 +1,12 @@
 from django.conf import settings
 from django.db import models
 from django.db.models import Q
-from django.db.models.signals import pre_delete
+from django.db.models.signals import post_save, pre_delete
 from django.urls import reverse
 from django.utils import timezone
 
 from comments.models import Comment
-from notifications.models import deleted_object_receiver
+from notifications.models import deleted_object_receiver, updated_target_receiver
 
 
 class AnnouncementQuerySet(models.query.QuerySet):
@@ -91,3 +91,4 @@ class Announcement(models.Model):
 
 
 pre_delete.connect(deleted_object_receiver, sender=Announcement)
+post_save.connect(updated_target_receiver, sender=Announcement)
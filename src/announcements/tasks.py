@@ -1,3 +1,5 @@
+import logging
+
 from django.contrib.auth import get_user_model
 from django.core.mail import EmailMultiAlternatives
 from django.shortcuts import get_object_or_404
@@ -8,10 +10,13 @@ from django.utils import timezone
 from announcements.models import Announcement
 from courses.models import CourseStudent
 from hackerspace_online.celery import app
+from notifications.models import new_notification
 from notifications.signals import notify
 from siteconfig.models import SiteConfig
 from profile_manager.models import Profile
 
+logger = logging.getLogger(__name__)
+
 User = get_user_model()
 
 
@@ -20,7 +25,7 @@ def send_notifications(user_id, announcement_id):
     announcement = get_object_or_404(Announcement, pk=announcement_id)
     sending_user = User.objects.get(id=user_id)
     affected_users = CourseStudent.objects.all_users_for_active_semester()
-    notify.send(
+    responses = notify.send(
         sending_user,
         # action=new_announcement,
         target=announcement,
@@ -29,6 +34,10 @@ def send_notifications(user_id, announcement_id):
         icon="<i class='fa fa-lg fa-fw fa-newspaper-o text-info'></i>",
         verb='posted'
     )
+    # the report from notifications.models.new_notification
+    report = dict(responses)[new_notification]
+    logger.info(f"Task announcements.tasks.send_notifications: {report}")
+    return report
 
 
 @app.task(name='announcements.tasks.send_announcement_emails')
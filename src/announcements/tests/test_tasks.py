@@ -151,7 +151,8 @@ class AnnouncementTasksTests(TenantTestCase):
 
     def test_send_notifications(self):
 
-        tasks.send_notifications(self.ai_user.id, self.announcement.id)
+        report = tasks.send_notifications(self.ai_user.id, self.announcement.id)
+        self.assertIn('notifications_per_sec', report)
 
         # run method as synchronous task
         task_result = tasks.send_notifications.apply(
@@ -3,6 +3,7 @@ from collections import defaultdict
 
 from django.conf import settings
 from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
 from django.db import models
 from django.db.models import Max, Sum, Count, Q
 from django.shortcuts import get_object_or_404
@@ -14,9 +15,10 @@ from django.db.models.signals import post_save
 from siteconfig.models import SiteConfig
 from notifications.signals import notify
 
+from prerequisites.evaluator import PrereqEvaluator
 from prerequisites.models import Prereq, IsAPrereqMixin, HasPrereqsMixin
 from tags.models import TagsModelMixin
-from notifications.models import notify_rank_up
+from notifications.models import Notification, notify_rank_up, updated_target_receiver
 
 
 # Create your models here.
@@ -200,6 +202,11 @@ class Badge(IsAPrereqMixin, HasPrereqsMixin, TagsModelMixin, models.Model):
     def percent_of_active_users_granted_this(self):
         return self.fraction_of_active_users_granted_this() * 100
 
+    def get_granted_icon(self):
+        """ The icon of the notification sent when this badge is granted """
+        fa_icon = self.badge_type.fa_icon or "fa-certificate"
+        return f"<i class='text-warning fa fa-lg fa-fw {fa_icon}'></i>"
+
     def get_rarity_icon(self):
         percentile = self.percent_of_active_users_granted_this()
         badge_rarity = BadgeRarity.objects.get_rarity(percentile)
@@ -216,6 +223,13 @@ class Badge(IsAPrereqMixin, HasPrereqsMixin, TagsModelMixin, models.Model):
         # print("num_approved: " + str(num_approved) + "/" + str(num_required))
         return num_approved >= num_required
 
+    @classmethod
+    def prereq_counts_for_users(cls, user_ids, object_ids):
+        """ Number of assertions per (user, badge), same assertions as condition_met_as_prerequisite() """
+        assertions = BadgeAssertion.objects.get_queryset(False).filter(user_id__in=user_ids, badge_id__in=object_ids)
+        rows = assertions.order_by().values_list('user_id', 'badge_id').annotate(count=Count('id'))
+        return {(user_id, badge_id): count for user_id, badge_id, count in rows}
+
 
 class BadgeAssertionQuerySet(models.query.QuerySet):
     def get_user(self, user):
@@ -317,14 +331,90 @@ class BadgeAssertionManager(models.Manager):
         return new_assertion
 
     def check_for_new_assertions(self, user, transfer=False):
-        badges = Badge.objects.get_conditions_met(user)
-        for badge in badges:
-            # if the badge doesn't already exist
-            if not self.all_for_user_badge(user, badge, False):
-                self.create_assertion(user, badge, None, transfer)
-                # if a new badge has been granted, then check again recursively.
-                # maybe this should be celeried?
-                self.check_for_new_assertions(user, transfer)
+        return self.grant_earned_badges([user], transfer)
+
+    def grant_earned_badges(self, users, transfer=False):
+        """
+        Grants the users every active badge they have met the prerequisites for and don't have yet, for one user or a
+        whole cohort at once.  The prerequisites are evaluated with one PrereqEvaluator, and each badge granted is added
+        to its facts in memory, so badges earned through other badges are found without rescanning, until nothing new is
+        earned.  The assertions are created with bulk_create and the users' XP is recalculated once.  Only if that changes
+        someone's XP, e.g. for a Rank prerequisite, are the prerequisites evaluated again.
+
+        :return: a dict {user_id: [badges granted]}
+        """
+        users = list(users)
+        badges = Badge.objects.get_queryset().get_active().select_related('badge_type').in_bulk()
+        owned = set(
+            self.get_queryset(False).filter(user__in=users, badge_id__in=list(badges)).values_list('user_id', 'badge_id')
+        )
+        badge_ct_id = ContentType.objects.get_for_model(Badge).id
+        evaluator = PrereqEvaluator()
+
+        granted = defaultdict(list)
+        while True:
+            facts = evaluator.facts_for(Badge, users, list(badges))
+            new_assertions = []
+            while True:
+                met = evaluator.conditions_met(Badge, users, list(badges), no_prereq_means=False, facts=facts)
+                earned = [(user_id, badge_id) for user_id, badge_ids in met.items() for badge_id in badge_ids
+                          if (user_id, badge_id) not in owned]
+                if not earned:
+                    break
+                for user_id, badge_id in earned:
+                    owned.add((user_id, badge_id))
+                    facts.add(user_id, badge_ct_id, badge_id)
+                    new_assertions.append((user_id, badges[badge_id]))
+
+            if not new_assertions:
+                break
+            for user_id, badge in new_assertions:
+                granted[user_id].append(badge)
+            if not self._bulk_create_assertions(users, new_assertions, transfer):
+                break
+
+        return dict(granted)
+
+    def _bulk_create_assertions(self, users, new_assertions, transfer):
+        """
+        Creates the first assertion of each (user_id, badge), notifies the users, and recalculates their XP
+        :return: the number of users whose XP changed
+        """
+        from prerequisites.tasks import update_quest_conditions_for_prereq_objects
+        from profile_manager.models import Profile
+        from tags.models import UserTagXP
+
+        issued_by = SiteConfig.get().deck_ai
+        semester = SiteConfig.get().active_semester
+        self.bulk_create([
+            BadgeAssertion(badge=badge, user_id=user_id, ordinal=1, issued_by=issued_by, do_not_grant_xp=transfer,
+                           semester=semester)
+            for user_id, badge in new_assertions
+        ])
+
+        # bulk_create doesn't send post_save, so notify the same way post_save_receiver() does, one query per badge
+        users_by_id = {user.id: user for user in users}
+        recipients_by_badge = defaultdict(list)
+        for user_id, badge in new_assertions:
+            recipients_by_badge[badge].append(users_by_id[user_id])
+        for badge, recipients in recipients_by_badge.items():
+            Notification.objects.bulk_notify(issued_by, recipients, "granted you a", icon=badge.get_granted_icon(), target=badge)
+
+        # and update what post_save would have through the prerequisites and tags receivers
+        badge_ct_id = ContentType.objects.get_for_model(Badge).id
+        badges_by_user_id = defaultdict(list)
+        for user_id, badge in new_assertions:
+            badges_by_user_id[user_id].append([badge_ct_id, badge.id])
+        for user_id, prereq_objects in badges_by_user_id.items():
+            update_quest_conditions_for_prereq_objects.apply_async(args=[user_id, prereq_objects], queue='default')
+        UserTagXP.invalidate_users(badges_by_user_id)
+
+        profiles = list(Profile.objects.filter(user_id__in=badges_by_user_id).select_related('user'))
+        old_xps = {profile.id: profile.xp_cached for profile in profiles}
+        num_changed = Profile.objects.bulk_xp_invalidate_cache(profiles)
+        for profile in profiles:
+            notify_rank_up(profile.user, old_xps[profile.id], profile.xp_cached)
+        return num_changed
 
     def get_by_type_for_user(self, user):
         self.check_for_new_assertions(user)
@@ -346,6 +436,21 @@ class BadgeAssertionManager(models.Manager):
             xp = 0
         return xp
 
+    def calculate_xp_for_users(self, user_ids):
+        """ Same as calculate_xp(), but for many users at once with a single grouped query
+        :return: a dict {user_id: xp}, users without any xp granting assertions are not included
+        """
+        qs = self.get_queryset(True).grant_xp().filter(user_id__in=user_ids)
+        xps = qs.order_by().values_list('user_id').annotate(xp=Sum('badge__xp'))
+        return {user_id: xp or 0 for user_id, xp in xps}
+
+    def xp_events_for_users(self, user_ids):
+        """ The XP granted by each of the users' assertions, used to build XP over time series
+        :return: a list of (user_id, timestamp, xp) tuples
+        """
+        qs = self.get_queryset(True).grant_xp().filter(user_id__in=user_ids)
+        return [(user_id, timestamp, xp or 0) for user_id, timestamp, xp in qs.values_list('user_id', 'timestamp', 'badge__xp')]
+
     def calculate_xp_to_date(self, user, date):
         # self.check_for_new_assertions(user)
         qs = self.get_queryset(True).grant_xp().get_user(user)
@@ -409,22 +514,13 @@ def post_save_receiver(sender, **kwargs):
         if sender is None:
             sender = User.objects.filter(is_staff=True).first()
 
-        fa_icon = assertion.badge.badge_type.fa_icon
-
-        if not fa_icon:
-            fa_icon = "fa-certificate"
-
-        icon = "<i class='text-warning fa fa-lg fa-fw "
-        icon += fa_icon
-        icon += "'></i>"
-
         notify.send(
             sender,
             # action= action,
             target=assertion.badge,
             recipient=assertion.user,
             affected_users=[assertion.user, ],
-            icon=icon,
+            icon=assertion.badge.get_granted_icon(),
             verb="granted you a")
 
         # if user ranked up notify them
@@ -436,3 +532,6 @@ def post_save_receiver(sender, **kwargs):
                 # since post-save signal. this is before user.profile.xp_invalidate_cache()
                 assertion.user.profile.xp_cached + assertion.badge.xp,
             )
+
+
+post_save.connect(updated_target_receiver, sender=Badge)
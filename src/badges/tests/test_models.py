@@ -1,5 +1,7 @@
 from unittest import mock
 from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 
 from django_tenants.test.cases import TenantTestCase
@@ -8,6 +10,10 @@ from model_bakery import baker
 from model_bakery.recipe import Recipe
 
 from badges.models import Badge, BadgeAssertion, BadgeRarity, BadgeSeries, BadgeType
+from hackerspace_online.celery import app
+from prerequisites.models import Prereq, PrereqAllConditionsMet
+from prerequisites.tasks import update_quest_conditions_for_user
+from quest_manager.models import Quest, QuestSubmission
 from siteconfig.models import SiteConfig
 from notifications.models import Notification
 
@@ -348,3 +354,95 @@ class BadgeAssertionTestModel(TenantTestCase):
         self.assertEqual(notifications.count(), 4)
         self.assertEqual(notifications.filter(verb__contains='granted').count(), 3)
         self.assertEqual(notifications.filter(verb__contains='promoted').count(), 1)
+
+
+class BadgeGrantingTest(TenantTestCase):
+
+    def setUp(self):
+        self.sem = SiteConfig.get().active_semester
+        self.students = baker.make(User, _quantity=3)
+
+        # completing the quest earns the first badge, which earns the second one
+        self.quest = baker.make(Quest)
+        self.badge = baker.make(Badge, xp=10)
+        self.chained_badge = baker.make(Badge, xp=5)
+        Prereq.add_simple_prereq(self.badge, self.quest)
+        Prereq.add_simple_prereq(self.chained_badge, self.badge)
+        self.manual_badge = baker.make(Badge, xp=100)
+
+    def complete_quest(self, user):
+        baker.make(QuestSubmission, user=user, quest=self.quest, is_completed=True, is_approved=True, semester=self.sem)
+
+    def test_grant_earned_badges__chained(self):
+        """ Badges earned through other badges granted at the same time are found in one call """
+        student = self.students[0]
+        self.complete_quest(student)
+
+        granted = BadgeAssertion.objects.grant_earned_badges([student])
+
+        self.assertEqual(granted, {student.id: [self.badge, self.chained_badge]})
+        self.assertEqual(BadgeAssertion.objects.filter(user=student).count(), 2)
+        self.assertFalse(BadgeAssertion.objects.filter(badge=self.manual_badge).exists())
+        student.profile.refresh_from_db()
+        self.assertEqual(student.profile.xp_cached, 15)
+        self.assertEqual(Notification.objects.filter(recipient=student, verb="granted you a").count(), 2)
+
+        # nothing new the second time
+        self.assertEqual(BadgeAssertion.objects.grant_earned_badges([student]), {})
+        self.assertEqual(BadgeAssertion.objects.filter(user=student).count(), 2)
+
+    def test_grant_earned_badges__cohort(self):
+        for student in self.students[:2]:
+            self.complete_quest(student)
+        # already has the first badge, so only gets the second one
+        baker.make(BadgeAssertion, user=self.students[1], badge=self.badge, semester=self.sem)
+
+        granted = BadgeAssertion.objects.grant_earned_badges(self.students)
+
+        self.assertEqual(granted, {
+            self.students[0].id: [self.badge, self.chained_badge],
+            self.students[1].id: [self.chained_badge],
+        })
+        self.assertEqual(BadgeAssertion.objects.filter(user=self.students[1], badge=self.badge).count(), 1)
+
+    def test_grant_earned_badges__updates_available_quests(self):
+        """ Quests that require the granted badges become available, the same as when a badge is granted one by one """
+        self.addCleanup(setattr, app.conf, 'task_always_eager', app.conf.task_always_eager)
+        app.conf.task_always_eager = True
+        student = self.students[0]
+        self.complete_quest(student)
+        badge_quest = baker.make(Quest)
+        Prereq.add_simple_prereq(badge_quest, self.chained_badge)
+        update_quest_conditions_for_user(student.id)
+        self.assertNotIn(badge_quest.id, self.get_available_quest_ids(student))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            BadgeAssertion.objects.grant_earned_badges([student])
+
+        self.assertIn(badge_quest.id, self.get_available_quest_ids(student))
+
+    def get_available_quest_ids(self, user):
+        return PrereqAllConditionsMet.objects.get(user=user, model_name=Quest.get_model_name()).get_ids()
+
+    def test_grant_earned_badges__transfer(self):
+        student = self.students[0]
+        self.complete_quest(student)
+
+        BadgeAssertion.objects.check_for_new_assertions(student, transfer=True)
+
+        self.assertEqual(BadgeAssertion.objects.filter(user=student, do_not_grant_xp=True).count(), 2)
+        student.profile.refresh_from_db()
+        self.assertEqual(student.profile.xp_cached, 0)
+
+    def test_grant_earned_badges__queries(self):
+        """ Checking for new badges doesn't take more queries with more badges and users """
+        BadgeAssertion.objects.grant_earned_badges(self.students[:1])
+        with CaptureQueriesContext(connection) as few:
+            BadgeAssertion.objects.grant_earned_badges(self.students[:1])
+
+        for _ in range(5):
+            Prereq.add_simple_prereq(baker.make(Badge), self.quest)
+        with CaptureQueriesContext(connection) as many:
+            BadgeAssertion.objects.grant_earned_badges(self.students)
+
+        self.assertEqual(len(few), len(many))
@@ -7,8 +7,8 @@ from django.contrib.contenttypes.models import ContentType
 from django.db import models
 from django.utils.html import urlize, escape
 
-from notifications.models import deleted_object_receiver
-from django.db.models.signals import pre_delete
+from notifications.models import deleted_object_receiver, updated_target_receiver
+from django.db.models.signals import post_save, pre_delete
 
 
 # from quest_manager.models import Quest
@@ -211,3 +211,4 @@ class Document(models.Model):
 
 
 pre_delete.connect(deleted_object_receiver, sender=Comment)
+post_save.connect(updated_target_receiver, sender=Comment)
@@ -1,10 +1,12 @@
+import time
 from datetime import date, datetime, timedelta
 
 from django.conf import settings
 from django.contrib.auth.models import User
+from django.core.cache import cache
 from django.core.validators import validate_comma_separated_integer_list
-from django.db import models
-from django.db.models.signals import post_save
+from django.db import connection, models
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 from django.urls import reverse
 from django.utils import timezone
@@ -12,6 +14,7 @@ from django.utils import timezone
 import numpy
 from colorful.fields import RGBColorField
 
+from notifications.models import updated_target_receiver
 from prerequisites.models import IsAPrereqMixin
 from quest_manager.models import QuestSubmission
 from siteconfig.models import SiteConfig
@@ -106,6 +109,8 @@ class RankManager(models.Manager):
 
 
 class Rank(IsAPrereqMixin, models.Model):
+    prereq_uses_num_required = False
+
     name = models.CharField(max_length=50, unique=False, null=True)
     xp = models.PositiveIntegerField(help_text='The XP at which this rank is granted')
     icon = models.ImageField(upload_to='icons/ranks/', null=True, blank=True,
@@ -135,12 +140,29 @@ class Rank(IsAPrereqMixin, models.Model):
         # profile = Profile.objects.get(user=user)
         return user.profile.xp_cached >= self.xp
 
+    @classmethod
+    def prereq_counts_for_users(cls, user_ids, object_ids):
+        from profile_manager.models import Profile
+        rank_xps = list(cls.objects.filter(id__in=object_ids).values_list('id', 'xp'))
+        user_xps = Profile.objects.filter(user_id__in=user_ids).values_list('user_id', 'xp_cached')
+        return {
+            (user_id, rank_id): 1
+            for user_id, xp_cached in user_xps
+            for rank_id, rank_xp in rank_xps
+            if xp_cached >= rank_xp
+        }
+
     def get_map(self):
         from djcytoscape.models import CytoScape
         return CytoScape.objects.get_map_for_init(self)
 
 
+post_save.connect(updated_target_receiver, sender=Rank)
+
+
 class Grade(IsAPrereqMixin, models.Model):
+    prereq_uses_num_required = False
+
     name = models.CharField(max_length=20, unique=True)
     value = models.PositiveIntegerField(unique=True)
 
@@ -158,6 +180,12 @@ class Grade(IsAPrereqMixin, models.Model):
         else:
             return False
 
+    @classmethod
+    def prereq_counts_for_users(cls, user_ids, object_ids):
+        # grade values are unique, so matching the grade's id is the same as matching its value
+        coursestudents = CourseStudent.objects.current_courses_for_users(user_ids).filter(grade_fk_id__in=object_ids)
+        return {pair: 1 for pair in coursestudents.values_list('user_id', 'grade_fk_id')}
+
 
 class SemesterManager(models.Manager):
 
@@ -196,6 +224,199 @@ class SemesterManager(models.Manager):
         return active_sem
 
 
+class SemesterCalendar:
+    """ The class days of a semester, precomputed from its first and last days and its ExcludedDates so that
+    day counts, fractions and dates can be looked up without querying the database, e.g. once per day of a chart.
+
+    `cumulative[i]` is the number of class days from `first_day` up to and including `first_day + i days`, and
+    `class_dates` are the class days in order.  Dates outside the semester fall back to numpy's business day
+    functions on the same `numpy.busdaycalendar`, so results always match the plain numpy calculations.
+    """
+
+    def __init__(self, first_day, last_day, excluded_dates):
+        self.first_day = first_day
+        self.last_day = last_day
+        self.holidays = tuple(sorted(excluded_dates))
+        self._build()
+
+    def _build(self):
+        self.busdaycal = numpy.busdaycalendar(holidays=list(self.holidays))
+        days = numpy.arange(self.first_day, self.last_day + timedelta(days=1), dtype='datetime64[D]')
+        is_class_day = numpy.is_busday(days, busdaycal=self.busdaycal)
+        self.cumulative = numpy.cumsum(is_class_day)
+        self.class_dates = days[is_class_day]
+
+    def __getstate__(self):
+        # numpy.busdaycalendar can't be pickled, so cache the inputs and rebuild the arrays when unpickled
+        return {'first_day': self.first_day, 'last_day': self.last_day, 'holidays': self.holidays}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._build()
+
+    def matches(self, semester):
+        return (self.first_day, self.last_day) == (semester.first_day, semester.last_day)
+
+    def _index(self, day):
+        """ The index of `day` into the precomputed arrays, or None if it falls outside the semester """
+        index = (day - self.first_day).days
+        return index if 0 <= index < len(self.cumulative) else None
+
+    def is_class_day(self, day):
+        index = self._index(day)
+        if index is None:
+            return bool(numpy.is_busday(day, busdaycal=self.busdaycal))
+        return bool(self.cumulative[index] - (self.cumulative[index - 1] if index else 0))
+
+    def num_days(self, upto=None):
+        """ The number of class days from the first day up to and including `upto` (default: the last day) """
+        if upto is None or upto > self.last_day:
+            upto = self.last_day
+        index = self._index(upto)
+        if index is not None:
+            return int(self.cumulative[index])
+        count = numpy.busday_count(self.first_day, upto, busdaycal=self.busdaycal)
+        if numpy.is_busday(upto, busdaycal=self.busdaycal):  # end date is not included, so add here.
+            count += 1
+        return int(count)
+
+    def fraction_complete(self, upto):
+        return self.num_days(upto) / self.num_days()
+
+    def date_after_class_days(self, offset, roll):
+        """ Same as `numpy.busday_offset(first_day, offset, roll=roll)` with the semester's excluded dates """
+        if roll == 'forward' or self.is_class_day(self.first_day):
+            index = offset
+        else:
+            # rolling backward from a non-class first day lands on the last class day before the semester
+            index = offset - 1
+        if 0 <= index < len(self.class_dates):
+            return self.class_dates[index].item()
+        return numpy.busday_offset(self.first_day, offset, roll=roll, busdaycal=self.busdaycal).item()
+
+
+class MarkDistribution:
+    """ The marks of the students enrolled in the active semester, kept sorted and binned for the mark distribution
+    chart so a student's dashboard doesn't need to load every profile.  The distribution is cached, updated in place as
+    marks change (see `update_profiles`) and rebuilt with a single query when enrollment changes.
+
+    Marks are capped between 0 and 100, the last bin of BINS only holds 100%.
+    """
+    BINS = numpy.arange(0, 111, 10)
+
+    # seconds that `update_profiles` holds the lock for at most, and waits for it before giving up
+    LOCK_TIMEOUT = 10
+    LOCK_WAIT = 1
+
+    def __init__(self, semester_id, rows):
+        """ :param rows: (user_id, counted, mark) for each user enrolled in the semester, see `counted()` """
+        self.semester_id = semester_id
+        self.enrolled_user_ids = set()
+        self.marks = {}  # {user_id: capped mark} of the counted students
+        for user_id, counted, mark in rows:
+            self.enrolled_user_ids.add(user_id)
+            if counted:
+                self.marks[user_id] = self.cap(mark)
+        self.sorted_marks = numpy.sort(numpy.array(list(self.marks.values()), dtype=float))
+        self.histogram, _ = numpy.histogram(self.sorted_marks, bins=self.BINS)
+
+    @staticmethod
+    def counted(is_active, is_staff, is_test_account):
+        """ Whether a user enrolled in the semester is included, same as all_users_for_active_semester(students_only=True) """
+        return is_active and not is_staff and not is_test_account
+
+    @staticmethod
+    def cap(mark):
+        return min(max(float(mark or 0), 0), 100)
+
+    @classmethod
+    def cache_key(cls):
+        return f'{connection.schema_name}-mark-distribution'
+
+    @classmethod
+    def get(cls):
+        """ The active semester's distribution, from the cache if it's still for the active semester """
+        semester_id = SiteConfig.get().active_semester_id
+        distribution = cache.get(cls.cache_key())
+        if distribution is None or distribution.semester_id != semester_id:
+            courses = CourseStudent.objects.all_for_semester(semester_id).order_by()
+            rows = courses.values_list(
+                'user_id', 'user__is_active', 'user__is_staff', 'user__profile__is_test_account', 'user__profile__mark_cached'
+            ).distinct()
+            distribution = cls(semester_id, ((user_id, cls.counted(*flags), mark) for user_id, *flags, mark in rows))
+            cache.set(cls.cache_key(), distribution, settings.MARK_DISTRIBUTION_CACHE_TIMEOUT)
+        return distribution
+
+    @classmethod
+    def invalidate(cls):
+        cache.delete(cls.cache_key())
+
+    @classmethod
+    def lock_key(cls):
+        return f'{connection.schema_name}-mark-distribution-lock'
+
+    @classmethod
+    def acquire_lock(cls):
+        """ :return: True if the lock was acquired within LOCK_WAIT seconds """
+        deadline = time.monotonic() + cls.LOCK_WAIT
+        while not cache.add(cls.lock_key(), True, cls.LOCK_TIMEOUT):
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.05)
+        return True
+
+    @classmethod
+    def update_profiles(cls, profiles):
+        """ Update the cached distribution, if there is one, with the profiles' mark_cached and whether their users are
+        still counted, e.g. if they were deactivated or made into test accounts.  The update is locked so concurrent
+        saves don't overwrite each other's changes. """
+        if cache.get(cls.cache_key()) is None:
+            return
+
+        if not cls.acquire_lock():
+            # rather than lose this change, rebuild the distribution the next time it's needed
+            cls.invalidate()
+            return
+
+        try:
+            distribution = cache.get(cls.cache_key())
+            if distribution is None:
+                return
+
+            changed = False
+            for profile in profiles:
+                if profile.user_id in distribution.enrolled_user_ids:
+                    counted = cls.counted(profile.user.is_active, profile.user.is_staff, profile.is_test_account)
+                    changed |= distribution.set_mark(profile.user_id, profile.mark_cached, counted)
+            if changed:
+                cache.set(cls.cache_key(), distribution, settings.MARK_DISTRIBUTION_CACHE_TIMEOUT)
+        finally:
+            cache.delete(cls.lock_key())
+
+    def bin_index(self, mark):
+        return min(int(numpy.searchsorted(self.BINS, self.cap(mark), side='right')) - 1, len(self.histogram) - 1)
+
+    def set_mark(self, user_id, mark, counted=True):
+        """ Move a student's mark within the sorted marks and the histogram, or remove it if they're no longer counted
+        :return: True if the distribution changed
+        """
+        old_mark = self.marks.pop(user_id, None)
+        if old_mark is not None:
+            self.sorted_marks = numpy.delete(self.sorted_marks, numpy.searchsorted(self.sorted_marks, old_mark))
+            self.histogram[self.bin_index(old_mark)] -= 1
+        if counted:
+            mark = self.marks[user_id] = self.cap(mark)
+            self.sorted_marks = numpy.insert(self.sorted_marks, numpy.searchsorted(self.sorted_marks, mark), mark)
+            self.histogram[self.bin_index(mark)] += 1
+        return old_mark != self.marks.get(user_id)
+
+    def percentile(self, mark):
+        """ The percent of counted students with a lower mark, by binary search of the sorted marks """
+        if not len(self.sorted_marks):
+            return 0
+        return float(numpy.searchsorted(self.sorted_marks, self.cap(mark), side='left') / len(self.sorted_marks) * 100)
+
+
 def default_end_date():
     return date.today() + timedelta(days=135)
 
@@ -226,6 +447,12 @@ class Semester(models.Model):
     def __str__(self):
         return self.name or self.first_day.strftime("%b-%Y")
 
+    def __getstate__(self):
+        # semesters are pickled along with the cached SiteConfig, don't carry a calendar that might go stale with them
+        state = super().__getstate__()
+        state.pop('_calendar', None)
+        return state
+
     def active_by_date(self):
         # use local date `datetime.date.today()` instead of UTC date from `timezone.now().date()`
         return (self.last_day + timedelta(days=5)) > date.today() > (self.first_day - timedelta(days=20))
@@ -238,20 +465,34 @@ class Semester(models.Model):
         # the current local date.  Use current local date with date.today()
         return self.first_day <= date.today() <= self.last_day
 
+    @classmethod
+    def calendar_cache_key(cls, semester_id):
+        return f'{connection.schema_name}-semester-{semester_id}-calendar'
+
+    @classmethod
+    def calendar_version_key(cls, semester_id):
+        return f'{connection.schema_name}-semester-{semester_id}-calendar-version'
+
+    def calendar(self):
+        """ The semester's SemesterCalendar, kept in the cache and on the instance until the semester or its
+        ExcludedDates change.  `invalidate_semester_calendar` bumps the semester's version in the cache, so instances
+        in every process know to drop the calendar they are holding.
+        """
+        version = cache.get(self.calendar_version_key(self.pk), 0)
+        held_version, calendar = getattr(self, '_calendar', (None, None))
+        if held_version != version or not calendar.matches(self):
+            # a calendar built from dates read before an invalidation is stored with the old version, and ignored
+            cached_version, calendar = cache.get(self.calendar_cache_key(self.pk), (None, None))
+            if cached_version != version or not calendar.matches(self):
+                calendar = SemesterCalendar(self.first_day, self.last_day, self.excluded_days())
+                cache.set(self.calendar_cache_key(self.pk), (version, calendar), None)
+            self._calendar = (version, calendar)
+        return calendar
+
     def num_days(self, upto_today=False):
         '''The number of classes in the semester (from start date to end date
         excluding weekends and ExcludedDates). '''
-
-        excluded_days = self.excluded_days()
-        if upto_today and date.today() < self.last_day:
-            last_day = date.today()
-        else:
-            last_day = self.last_day
-        count = numpy.busday_count(self.first_day, last_day, holidays=excluded_days)
-        if numpy.is_busday(last_day, holidays=excluded_days):  # end date is not included, so add here.
-            count += 1
-        # We want to return an int because a numpty.int64 is not JSON serializable as of the moment
-        return count.item() if hasattr(count, 'item') else count
+        return self.calendar().num_days(date.today() if upto_today else None)
 
     def excluded_days(self):
         return self.excludeddate_set.all().values_list('date', flat=True)
@@ -260,9 +501,7 @@ class Semester(models.Model):
         return self.num_days(True)
 
     def fraction_complete(self):
-        current_days = self.num_days(True)
-        total_days = self.num_days()
-        return current_days / total_days
+        return self.calendar().fraction_complete(date.today())
 
     def percent_complete(self):
         return self.fraction_complete() * 100.0
@@ -282,12 +521,9 @@ class Semester(models.Model):
     def get_date(self, fraction_complete):
         """ Gets the closest date, rolling back if it falls on a weekend or excluded
         after a fraction of the semester is over """
-        days = self.num_days()
-        days_to_fraction = int(days * fraction_complete)
-        excluded_days = self.excluded_days()
-        date_after_fraction = numpy.busday_offset(self.first_day, offsets=days_to_fraction, roll='backward',
-                                                  holidays=excluded_days)
-        return date_after_fraction.item()
+        calendar = self.calendar()
+        days_to_fraction = int(calendar.num_days() * fraction_complete)
+        return calendar.date_after_class_days(days_to_fraction, roll='backward')
 
     def get_datetime_by_days_since_start(self, class_days, add_holidays=False):
         """ The date `class days` from the start of the semester
@@ -301,10 +537,8 @@ class Semester(models.Model):
         Returns:
             {datetime} -- [description]
         """
-        excluded_days = self.excluded_days()
-
         # The next day of class excluding holidays/weekends, -1 because first day counts as 1, not zero.
-        d = numpy.busday_offset(self.first_day, class_days - 1, roll='forward', holidays=excluded_days).astype(date)
+        d = self.calendar().date_after_class_days(class_days - 1, roll='forward')
 
         # Might want to include the holidays (if class day is Friday, then work done on weekend/holidays won't show up
         # till Monday.  For chart, want to include those days
@@ -334,10 +568,7 @@ class Semester(models.Model):
 
     def get_student_mark_list(self, students_only=False):
         students = CourseStudent.objects.all_users_for_active_semester(students_only=students_only)
-        mark_list = []
-        for student in students:
-            mark_list.append(student.profile.mark_cached)
-        return mark_list
+        return list(students.values_list('profile__mark_cached', flat=True))
 
 
 class BlockManager(models.Manager):
@@ -355,6 +586,8 @@ class BlockManager(models.Manager):
 
 
 class Block(IsAPrereqMixin, models.Model):
+    prereq_uses_num_required = False
+
     name = models.CharField(max_length=50, unique=True)
     description = models.TextField(blank=True, null=True)
     current_teacher = models.ForeignKey(settings.AUTH_USER_MODEL,
@@ -378,6 +611,11 @@ class Block(IsAPrereqMixin, models.Model):
         # num_required is not used for this one
         return CourseStudent.objects.current_courses(user).filter(block=self).exists()
 
+    @classmethod
+    def prereq_counts_for_users(cls, user_ids, object_ids):
+        coursestudents = CourseStudent.objects.current_courses_for_users(user_ids).filter(block_id__in=object_ids)
+        return {pair: 1 for pair in coursestudents.values_list('user_id', 'block_id')}
+
 
 class ExcludedDate(models.Model):
     semester = models.ForeignKey(Semester, on_delete=models.CASCADE)
@@ -387,8 +625,37 @@ class ExcludedDate(models.Model):
     def __str__(self):
         return self.date.strftime("%d-%b-%Y")
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # so the calendar of the semester a date is moved away from can be invalidated too
+        instance._loaded_semester_id = instance.__dict__.get('semester_id')
+        return instance
+
+
+@receiver(post_save, sender=Semester)
+@receiver(post_delete, sender=Semester)
+@receiver(post_save, sender=ExcludedDate)
+@receiver(post_delete, sender=ExcludedDate)
+def invalidate_semester_calendar(sender, instance, **kwargs):
+    """ Drop the cached SemesterCalendar when a semester's dates or its ExcludedDates change """
+    if sender is Semester:
+        semester_ids = {instance.pk}
+    else:
+        semester_ids = {instance.semester_id, getattr(instance, '_loaded_semester_id', None)} - {None}
+        instance._loaded_semester_id = instance.semester_id
+
+    for semester_id in semester_ids:
+        cache.delete(Semester.calendar_cache_key(semester_id))
+        try:
+            cache.incr(Semester.calendar_version_key(semester_id))
+        except ValueError:
+            cache.set(Semester.calendar_version_key(semester_id), 1, None)
+
 
 class Course(IsAPrereqMixin, models.Model):
+    prereq_uses_num_required = False
+
     title = models.CharField(max_length=50, unique=True)
     icon = models.ImageField(upload_to='icons/', null=True, blank=True)
     xp_for_100_percent = models.PositiveIntegerField(default=1000)
@@ -411,6 +678,11 @@ class Course(IsAPrereqMixin, models.Model):
         else:
             return False
 
+    @classmethod
+    def prereq_counts_for_users(cls, user_ids, object_ids):
+        coursestudents = CourseStudent.objects.current_courses_for_users(user_ids).filter(course_id__in=object_ids)
+        return {pair: 1 for pair in coursestudents.values_list('user_id', 'course_id')}
+
     @staticmethod
     def autocomplete_search_fields():  # for grapelli prereq selection
         return ("title__icontains",)
@@ -468,6 +740,13 @@ class CourseStudentManager(models.Manager):
                 xp += studentcourse.xp_adjustment
         return xp
 
+    def calculate_xp_for_users(self, user_ids):
+        """ Same as calculate_xp(), the sum of xp adjustments, but for many users at once with a single grouped query
+        :return: a dict {user_id: xp}, users without a current course are not included
+        """
+        xps = self.current_courses_for_users(user_ids).order_by().values_list('user_id').annotate(xp=models.Sum('xp_adjustment'))
+        return {user_id: xp or 0 for user_id, xp in xps}
+
     def calc_semester_grades(self, semester):
         coursestudents = self.get_queryset().get_semester(semester)
         for coursestudent in coursestudents:
@@ -491,6 +770,10 @@ class CourseStudentManager(models.Manager):
     def current_courses(self, user):
         return self.all_for_user(user).get_semester(SiteConfig.get().active_semester)
 
+    def current_courses_for_users(self, user_ids):
+        """ Same as current_courses(), but for many users at once """
+        return self.get_queryset().filter(user_id__in=user_ids).get_semester(SiteConfig.get().active_semester)
+
     def all_users_for_active_semester(self, students_only=False):
         """
         :return: queryset of all Users who are enrolled in a course during the active semester (doubles removed)
@@ -545,11 +828,13 @@ class CourseStudent(models.Model):
     # return reverse('courses:detail', kwargs={'pk': self.pk})
 
     # @cached_property
-    def calc_mark(self, xp):
+    def calc_mark(self, xp, fraction_complete=None):
+        """ :param fraction_complete: optional, the semester's fraction_complete() if it's already been calculated """
         if not self.course:  # course may be null if it was deleted.
             return 0
 
-        fraction_complete = self.semester.fraction_complete()
+        if fraction_complete is None:
+            fraction_complete = self.semester.fraction_complete()
         if fraction_complete > 0:
             return xp / fraction_complete * 100 / self.course.xp_for_100_percent
         else:
@@ -563,6 +848,13 @@ class CourseStudent(models.Model):
             return 0
 
 
+@receiver(post_save, sender=CourseStudent)
+@receiver(post_delete, sender=CourseStudent)
+def invalidate_mark_distribution(sender, instance, **kwargs):
+    """ Enrollment changed, so rebuild the MarkDistribution the next time it's needed """
+    MarkDistribution.invalidate()
+
+
 @receiver(post_save, sender=CourseStudent)
 def coursestudent_post_save_callback(instance, **kwargs):
     """
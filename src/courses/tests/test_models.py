@@ -1,16 +1,22 @@
 from datetime import date, datetime, timedelta
 
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.utils import timezone
 from django.db.models import ProtectedError
 
 from django_tenants.test.cases import TenantTestCase
+import numpy
 from freezegun import freeze_time
 from unittest.mock import patch
 from model_bakery import baker
 
-from courses.models import Block, Course, CourseStudent, ExcludedDate, MarkRange, Rank, Semester
+from courses.models import (
+    Block, Course, CourseStudent, ExcludedDate, MarkDistribution, MarkRange, Rank, Semester, SemesterCalendar,
+)
 from siteconfig.models import SiteConfig
 
 User = get_user_model()
@@ -282,6 +288,153 @@ class SemesterModelTest(TenantTestCase):
         self.assertEqual(student.profile.xp_cached, 0)
 
 
+class SemesterCalendarTest(TenantTestCase):
+
+    def setUp(self):
+        self.semester = baker.make(Semester, first_day=date(2019, 9, 1), last_day=date(2019, 12, 20))
+        self.excluded = [date(2019, 9, 2), date(2019, 10, 14), date(2019, 11, 11), date(2019, 11, 12)]
+        for day in self.excluded:
+            baker.make(ExcludedDate, semester=self.semester, date=day)
+
+    def test_same_results_as_numpy(self):
+        """ Lookups in the precomputed arrays match numpy's business day functions, inside and outside the semester """
+        calendar = SemesterCalendar(self.semester.first_day, self.semester.last_day, self.excluded)
+        first_day = self.semester.first_day
+
+        for offset in range(-10, 130):
+            day = first_day + timedelta(days=offset)
+            last_day = min(day, self.semester.last_day)
+            expected = numpy.busday_count(first_day, last_day, holidays=self.excluded)
+            expected += numpy.is_busday(last_day, holidays=self.excluded)
+            self.assertEqual(calendar.num_days(day), expected)
+            self.assertEqual(calendar.is_class_day(day), numpy.is_busday(day, holidays=self.excluded))
+
+            for roll in ['forward', 'backward']:
+                expected = numpy.busday_offset(first_day, offset, roll=roll, holidays=self.excluded).item()
+                self.assertEqual(calendar.date_after_class_days(offset, roll), expected)
+
+    def test_no_queries_once_cached(self):
+        self.semester.num_days()
+        semester = Semester.objects.get(id=self.semester.id)
+
+        with CaptureQueriesContext(connection) as queries:
+            semester.num_days()
+            with freeze_time(date(2019, 10, 15), tz_offset=0):
+                semester.fraction_complete()
+            semester.get_date(0.5)
+            for day in range(1, 60):
+                semester.get_datetime_by_days_since_start(day)
+        self.assertEqual(len(queries), 0)
+
+    def test_invalidated_by_excluded_dates(self):
+        num_days = self.semester.num_days()
+
+        excluded_date = baker.make(ExcludedDate, semester=self.semester, date=date(2019, 12, 2))
+        self.assertEqual(Semester.objects.get(id=self.semester.id).num_days(), num_days - 1)
+        self.assertEqual(self.semester.num_days(), num_days - 1)
+
+        excluded_date.delete()
+        self.assertEqual(self.semester.num_days(), num_days)
+
+    def test_invalidated_by_moving_excluded_date(self):
+        """ Both the semester the date is moved to and the one it's moved away from are invalidated """
+        other_semester = baker.make(Semester, first_day=date(2020, 1, 6), last_day=date(2020, 1, 31))
+        baker.make(ExcludedDate, semester=self.semester, date=date(2019, 12, 2))
+        num_days = self.semester.num_days()
+        other_num_days = other_semester.num_days()
+
+        excluded_date = ExcludedDate.objects.get(date=date(2019, 12, 2))
+        excluded_date.semester = other_semester
+        excluded_date.save()
+
+        self.assertEqual(Semester.objects.get(id=self.semester.id).num_days(), num_days + 1)
+        self.assertEqual(self.semester.num_days(), num_days + 1)
+        self.assertEqual(other_semester.num_days(), other_num_days)
+
+    def test_invalidated_by_semester_dates(self):
+        num_days = self.semester.num_days()
+
+        self.semester.last_day = date(2019, 12, 27)
+        self.semester.save()
+        self.assertEqual(Semester.objects.get(id=self.semester.id).num_days(), num_days + 5)
+
+
+class MarkDistributionTest(TenantTestCase):
+
+    def setUp(self):
+        self.semester = SiteConfig.get().active_semester
+        self.course = baker.make(Course, xp_for_100_percent=1000)
+        self.students = baker.make(User, _quantity=5)
+        for student in self.students:
+            baker.make(CourseStudent, user=student, course=self.course, semester=self.semester)
+        self.set_marks([5, 15, 15, 60, 120])
+        # not counted
+        baker.make(CourseStudent, user=baker.make(User, is_staff=True), course=self.course, semester=self.semester)
+        baker.make(CourseStudent, user=baker.make(User), course=self.course, semester=baker.make(Semester))
+
+    def set_marks(self, marks):
+        for student, mark in zip(self.students, marks):
+            student.profile.mark_cached = mark
+            student.profile.save()
+
+    def test_histogram(self):
+        distribution = MarkDistribution.get()
+
+        self.assertListEqual(distribution.histogram.tolist(), [1, 2, 0, 0, 0, 0, 1, 0, 0, 0, 1])
+        self.assertListEqual(distribution.sorted_marks.tolist(), [5, 15, 15, 60, 100])
+        expected, _ = numpy.histogram(numpy.clip(Semester.get_student_mark_list(Semester, students_only=True), 0, 100),
+                                      bins=MarkDistribution.BINS)
+        self.assertListEqual(distribution.histogram.tolist(), expected.tolist())
+
+    def test_percentile(self):
+        distribution = MarkDistribution.get()
+        self.assertEqual(distribution.percentile(5), 0)
+        self.assertEqual(distribution.percentile(16), 60)
+        self.assertEqual(distribution.percentile(150), 80)
+
+    def test_updated_in_place(self):
+        """ Mark changes are applied to the cached distribution without rebuilding it """
+        MarkDistribution.get()
+        self.set_marks([95, 15])
+        self.students[2].profile.is_test_account = True
+        self.students[2].profile.save()
+        self.students[3].is_active = False
+        self.students[3].save()
+
+        with CaptureQueriesContext(connection) as queries:
+            distribution = MarkDistribution.get()
+        self.assertEqual(len([query for query in queries if not query['sql'].startswith('SET search_path')]), 0)
+        self.assertListEqual(distribution.sorted_marks.tolist(), [15, 95, 100])
+        self.assertListEqual(distribution.histogram.tolist(), [0, 1, 0, 0, 0, 0, 0, 0, 0, 1, 1])
+
+    @patch.object(MarkDistribution, 'LOCK_WAIT', 0)
+    def test_update_while_locked(self):
+        """ If another process is updating the distribution, it's rebuilt later instead of losing the change """
+        MarkDistribution.get()
+        cache.add(MarkDistribution.lock_key(), True)
+        try:
+            self.set_marks([95])
+        finally:
+            cache.delete(MarkDistribution.lock_key())
+
+        self.assertIsNone(cache.get(MarkDistribution.cache_key()))
+        self.assertIn(95, MarkDistribution.get().sorted_marks.tolist())
+
+    def test_bulk_xp_invalidate_cache_updates_marks(self):
+        from profile_manager.models import Profile
+
+        MarkDistribution.get()
+        Profile.objects.bulk_xp_invalidate_cache(Profile.objects.filter(user__in=self.students))
+        expected = sorted(float(profile.mark_cached) for profile in Profile.objects.filter(user__in=self.students))
+        self.assertListEqual(MarkDistribution.get().sorted_marks.tolist(), expected)
+
+    def test_invalidated_by_enrollment(self):
+        MarkDistribution.get()
+        student = baker.make(User)
+        baker.make(CourseStudent, user=student, course=self.course, semester=self.semester)
+        self.assertIn(student.id, MarkDistribution.get().marks)
+
+
 class CourseModelTest(TenantTestCase):
 
     def setUp(self):
@@ -1048,6 +1048,20 @@ class TestAjax_MarkDistributionChart(ViewTestUtilsMixin, TenantTestCase):
         self.assertNotEqual(total_students, len(test_account_students))
         self.assertEqual(total_students, len(active_sem_students))
 
+    def test_user_percentile(self):
+        """ the user's percentile is the percent of students in the active semester with a lower mark """
+        students = [self.create_student_course(100) for i in range(4)]
+        for index, course_student in enumerate(students):
+            course_student.user.profile.mark_cached = index * 20
+            course_student.user.profile.save()
+
+        self.client.force_login(self.teacher)
+        response = self.client.get(
+            reverse('courses:mark_distribution_chart', args=[students[2].user.id]),
+            HTTP_X_REQUESTED_WITH='XMLHttpRequest'
+        )
+        self.assertEqual(json.loads(response.content)['data']['percentile'], 50)
+
 
 class TestAjax_ProgressChart(ViewTestUtilsMixin, TenantTestCase):
 
@@ -19,18 +19,15 @@ from hackerspace_online.decorators import staff_member_required, xml_http_reques
 
 from announcements.models import Announcement
 from siteconfig.models import SiteConfig
-from tags.models import get_user_tags_and_xp, get_quest_submission_by_tag, get_badge_assertion_by_tags
+from tags.models import UserTagXP, get_user_tags_and_xp
 # from .forms import ProfileForm
 from tenant.views import NonPublicOnlyViewMixin, non_public_only_view
 
 from .forms import BlockForm, CourseStudentForm, CourseStudentStaffForm, MarkRangeForm, SemesterForm, ExcludedDateFormset, ExcludedDateFormsetHelper
-from .models import Block, Course, CourseStudent, Rank, Semester, MarkRange
+from .models import Block, Course, CourseStudent, MarkDistribution, Rank, Semester, MarkRange
 from djcytoscape.models import CytoScape
 from notifications.models import Notification
 
-from django.db.models import Q
-from django.db.models.functions import Greatest
-
 import numpy
 import math
 
@@ -572,26 +569,27 @@ def ajax_progress_chart(request, user_id=0):
             next_day_of_class = sem.get_datetime_by_days_since_start(i, add_holidays=True)
             datelist.append(next_day_of_class)
 
+        today = timezone.localtime()
+
+        # XP earned up to the end of each class day, plus today for the weekend carry-over below
+        *xp_series, xp_today = user.profile.xp_series(datelist + [today])
+
         xp_data = []
         # generate an list of dictionary data for chart.js:
         #   x: day into course
         #   y: XP earned so far
 
-        xp = 0
         num_courses = user.profile.num_courses()
         # days_so_far == len(datelist)
-        for day in range(0, sem.days_so_far()):
-            xp = user.profile.xp_to_date(datelist[day]) / num_courses
+        for day, xp in enumerate(xp_series):
             xp_data.append(
                 # day 0-indexed
-                {'x': day + 1, 'y': xp}
+                {'x': day + 1, 'y': xp / num_courses}
             )
 
-        today = timezone.localtime()
-
         # SAT and SUN are always excluded by numpy.busday_offset
         # use today.date() because its a datetime.datetime object and we compare it to a DateField (returns datetime.date)
-        if today.weekday() in [5, 6] or today.date() in sem.excluded_days():  # SAT, SAT or a day specifically excluded
+        if not sem.calendar().is_class_day(today.date()):  # SAT, SUN or a day specifically excluded
             # according to a comment inside get_datetime_by_days_since_start:
             #   "work done on weekend/holidays won't show up till Monday"
 
@@ -599,7 +597,7 @@ def ajax_progress_chart(request, user_id=0):
             # ie. if today is sunday: friday's total xp <= sunday's total xp
             # (if a submission is removed then will subtract from both friday and sunday xp)
             total_xp = xp_data[-1]['y']
-            difference = user.profile.xp_to_date(today) - total_xp
+            difference = xp_today - total_xp
 
             # if true: user has earned xp during the weekend.
             # add that xp to the last valid date
@@ -618,8 +616,6 @@ def ajax_progress_chart(request, user_id=0):
 
 
 class Ajax_MarkDistributionChart(NonPublicOnlyViewMixin, View):
-    _BINS = 10
-    _BIN_WIDTH = 10
 
     def dispatch(self, request, *args, **kwargs):
         is_ajax = request.META.get('HTTP_X_REQUESTED_WITH') == 'XMLHttpRequest'
@@ -639,47 +635,43 @@ class Ajax_MarkDistributionChart(NonPublicOnlyViewMixin, View):
         return get_object_or_404(User, pk=pk)
 
     def get_datasets(self):
-        """query datasets for both histograms ( marks over 100% will be capped at 100% )
+        """datasets for both histograms ( marks over 100% will be capped at 100% )
 
         Returns:
-            tuple[int, list[ints]]: queried user's mark and all students in active semester's mark
+            tuple[int, MarkDistribution]: queried user's mark and the active semester's distribution of student marks
         """
-        # grab dataset
         user_mark = self.user.profile.mark_cached or 0  # can be nonetype
-        student_marks = Semester.get_student_mark_list(Semester, students_only=True)
-        # only remove user's mark from student_marks if user is part of active sem
-        if CourseStudent.objects.all_users_for_active_semester(students_only=True).filter(id=self.user.id).exists():
-            student_marks.remove(user_mark)
-
-        # limit marks, so marks > 100 can show on histogram
-        user_mark = min(user_mark, 100)
-        student_marks = numpy.clip(student_marks, 0, 100)
-
-        return user_mark, student_marks
+        return MarkDistribution.cap(user_mark), MarkDistribution.get()
 
     def generate_histograms(self):
         """generates histograms
 
         Returns:
-            tuple[list[int], list[int], list[int]]:
+            tuple[list[int], list[int], list[int], float]:
 
                 for first two list in tuple:
                     histogram of values using student and queried user's marks
 
-                last el in tuple:
+                third el in tuple:
                     histogram's bins in list form
+
+                last el in tuple:
+                    the queried user's percentile amongst the students
         """
-        user_mark, student_marks = self.get_datasets()
+        user_mark, distribution = self.get_datasets()
+        bins = MarkDistribution.BINS
 
-        # histogram length will be len(bin)-1, so bin length has to be self._BIN_SIZE+1
-        bins = numpy.arange(0, self._BINS * (self._BIN_WIDTH + 1) + 1, self._BIN_WIDTH)
-        student_histogram, _ = numpy.histogram(student_marks, bins=bins)
-        user_histogram, _ = numpy.histogram(user_mark, bins=bins)
+        user_histogram = numpy.zeros(len(bins) - 1, dtype=int)
+        user_histogram[distribution.bin_index(user_mark)] = 1
+        # only remove user's mark from student histogram if user is counted in the active sem
+        student_histogram = distribution.histogram.copy()
+        if self.user.id in distribution.marks:
+            student_histogram[distribution.bin_index(distribution.marks[self.user.id])] -= 1
 
-        return student_histogram, user_histogram, bins
+        return student_histogram, user_histogram, bins, distribution.percentile(user_mark)
 
     def get_json_data(self):
-        student_histogram, user_histogram, bins = self.generate_histograms()
+        student_histogram, user_histogram, bins, percentile = self.generate_histograms()
 
         # combine histogram
         student_histogram = numpy.add(student_histogram, user_histogram)
@@ -703,6 +695,7 @@ class Ajax_MarkDistributionChart(NonPublicOnlyViewMixin, View):
             'data': {
                 'user_id': user_id,  # int
                 'students': student_histogram,  # list[int]
+                'percentile': percentile,  # float
             }
         })
 
@@ -739,54 +732,7 @@ class Ajax_TagChart(NonPublicOnlyViewMixin, View):
                     list has 2 values, 0 or xp. list[index] == 0 means that quest doesn't have tag for user_tags[index].
                     If list[index] == quest.xp then quest has tag user_tags[index]
         """
-        submissions_queryset = get_quest_submission_by_tag(self.user, user_tags).order_by('quest_id', 'ordinal')
-
-        # use this to keep track of how much xp submission has
-        # since xp_earned can change if it does not meet the cut off
-        submissions_xp = submissions_queryset.annotate(xp_earned=Greatest('quest__xp', 'xp_requested')).values('id', 'xp_earned')
-        submissions_xp = {sub['id']: sub['xp_earned'] for sub in submissions_xp}  # convert to dict for easier access
-
-        # change xp_earned or remove submissions if they go over max_xp
-        quest_ids = submissions_queryset.filter(quest__max_xp__gt=-1).distinct('quest').values_list('quest', flat=True)
-        keep_submissions_id = []
-        for quest_id in quest_ids:
-
-            submissions_for_quest = submissions_queryset.filter(quest_id=quest_id)
-            current_xp_total = 0
-            for submission in submissions_for_quest:
-                keep_submissions_id.append(submission.id)
-
-                # change xp earned to match max_xp cutoff
-                # since all other sub after this will be 0 stop here
-                if submissions_xp[submission.id] + current_xp_total > submission.quest.max_xp:
-                    new_xp_amount = submission.quest.max_xp - current_xp_total
-                    submissions_xp[submission.id] = new_xp_amount
-                    break
-
-                current_xp_total += submissions_xp[submission.id]
-
-        # remove ids not in keep_submissions_id since they should have xp_earned of 0 anyway
-        # exception of quest__max_xp=-1 since they dont have max xp
-        submissions_queryset = submissions_queryset.filter(Q(quest__max_xp=-1) | Q(id__in=keep_submissions_id)).order_by('quest', 'ordinal')
-
-        # formats quest_queryset for chart.js
-        submission_dataset = []
-        for submission in submissions_queryset:
-            quest = submission.quest
-            quest_tags = quest.tags.all().values_list('name', flat=True)
-
-            # gets xp in all related to quest tags
-            xp_earned = submissions_xp[submission.id]
-            xp_in_tag = [xp_earned if tag in quest_tags else 0 for tag in user_tags]
-
-            # account for ordinal in name
-            name = quest.name
-            if submissions_queryset.filter(quest__id=quest.id).count() > 1:
-                name += f" ({submission.ordinal})"
-
-            submission_dataset.append({'name': name, 'dataset': xp_in_tag})
-
-        return submission_dataset
+        return UserTagXP.for_user(self.user).quest_dataset(user_tags)
 
     def get_badge_dataset(self, user_tags):
         """  Badge dataset for chart.js to use to display bar chart for badge objects
@@ -801,26 +747,7 @@ class Ajax_TagChart(NonPublicOnlyViewMixin, View):
                     list has 2 values, 0 or xp. list[index] == 0 means that badge doesn't have tag for user_tags[index].
                     If list[index] == badge.xp then badge has tag user_tags[index]
         """
-        # use assertions instead of badges so we can count for multiple of same assertion
-        assertion_queryset = get_badge_assertion_by_tags(self.user, user_tags).order_by('badge_id', 'ordinal')
-
-        # formats badge_queryset for chart.js
-        assertion_dataset = []
-        for assertion in assertion_queryset:
-            badge = assertion.badge
-            badge_tags = badge.tags.all().values_list('name', flat=True)
-
-            # gets xp in all related to badge tags
-            xp_in_tag = [badge.xp if tag in badge_tags else 0 for tag in user_tags]
-
-            # account for ordinal in name
-            name = badge.name
-            if assertion_queryset.filter(badge__id=badge.id).count() > 1:
-                name += f" ({assertion.ordinal})"
-
-            assertion_dataset.append({'name': name, 'dataset': xp_in_tag})
-
-        return assertion_dataset
+        return UserTagXP.for_user(self.user).badge_dataset(user_tags)
 
     def get_json_data(self):
         # get names from get_user_tags_and_xp to get it in order by tag xp
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class DjcytoscapeConfig(AppConfig):
     name = 'djcytoscape'
     verbose_name = "Quest Maps"
+
+    def ready(self):
+        import djcytoscape.signals  # noqa
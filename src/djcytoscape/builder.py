@@ -0,0 +1,437 @@
+from collections import defaultdict
+
+from django.contrib.contenttypes.models import ContentType
+from django.db.models import Sum
+from django.urls import reverse
+
+from prerequisites.evaluator import PrereqGraph
+from quest_manager.models import Quest
+
+from .models import CytoElement, CytoScape, TempCampaign
+
+
+class MapGraph(PrereqGraph):
+    """
+    The prerequisite graph plus every object that can be placed on a map, loaded with a handful of queries.
+    Maps built from it don't query per node, so share one between maps when regenerating more than one.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.objects = {}  # (content_type_id, object_id) -> object, for every parent of a Prereq
+
+        ids_by_ct = defaultdict(set)
+        for ct_id, object_id in self.parents:
+            ids_by_ct[ct_id].add(object_id)
+        for ct_id, object_ids in ids_by_ct.items():
+            model = ContentType.objects.get_for_id(ct_id).model_class()
+            if model is None:
+                continue
+            # The GFK uses the base manager, so archived quests etc. are loaded, and then left out as inactive
+            qs = model._base_manager.filter(id__in=object_ids)
+            if model is Quest:
+                qs = qs.select_related('campaign')
+            self.objects.update({(ct_id, obj.id): obj for obj in qs})
+
+        # Same quests as Quest.active, which would otherwise check expiry with a query per quest
+        self.active_quest_ids = set(Quest.objects.get_active().values_list('id', flat=True))
+
+        # Same sums as Category.xp_sum(), used in campaign labels
+        campaign_ids = {obj.campaign_id for obj in self.objects.values() if isinstance(obj, Quest) and obj.campaign_id}
+        current_quests = Quest.objects.get_queryset().visible().filter(campaign_id__in=campaign_ids)
+        self.campaign_xp = dict(
+            current_quests.order_by().values('campaign_id').annotate(xp_sum=Sum('xp')).values_list('campaign_id', 'xp_sum')
+        )
+
+    def related_selector_ids(self, keys):
+        """
+        The selector_ids of the nodes whose maps can change when any of the given objects change: the objects themselves,
+        and the objects they require as prerequisites (which a newly published quest, for example, would be added under).
+        :param keys: (content_type_id, object_id) of the changed objects
+        """
+        selector_ids = set()
+        for key in keys:
+            key = tuple(key)
+            required = self.leaf_terms(self.prereq_ids_for(*key))
+            for ct_id, object_id in [key] + [(term.content_type_id, term.object_id) for term in required]:
+                model = ContentType.objects.get_for_id(ct_id).model_class()
+                if model is not None:
+                    selector_ids.add(f"{model.__name__}: {object_id}")
+        return selector_ids
+
+    @staticmethod
+    def key(obj):
+        return ContentType.objects.get_for_model(obj).id, obj.id
+
+    def is_active(self, obj):
+        if isinstance(obj, Quest):
+            return obj.id in self.active_quest_ids
+        return getattr(obj, 'active', True)
+
+    def reliant_objects(self, obj):
+        """
+        The objects that require obj as a prereq, same as obj.get_reliant_objects(exclude_NOT=True, sort=True)
+        but without any queries.
+        """
+        key = self.key(obj)
+        parent_keys = set()
+        for prereq_id in self.reliant.get(key, ()):
+            for term in self.clauses[prereq_id]:
+                if term is not None and not term.invert and (term.content_type_id, term.object_id) == key:
+                    parent_keys.add(self.parent_of[prereq_id])
+
+        reliant_objects = [self.objects[parent_key] for parent_key in parent_keys if parent_key in self.objects]
+        return sorted((obj for obj in reliant_objects if self.is_active(obj)), key=str)
+
+    def has_complicated_prereqs(self, obj):
+        """ Same as obj.has_or_prereq() or obj.has_inverted_prereq() """
+        for prereq_id in self.prereq_ids_for(*self.key(obj)):
+            term, or_term = self.clauses[prereq_id]
+            if term.invert or or_term is not None:
+                return True
+        return False
+
+
+class MapBuilder:
+    """
+    Generates all the nodes and edges of a CytoScape in memory from a MapGraph, then saves them with bulk_create.
+
+    Nodes are keyed by their selector_id (or their classes and label for campaign and link nodes, which don't have one)
+    until they are saved, and the TempCampaigns used to fix up the campaign edges use these keys as node ids.
+
+    Usage:
+        MapBuilder(scape).build().save()  # a new map
+        MapBuilder(scape).build().update()  # an existing map
+    """
+
+    # the fields compared when updating a saved map
+    NODE_FIELDS = ['selector_id', 'label', 'classes', 'href', 'id_styles', 'is_transition']
+    EDGE_FIELDS = ['label', 'classes']
+
+    def __init__(self, scape, graph=None):
+        self.scape = scape
+        self.graph = graph or MapGraph()
+        self.nodes = {}  # key -> unsaved CytoElement
+        self.edges = {}  # (source key, target key) -> unsaved CytoElement
+        self.campaign_list = []  # TempCampaigns
+
+    @staticmethod
+    def node_key(node):
+        if node.selector_id:
+            return node.selector_id
+        return f"{node.classes}: {node.label}"
+
+    def build(self):
+        initial_object = self.scape.initial_content_object
+
+        # Create the starting node from the initial object, and a link back to the parent map if there is one
+        first_key = self.add_first_node(initial_object)
+
+        # Add nodes reliant on the first node, this is recursive and will generate all nodes until endpoints reached
+        self.add_reliant_nodes(initial_object, first_key)
+
+        # Add those funky edges for proper display of compound (parent) nodes in cyto dagre layout
+        self.fix_nonsequential_campaign_edges()
+        return self
+
+    def save(self):
+        """ Saves the nodes, then the nodes inside campaigns (which need their campaign's id), then the edges """
+        nodes = list(self.nodes.values())
+        CytoElement.objects.bulk_create([node for node in nodes if node.data_parent is None])
+        CytoElement.objects.bulk_create([node for node in nodes if node.data_parent is not None])
+        CytoElement.objects.bulk_create(list(self.edges.values()))
+
+    def update(self):
+        """
+        Applies the differences between the built elements and the elements already saved for this map, instead of
+        replacing them all: new elements are created, changed ones updated, and the ones no longer on the map deleted.
+        Elements are matched with the same keys used while building, so unchanged elements keep their ids.
+        :return: the number of elements created, updated or deleted
+        """
+        saved = list(CytoElement.objects.all_for_scape(self.scape))
+        saved_by_id = {element.id: element for element in saved}
+        saved_nodes = {}  # key -> saved node that is still on the map
+        saved_edges = {}  # (source key, target key) -> saved edge that is still on the map
+        stale = []
+
+        for element in saved:
+            if element.group == CytoElement.NODES:
+                key = self.node_key(element)
+                if key in self.nodes and key not in saved_nodes:
+                    saved_nodes[key] = element
+                else:
+                    stale.append(element)
+        for element in saved:
+            if element.group == CytoElement.EDGES:
+                source = saved_by_id.get(element.data_source_id)
+                target = saved_by_id.get(element.data_target_id)
+                key = (self.node_key(source), self.node_key(target)) if source and target else None
+                if (key in self.edges and key not in saved_edges
+                        and saved_nodes.get(key[0]) is source and saved_nodes.get(key[1]) is target):
+                    saved_edges[key] = element
+                else:
+                    stale.append(element)
+
+        # the built nodes, or the saved nodes they match
+        nodes = {key: saved_nodes.get(key, node) for key, node in self.nodes.items()}
+
+        def parent(key):
+            built_parent = self.nodes[key].data_parent
+            return nodes[self.node_key(built_parent)] if built_parent is not None else None
+
+        # Nodes outside of campaigns first, then the nodes inside them, which need their campaign's id
+        new_nodes = [(key, node) for key, node in self.nodes.items() if key not in saved_nodes]
+        for in_campaign in [False, True]:
+            batch = [node for key, node in new_nodes if (self.nodes[key].data_parent is not None) == in_campaign]
+            for node in batch:
+                node.data_parent = parent(self.node_key(node))
+            CytoElement.objects.bulk_create(batch)
+
+        changed_nodes = []
+        for key, node in saved_nodes.items():
+            built = self.nodes[key]
+            new_parent = parent(key)
+            changed = [field for field in self.NODE_FIELDS if getattr(node, field) != getattr(built, field)]
+            if node.data_parent_id != (new_parent.id if new_parent else None):
+                node.data_parent = new_parent
+                changed.append('data_parent')
+            if changed:
+                for field in changed:
+                    if field != 'data_parent':
+                        setattr(node, field, getattr(built, field))
+                changed_nodes.append(node)
+        CytoElement.objects.bulk_update(changed_nodes, self.NODE_FIELDS + ['data_parent'])
+
+        new_edges = []
+        changed_edges = []
+        for key, built in self.edges.items():
+            edge = saved_edges.get(key)
+            if edge is None:
+                built.data_source = nodes[key[0]]
+                built.data_target = nodes[key[1]]
+                new_edges.append(built)
+            elif any(getattr(edge, field) != getattr(built, field) for field in self.EDGE_FIELDS):
+                for field in self.EDGE_FIELDS:
+                    setattr(edge, field, getattr(built, field))
+                changed_edges.append(edge)
+        CytoElement.objects.bulk_create(new_edges)
+        CytoElement.objects.bulk_update(changed_edges, self.EDGE_FIELDS)
+
+        # last, so nodes moved to a new campaign aren't deleted along with their old one
+        if stale:
+            CytoElement.objects.filter(id__in=[element.id for element in stale]).delete()
+
+        return len(new_nodes) + len(changed_nodes) + len(new_edges) + len(changed_edges) + len(stale)
+
+    def get_or_create_node(self, **kwargs):
+        """ :return: the key of the node with these fields, and whether it was created """
+        node = CytoElement(scape=self.scape, group=CytoElement.NODES, **kwargs)
+        key = self.node_key(node)
+        created = key not in self.nodes
+        if created:
+            self.nodes[key] = node
+        return key, created
+
+    def get_or_create_edge(self, source_key, target_key, **kwargs):
+        if (source_key, target_key) not in self.edges:
+            self.edges[(source_key, target_key)] = CytoElement(
+                scape=self.scape,
+                group=CytoElement.EDGES,
+                data_source=self.nodes[source_key],
+                data_target=self.nodes[target_key],
+                **kwargs
+            )
+
+    def delete_edge(self, source_key, target_key):
+        self.edges.pop((source_key, target_key), None)
+
+    def add_first_node(self, obj):
+        """ Adds the first node from `obj`, then if this map has a parent, adds an additional node to link back to the
+        parent scape/map.  Returns the first node's key."""
+        first_key, _ = self.add_object_node(obj, initial_node=True)
+
+        if self.scape.parent_scape:
+            # the node to link to the parent map
+            parent_key, _ = self.get_or_create_node(
+                label=f"{self.scape.parent_scape.name} Quest Map",
+                href=reverse('maps:quest_map', args=[self.scape.parent_scape.id]),
+                classes='link parent-map',
+            )
+
+            # link them together with an edge
+            self.get_or_create_edge(parent_key, first_key)
+
+        return first_key
+
+    def add_object_node(self, obj, initial_node=False):
+        """ Gets or adds the node representing obj (a quest, badge, etc.).  Returns its key and whether it was created """
+        key = CytoElement.generate_selector_id(obj)
+        created = False
+        if key not in self.nodes:
+            # check for an icon
+            if hasattr(obj, 'get_icon_url'):
+                img_url = obj.get_icon_url()
+            else:
+                img_url = "none"
+
+            key, created = self.get_or_create_node(
+                selector_id=key,
+                label=CytoScape.generate_label(obj),
+                id_styles="'background-image': '" + img_url + "'",
+                classes=type(obj).__name__,
+                href=obj.get_absolute_url(),
+                is_transition=getattr(obj, 'map_transition', False),
+            )
+
+        # if this is a transition node (to a new map), format it and link it.
+        node = self.nodes[key]
+        if not initial_node and self.scape.is_transition_node(node):
+            node.convert_to_transition_node(obj, self.scape, commit=False)
+
+        return key, created
+
+    def get_temp_campaign(self, campaign_key) -> TempCampaign:
+        for campaign in self.campaign_list:
+            if campaign.node_id == campaign_key:
+                return campaign
+        return None
+
+    def add_to_campaign(self, obj, target_key, source_key):
+        """
+        Checks if obj is in a campaign, if so, gets or creates the campaign node (Parent/compound node)
+        and adds it as the parent (compound) node.  Also registers the target and source nodes with the TempCampaign
+        (for edges later)
+        :param obj: the django object currently being processed, represented by the target node
+        :param target_key: node of the reliant object, obj
+        :param source_key: node representing the target node's prereq
+        :return: campaign = None if obj isn't part of a campaign, the campaign's node key, and
+        campaign_created = False if obj is in campaign, but the campaign was created by an earlier node
+        """
+        campaign = getattr(obj, 'campaign', None)
+        if campaign is None:
+            return None, None, False
+
+        # Create a node for this campaign (or get it if it already exists)
+        campaign_key, campaign_created = self.get_or_create_node(
+            label=CytoScape.generate_label(campaign, xp_sum=self.graph.campaign_xp.get(campaign.id)),
+            classes="campaign",
+        )
+
+        # Add a parent (i.e. campaign) to the target node (to form a compound node)
+        self.nodes[target_key].data_parent = self.nodes[campaign_key]
+
+        # TempCampaign utility for cleaning up the edges and making the resulting map look good, after the entire map is built
+        if campaign_created:
+            self.campaign_list.append(TempCampaign(campaign_key))
+        self.get_temp_campaign(campaign_key).add_node(target_key, source_key)
+
+        return campaign, campaign_key, campaign_created
+
+    def add_reliant_nodes(self, source_obj, source_key):
+        """ Recursively connect nodes together with edges.  Starts at the top and works down through all objects
+        that rely on the source_obj as a prerequisite.
+
+        source_obj: the current django object being processed (could be any mappable prerequisite, such as a Quest, Badge, or Campaign)
+        source_key: the key of the node representing the source_obj
+
+        Other names:
+        parent node is confusing, but refers to the compound nodes that group other nodes together (i.e. campaigns)
+        In graph terms these are called parent nodes or compound nodes
+
+        target nodes are nodes created from reliant objects (objects that rely on the source_obj as a prerequisite)
+        """
+        source_node = self.nodes[source_key]
+
+        for obj in self.graph.reliant_objects(source_obj):
+            # create or get the node represented by the reliant object
+            target_key, node_created = self.add_object_node(obj)
+
+            # if source node is in a compound node (has a parent / campaign), add target node as a reliant in the temp_campaign
+            if source_node.data_parent is not None:
+                self.get_temp_campaign(self.node_key(source_node.data_parent)).add_reliant(source_key, target_key)
+
+            # if the source node is ITSELF a campaign (parent of a compound node)
+            if source_node.classes == "campaign":
+                self.get_temp_campaign(source_key).add_campaign_reliant(target_key)
+
+            # add new node to a campaign/compound/parent, if required
+            campaign_obj, campaign_key, campaign_created = self.add_to_campaign(obj, target_key, source_key)
+
+            # If this is the first time this campaign has been encountered, then check if IT has any reliant objects
+            if campaign_created:
+                self.add_reliant_nodes(campaign_obj, campaign_key)
+
+            # add a class to alternate prerequisites edges so they can be styled differently if desired
+            if self.graph.has_complicated_prereqs(obj):
+                self.get_or_create_edge(source_key, target_key, classes='complicated-prereqs')
+            else:
+                self.get_or_create_edge(source_key, target_key)
+
+            # If repeatable, also add circular edge
+            max_repeats = getattr(obj, 'max_repeats', 0)
+            if max_repeats != 0:
+                label = '∞' if max_repeats < 0 else 'x' + str(max_repeats)
+                self.get_or_create_edge(target_key, target_key, label=label, classes='repeat-edge')
+
+            # recursive, continue adding if this is a new node, and not a closing node
+            if node_created and not self.scape.is_transition_node(self.nodes[target_key]):
+                self.add_reliant_nodes(obj, target_key)
+
+    def fix_nonsequential_campaign_edges(self):
+        """
+        cyto dagre layout doesn't support compound/parent nodes, so for non-sequential/non-directed campaigns
+        (i.e. all quests are available concurrently) we need to:
+         1. add invisible edges joining the quests
+         2. remove edges between common prereqs and quests
+         3. add edges between common prereqs and campaign/compound/parent node
+         4. add invisible edge (for structure) from prereqs to first node
+         5. (deprecated) remove edges between quests and common reliants
+         6. (deprecated) add edges between campaign/compound/parent node and common reliants
+         7. (deprecated) add invisible edge (for structure) from last node to common reliants
+         8. add invisible edge (for structure) from last node to campaign reliants
+        """
+        for campaign in self.campaign_list:
+
+            last_node = campaign.get_last_node()
+
+            common_prereq_ids = campaign.get_common_prereq_node_ids()
+            if common_prereq_ids:  # then non-sequential campaign
+
+                # 1. add invisible edges joining the quests
+                for current_node in campaign.nodes:
+                    next_node = campaign.get_next_node(current_node)
+                    if next_node:
+                        self.get_or_create_edge(current_node.id, next_node.id, classes='hidden')
+
+                first_node = campaign.get_first_node()
+                for prereq_node_id in common_prereq_ids:
+
+                    # 2. remove edges between common prereqs and quests
+                    for quest_node in campaign.nodes:
+                        if prereq_node_id in quest_node.prereq_node_ids:
+                            self.delete_edge(prereq_node_id, quest_node.id)
+
+                    # 3. add edges between common prereqs and campaign/compound/parent node
+                    self.get_or_create_edge(prereq_node_id, campaign.node_id)
+
+                    # 4. add invisible edge (for structure) from prereqs to first node
+                    self.get_or_create_edge(prereq_node_id, first_node.id, classes='hidden')
+
+                # TODO this should no longer be required now that Campaigns can be set as prerequisites
+                # TODO but will break old maps / prereq setups if removed
+                for reliant_node_id in campaign.get_common_reliant_node_ids():
+
+                    # 5 remove edges between quests and common reliants
+                    for quest_node in campaign.nodes:
+                        if reliant_node_id in quest_node.reliant_node_ids:
+                            self.delete_edge(quest_node.id, reliant_node_id)
+
+                    # 6. add edges between campaign/compound/parent node and common reliants
+                    self.get_or_create_edge(campaign.node_id, reliant_node_id)
+
+                    # 7. add invisible edge (for structure) from last node to reliants
+                    self.get_or_create_edge(last_node.id, reliant_node_id, classes='hidden')
+
+            # 8. add invisible edge (for structure) from last node to campaign reliants
+            for reliant_node_id in campaign.campaign_reliant_node_ids:
+                self.get_or_create_edge(last_node.id, reliant_node_id, classes='hidden')
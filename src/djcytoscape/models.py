@@ -9,7 +9,6 @@ from django.contrib.contenttypes.models import ContentType
 from django.core.exceptions import ObjectDoesNotExist
 from django.urls import reverse
 from django.db import models
-from django.shortcuts import get_object_or_404
 from django.utils import timezone
 
 from url_or_relative_url_field.fields import URLOrRelativeURLField
@@ -201,14 +200,15 @@ class CytoElement(models.Model):
     def json(self):
         return json.dumps(self.json_dict())
 
-    def convert_to_transition_node(self, obj, scape):
+    def convert_to_transition_node(self, obj, scape, commit=True):
         """ If this obj is a transition node (to a new map), convert it."""
         ct = ContentType.objects.get_for_model(obj)
 
         self.href = reverse('maps:quest_map_interlink', args=[ct.id, obj.id, scape.id])
         self.classes = "link child-map"
         self.is_transition = True
-        self.save()
+        if commit:
+            self.save()
 
     @staticmethod
     def generate_selector_id(obj):
@@ -457,6 +457,16 @@ class CytoScapeManager(models.Manager):
 
         return self.get_queryset().filter(id__in=related_ids)
 
+    def get_maps_containing(self, selector_ids, campaigns=False):
+        """ returns all CytoScape maps with a node for any of the selector_ids as a queryset,
+        plus every map with a campaign node if campaigns is True """
+        q = models.Q(selector_id__in=selector_ids)
+        if campaigns:
+            q |= models.Q(classes="campaign")
+
+        related_ids = CytoElement.objects.filter(group=CytoElement.NODES).filter(q).values_list('scape__id', flat=True)
+        return self.get_queryset().filter(id__in=related_ids)
+
 
 class CytoScape(models.Model):
     ALLOWED_INITIAL_CONTENT_TYPES = models.Q(app_label='quest_manager', model='quest') | \
@@ -566,7 +576,8 @@ class CytoScape(models.Model):
         self.save()
 
     @staticmethod
-    def generate_label(obj):
+    def generate_label(obj, xp_sum=None):
+        """ xp_sum: the campaign's Category.xp_sum() if obj is a campaign and it has already been calculated """
         # set max label length in characters
         # object labels with large xp values require a shorter name length so all values when combined comply with max label length
         if hasattr(obj, 'xp'):
@@ -593,7 +604,9 @@ class CytoScape(models.Model):
                 plus = ""
             post = f" ({str(obj.xp)}{plus})"
         elif type(obj) is Category:
-            post = f" ({str(obj.xp_sum())} XP)"
+            if xp_sum is None:
+                xp_sum = obj.xp_sum()
+            post = f" ({str(xp_sum)} XP)"
 
         # if hasattr(obj, 'max_repeats'): # stop trying to be fancy!
         #     if obj.max_repeats != 0:
@@ -604,360 +617,6 @@ class CytoScape(models.Model):
         title = title.replace('"', '\\"')
         return title + post
 
-    def get_last_node_in_campaign(self, parent_node, offset=0):
-        """
-        :param offset: offset from last node by this (i.e. 1 --> second last node)
-        :param parent_node: the compound node/parent, i.e. campaign
-        :return: the most recent node added to the campaign (added to the compound/parent node) by using the highest id
-        """
-        try:
-            # latest normally used with dates, but actually works with other fields too!
-            # return CytoElement.objects.all_for_campaign(self, parent_node).latest('id')
-            qs = CytoElement.objects.all_for_campaign(self, parent_node).order_by('-id')
-            return qs[offset]
-        except self.DoesNotExist:
-            return None
-
-    def create_first_node(self, obj):
-        """ Creates the first node from `obj`, then if this map has a parent, creates an aditiona node to link back to back to the parent scape/map.
-        Returns the first node."""
-
-        # the initial node in this map
-        first_node, _ = self.create_node_from_object(obj, initial_node=True)
-
-        if self.parent_scape:
-            # the node to link to the parent map
-            parent_node, _ = CytoElement.objects.get_or_create(
-                scape=self,
-                group=CytoElement.NODES,
-                label=f"{self.parent_scape.name} Quest Map",
-                href=reverse('maps:quest_map', args=[self.parent_scape.id]),
-                classes='link parent-map'
-            )
-
-            # link them together with an edge
-            CytoElement.objects.get_or_create(
-                scape=self,
-                group=CytoElement.EDGES,
-                data_source=parent_node,
-                data_target=first_node,
-            )
-
-        return first_node
-
-    def create_child_map_node(self, obj, data_source):
-        """ If this obj is a transition node (to a new map, make a node to link to the next map"""
-        ct = ContentType.objects.get_for_model(obj)
-        # obj = ct.get_object_for_this_type(id=obj.id)
-
-        child_map_qs = CytoScape.objects.filter(initial_content_type=ct.id, initial_object_id=obj.id)
-        if child_map_qs.exists():
-            child_map = child_map_qs[0]
-            label = f"{child_map.name} Map"
-        else:
-            label = "The Void"
-
-        child_map_node, _ = CytoElement.objects.get_or_create(
-            scape=self,
-            group=CytoElement.NODES,
-            label=label,
-            href=reverse('maps:quest_map_interlink', args=[ct.id, obj.id, self.id]),  # <content_type_id>, <object_id>, <originating_scape_id>
-            classes="link child-map",
-        )
-
-        # link them together with an edge
-        CytoElement.objects.get_or_create(
-            scape=self,
-            group=CytoElement.EDGES,
-            data_source=data_source,
-            data_target=child_map_node,
-        )
-
-        return child_map_node
-
-    def create_node_from_object(self, obj, initial_node=False):
-        # If node node doesn't exist already, create a new one
-
-        # check for an icon
-        if hasattr(obj, 'get_icon_url'):
-            img_url = obj.get_icon_url()
-        else:
-            img_url = "none"
-
-        # check for map transition
-        map_transition = False
-        if hasattr(obj, 'map_transition'):
-            map_transition = obj.map_transition
-
-        new_node, created = CytoElement.objects.get_or_create(
-            scape=self,
-            group=CytoElement.NODES,
-            selector_id=CytoElement.generate_selector_id(obj),
-            label=self.generate_label(obj),
-            defaults={
-                      'id_styles': "'background-image': '" + img_url + "'",
-                      'classes': type(obj).__name__,
-                      'href': obj.get_absolute_url(),
-                      'is_transition': map_transition,
-                     }
-        )
-
-        # if this is a transition node (to a new map), format it and link it.
-        if not initial_node and self.is_transition_node(new_node):
-            new_node.convert_to_transition_node(obj, self)
-
-        return new_node, created
-
-    def init_temp_campaign_list(self):
-        """
-        Create a new member variable `campaign_list` or clear it if it already exists
-        """
-        self.campaign_list = []
-
-    def get_temp_campaign(self, campaign_id) -> TempCampaign:
-        for campaign in self.campaign_list:
-            try:
-                if campaign.node_id == campaign_id:
-                    return campaign
-            except ValueError:
-                pass
-        return None
-
-    def add_to_campaign(self, obj, target_node, source_node):
-        """
-        Checks if obj is in a campaign, if so, gets or creates the campaign_node (Parent/compound node)
-        and adds it as the parent (compound) node.  Also registers the target_node and source_node with the TempCampaign (for edges later)
-        :param source_node: node representing the target_node's prereq
-        :param obj: the django object currently being processed, represented by the target_node
-        :param target_node: node of the reliant object, obj
-        :return: campaign_node = None if obj isn't part of a campaign, otherwise = the campaign_node (i.e. parent_node)
-        campaign_created = False if obj is in campaign, but the campaign was created by an earlier node
-        """
-        # If part of a campaign, create parent and add to "parent" node, i.e. compound node
-        campaign_node = None
-        campaign = None
-        campaign_created = False
-
-        # Check if the obj has a campaign attribute, currently only Quest objects have this, but obj could be a Badge or other prereq model
-        if hasattr(obj, 'campaign') and obj.campaign is not None:
-            campaign = obj.campaign
-
-            # Create a node for this campaign (or get it if it already exists)
-            campaign_node, campaign_created = CytoElement.objects.get_or_create(
-                scape=self,
-                group=CytoElement.NODES,
-                label=CytoScape.generate_label(obj.campaign),
-                classes="campaign",
-                # defaults={'attribute': value},
-            )
-
-            # Add a parent (i.e. campaign) to the target node (to form a compound node)
-            target_node.data_parent = campaign_node
-            target_node.save()
-
-            # TempCampaign utility for cleaning up the edges and making the resulting map look good, after the entire map is built
-            if campaign_created:
-                self.campaign_list.append(TempCampaign(campaign_node.id))
-            temp_campaign = self.get_temp_campaign(campaign_node.id)  # not a Django model, so custom method
-
-            # TODO: Nodes might be present multiple times through different source nodes?  check and combine
-            temp_campaign.add_node(target_node.id, source_node.id)
-
-        return campaign, campaign_node, campaign_created
-
-    def fix_nonsequential_campaign_edges(self):
-        """
-        cyto dagre layout doesn't support compound/parent nodes, so for non-sequential/non-directed campaigns
-        (i.e. all quests are available concurrently) we need to:
-         1. add invisible edges joining the quests
-         2. remove edges between common prereqs and quests
-         3. add edges between common prereqs and campaign/compound/parent node
-         4. add invisible edge (for structure) from prereqs to first node
-         5. (deprecated) remove edges between quests and common reliants
-         6. (deprecated) add edges between campaign/compound/parent node and common reliants
-         7. (deprecated) add invisible edge (for structure) from last node to common reliants
-         8. add invisible edge (for structure) from last node to campaign reliants
-        """
-
-        for campaign in self.campaign_list:
-
-            last_node = campaign.get_last_node()
-
-            common_prereq_ids = campaign.get_common_prereq_node_ids()
-            if common_prereq_ids:  # then non-sequential campaign
-
-                # 1. add invisible edges joining the quests
-                for current_node in campaign.nodes:
-                    next_node = campaign.get_next_node(current_node)
-                    if next_node:
-                        CytoElement.objects.get_or_create(
-                            scape=self,
-                            group=CytoElement.EDGES,
-                            data_source_id=current_node.id,
-                            data_target_id=next_node.id,
-                            defaults={'classes': 'hidden', },
-                        )
-
-                first_node = campaign.get_first_node()
-                for prereq_node_id in common_prereq_ids:
-
-                    # 2. remove edges between common prereqs and quests
-                    for quest_node in campaign.nodes:
-                        # we already know all quests have this prereq node in common, so the edges should all exist
-                        # unless quest has internal prereq...
-                        if prereq_node_id in quest_node.prereq_node_ids:
-                            edge_node = get_object_or_404(CytoElement,
-                                                          data_source_id=prereq_node_id,
-                                                          data_target_id=quest_node.id)
-                            edge_node.delete()
-
-                    # 3. add edges between common prereqs and campaign/compound/parent node
-                    CytoElement.objects.get_or_create(
-                        scape=self,
-                        group=CytoElement.EDGES,
-                        data_source_id=prereq_node_id,
-                        data_target_id=campaign.node_id,
-                        # defaults={'attribute': value},
-                    )
-
-                    # 4. add invisible edge (for structure) from prereqs to first node
-                    CytoElement.objects.get_or_create(
-                        scape=self,
-                        group=CytoElement.EDGES,
-                        data_source_id=prereq_node_id,
-                        data_target_id=first_node.id,
-                        defaults={'classes': 'hidden', }
-                    )
-
-                # TODO this should no longer be required now that Campaigns can be set as prerequisites
-                # TODO but will break old maps / prereq setups if removed
-                reliant_node_ids = campaign.get_common_reliant_node_ids()
-                if reliant_node_ids:
-                    for reliant_node_id in reliant_node_ids:
-
-                        # 5 remove edges between quests and common reliants
-                        for quest_node in campaign.nodes:
-                            # we already know all quests have this reliant node in common, so the edges should all exist
-                            # unless it has an internal reliant...
-                            if reliant_node_id in quest_node.reliant_node_ids:
-                                edge_node = get_object_or_404(CytoElement,
-                                                              data_source_id=quest_node.id,
-                                                              data_target_id=reliant_node_id)
-                                edge_node.delete()
-
-                        # 6. add edges between campaign/compound/parent node and common reliants
-                        CytoElement.objects.get_or_create(
-                            scape=self,
-                            group=CytoElement.EDGES,
-                            data_source_id=campaign.node_id,
-                            data_target_id=reliant_node_id,
-                            # defaults={'attribute': value},
-                        )
-
-                        # 7. add invisible edge (for structure) from last node to reliants
-                        CytoElement.objects.get_or_create(
-                            scape=self,
-                            group=CytoElement.EDGES,
-                            data_source_id=last_node.id,
-                            data_target_id=reliant_node_id,
-                            defaults={'classes': 'hidden', }
-                            # defaults={'attribute': value},
-                        )
-
-            # 8. add invisible edge (for structure) from last node to campaign reliants
-            # TODO actually add nodes to the campaign_reliant_nodes_ids list!!!!
-            for reliant_node_id in campaign.campaign_reliant_node_ids:
-                CytoElement.objects.get_or_create(
-                    scape=self,
-                    group=CytoElement.EDGES,
-                    data_source_id=last_node.id,
-                    data_target_id=reliant_node_id,
-                    defaults={'classes': 'hidden', }
-                    # defaults={'attribute': value},
-                )
-
-    def find_reliant_objects_and_add_target_nodes(self, source_obj, source_node: CytoElement):
-        """ Recursivly connect nodes together with edges.  Starts at the top and works down through all objects
-        that rely on the source_obj as a prerequisite.
-
-        source_obj: the current django object being processed (could be any mappable prerequisite, such as a Quest, Badge, or Campaign)
-        source_node: the cytoscape node representing the source_obj
-
-        Other names:
-        parent node is confusing, but refers to the compound nodes that group other nodes together (i.e. campaigns)
-        variables with names such as data_parent, parent_node, etc, are Campaigns that a quest might be in.
-        In graph terms these are called parent nodes or compound nodes
-
-        target_nodes are nodes created from reliant objects (objects that rely on the source_obj as a prerequisite)
-        """
-        reliant_objects = source_obj.get_reliant_objects(exclude_NOT=True, sort=True)
-
-        for obj in reliant_objects:
-            # source_node
-            #  > reliant obj1 (target node 1)
-            #  > reliant obj2 (target node 2)
-            #  > ...
-
-            # create or get the node represented by the reliant object
-            target_node, node_created = self.create_node_from_object(obj)
-
-            # if source node is in a compound node (has a parent / campaign), add target_node as a reliant in the temp_campaign
-            if source_node.data_parent:
-                temp_campaign: TempCampaign = self.get_temp_campaign(source_node.data_parent.id)
-                temp_campaign.add_reliant(source_node.id, target_node.id)
-
-            # if the source node is ITSELF a campaign (parent of a compound node)
-            if source_node.is_parent():
-                temp_campaign: TempCampaign = self.get_temp_campaign(source_node.id)
-                temp_campaign.add_campaign_reliant(target_node.id)
-
-            # add new_node to a campaign/compound/parent, if required
-            campaign_obj, campaign_node, campaign_node_created = self.add_to_campaign(obj, target_node, source_node)
-
-            # If this is the first time this campaign has been encountered, then check if IT has any reliant objects
-            if campaign_node_created:
-                self.find_reliant_objects_and_add_target_nodes(campaign_obj, campaign_node)
-                # these nodes need to be added to the temp_campaigncampaign_reliant_node_ids for later cleanup
-
-            # add a class to alternate prerequisites edges so they can be styled differently if desired
-            if obj.has_or_prereq() or obj.has_inverted_prereq():
-                # add "alternate" class
-                defaults = {'classes': 'complicated-prereqs'}
-            else:
-                defaults = {}
-
-            # TODO: should add number of times prereq is required, similar to repeat edges below
-            CytoElement.objects.get_or_create(
-                scape=self,
-                group=CytoElement.EDGES,
-                data_source=source_node,
-                data_target=target_node,
-                defaults=defaults,
-            )
-
-            # If repeatable, also add circular edge
-            if hasattr(obj, 'max_repeats'):
-                if obj.max_repeats != 0:
-                    if obj.max_repeats < 0:
-                        label = '∞'
-                    else:
-                        label = 'x' + str(obj.max_repeats)
-
-                    CytoElement.objects.get_or_create(
-                        scape=self,
-                        group=CytoElement.EDGES,
-                        data_source=target_node,
-                        data_target=target_node,
-                        defaults={
-                            'label': label,
-                            'classes': 'repeat-edge',
-                        },
-                    )
-
-            # recursive, continue adding if this is a new node, and not a closing node
-            if node_created and not self.is_transition_node(target_node):
-                self.find_reliant_objects_and_add_target_nodes(obj, target_node)
-
     def is_transition_node(self, node: CytoElement):
         """ A transition node represents an obj.map_transition attribute set to True (saved in node.is_transition_)
         DEPRECATED: Also return True if node.label begins with the tilde '~' or contains an astrix '*'
@@ -984,29 +643,36 @@ class CytoScape(models.Model):
         scape.calculate_nodes()
         return scape
 
-    def calculate_nodes(self,):
+    def calculate_nodes(self, graph=None):
+        """ Generates all the nodes and edges of this map in memory, then saves them in bulk.
+        graph: a djcytoscape.builder.MapGraph, pass one in to share it between maps when generating several """
+        from djcytoscape.builder import MapBuilder
 
-        # Create the starting node from the initial quest, and a link back to the parent map if there is one
-        first_node = self.create_first_node(self.initial_content_object)
+        MapBuilder(self, graph).build().save()
+        self.last_regeneration = timezone.now()
+        self.update_cache()
 
-        # Temp campaign list used to track funky edges required for compound nodes to display properly with dagre
-        self.init_temp_campaign_list()
+    def update_elements(self, graph=None):
+        """ Brings the saved nodes and edges up to date with the current prerequisites, only creating, updating or
+        deleting the elements that differ instead of regenerating the whole map.
+        :return: the number of elements that changed """
+        from djcytoscape.builder import MapBuilder
 
-        # Add nodes reliant on the first_node, this is recursive and will generate all nodes until endpoints reached
-        # Endpoints... not sure yet, but probably quests starting with '~' tilde character, or add a new field?
-        self.find_reliant_objects_and_add_target_nodes(self.initial_content_object, first_node)
+        if self.initial_content_object is None:
+            self.delete()
+            raise (self.InitialObjectDoesNotExist)
 
-        # Add those funky edges for proper display of compound (parent) nodes in cyto dagre layout
-        self.fix_nonsequential_campaign_edges()
-        self.last_regeneration = timezone.now()
-        self.update_cache()
-        self.save()
+        changed = MapBuilder(self, graph).build().update()
+        if changed:
+            self.last_regeneration = timezone.now()
+            self.update_cache()
+        return changed
 
-    def regenerate(self):
+    def regenerate(self, graph=None):
         if self.initial_content_object is None:
             self.delete()
             raise (self.InitialObjectDoesNotExist)
 
         # Delete existing nodes
         CytoElement.objects.all_for_scape(self).delete()
-        self.calculate_nodes()
+        self.calculate_nodes(graph)
@@ -0,0 +1,29 @@
+from django.contrib.contenttypes.models import ContentType
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from badges.models import Badge
+from prerequisites.models import Prereq
+from quest_manager.models import Category, Quest
+
+from .tasks import update_maps_for_objects
+
+
+@receiver([post_save, post_delete], sender=Quest, dispatch_uid="djcytoscape.signals.update_maps_for_quest")
+@receiver([post_save, post_delete], sender=Badge, dispatch_uid="djcytoscape.signals.update_maps_for_badge")
+@receiver([post_save, post_delete], sender=Category, dispatch_uid="djcytoscape.signals.update_maps_for_campaign")
+def update_maps_for_object(sender, instance, *args, **kwargs):
+    """ Keep the maps showing a quest, badge or campaign (or the prereqs of a quest or badge) up to date when it changes """
+    update_maps_for_objects.apply_async(args=[[[ContentType.objects.get_for_model(instance).id, instance.id]]], queue='default')
+
+
+@receiver([post_save, post_delete], sender=Prereq, dispatch_uid="djcytoscape.signals.update_maps_for_prereq")
+def update_maps_for_prereq(sender, instance, *args, **kwargs):
+    """ A Prereq adds an edge from each of its prerequisite objects to its parent, so update the maps with any of them """
+    changed_objects = [
+        [instance.parent_content_type_id, instance.parent_object_id],
+        [instance.prereq_content_type_id, instance.prereq_object_id],
+    ]
+    if instance.or_prereq_content_type_id and instance.or_prereq_object_id:
+        changed_objects.append([instance.or_prereq_content_type_id, instance.or_prereq_object_id])
+    update_maps_for_objects.apply_async(args=[changed_objects], queue='default')
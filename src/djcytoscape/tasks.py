@@ -1,10 +1,15 @@
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
 
 from hackerspace_online.celery import app
 
 from notifications.signals import notify
+from prerequisites.tasks import TransactionAwareTask
+from quest_manager.models import Category
 from siteconfig.models import SiteConfig
 
+from .builder import MapGraph
 from .models import CytoScape
 
 User = get_user_model()
@@ -13,9 +18,11 @@ User = get_user_model()
 @app.task(name='djcytoscape.tasks.regenerate_all_maps')
 def regenerate_all_maps(requesting_user_id):
     requesting_user = User.objects.get(id=requesting_user_id)
+    # load the prerequisite graph once for all the maps
+    graph = MapGraph()
     for scape in CytoScape.objects.all():
         try:
-            scape.regenerate()
+            scape.regenerate(graph)
         except scape.InitialObjectDoesNotExist:
             notify.send(
                 SiteConfig.get().deck_ai,
@@ -32,3 +39,33 @@ def regenerate_all_maps(requesting_user_id):
         icon="<i class='fa fa-lg fa-fw fa-map-signs text-success'></i>",
         verb="completed regeneration of all valid maps."
     )
+
+
+@app.task(base=TransactionAwareTask, bind=True, name='djcytoscape.tasks.update_maps_for_objects', max_retries=settings.CELERY_TASK_MAX_RETRIES, coalesce=True, merge_first_arg=True)  # noqa
+def update_maps_for_objects(self, changed_objects):
+    """Updates the maps that can be affected by changes to some quests, badges, campaigns or Prereqs, by applying
+    only the differences (see CytoScape.update_elements()) instead of regenerating them.
+
+    The calls made while one is waiting in the queue are merged into it (see TransactionAwareTask.merge_first_arg), so a
+    burst of changes, e.g. reordering quests or an admin action on many of them, only builds the MapGraph once.
+
+    Args:
+        changed_objects (list): [content_type_id, object_id] pairs of the changed objects, for a Prereq: its parent
+            and prerequisite objects
+
+    Returns:
+        dict: {'maps': number of maps checked, 'changed': number of elements created, updated or deleted}
+    """
+    graph = MapGraph()
+    selector_ids = graph.related_selector_ids(changed_objects)
+    category_content_type_id = ContentType.objects.get_for_model(Category).id
+    campaigns = any(content_type_id == category_content_type_id for content_type_id, _ in changed_objects)
+
+    report = {'maps': 0, 'changed': 0}
+    for scape in CytoScape.objects.get_maps_containing(selector_ids, campaigns=campaigns):
+        try:
+            report['changed'] += scape.update_elements(graph)
+        except scape.InitialObjectDoesNotExist:
+            continue
+        report['maps'] += 1
+    return report
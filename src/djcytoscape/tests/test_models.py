@@ -1,15 +1,22 @@
 import json
+from unittest.mock import patch
 
 from django.core.exceptions import ValidationError
 from django.contrib.auth import get_user_model
 from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.db import connection
 from django.test import SimpleTestCase
+from django.test.utils import CaptureQueriesContext
 
 from django_tenants.test.cases import TenantTestCase
 from model_bakery import baker
 
 # from siteconfig.models import SiteConfig
+from djcytoscape.builder import MapBuilder, MapGraph
 from djcytoscape.models import CytoElement, CytoScape, TempCampaign, TempCampaignNode, clean_JSON
+from djcytoscape.tasks import update_maps_for_objects
+from prerequisites.models import Prereq
 from quest_manager.models import Quest, Category
 
 # from django_tenants.test.client import TenantClient
@@ -354,3 +361,154 @@ class CytoScapeModelTest(JSONTestCaseMixin, TenantTestCase):
         self.assertEqual(CytoScape.objects.get_related_maps(self.no_maps).count(), 0)
         self.assertEqual(CytoScape.objects.get_related_maps(self.one_map).count(), 1)
         self.assertEqual(CytoScape.objects.get_related_maps(self.all_maps).count(), 3)
+
+
+class MapBuilderTest(TenantTestCase):
+
+    def make_campaign_map(self, name, size):
+        """ A map starting at a quest, with `size` quests in a campaign that all require it, then a final quest """
+        first_quest = baker.make(Quest, name=f"{name} start")
+        campaign = baker.make(Category, title=name)
+        final_quest = baker.make(Quest, name=f"{name} end")
+        for i in range(size):
+            quest = baker.make(Quest, name=f"{name} {i}", campaign=campaign, max_repeats=i % 2)
+            Prereq.add_simple_prereq(quest, first_quest)
+            Prereq.add_simple_prereq(final_quest, quest)
+        return CytoScape.generate_map(first_quest, name)
+
+    def test_build(self):
+        scape = self.make_campaign_map("Campaign", 3)
+        builder = MapBuilder(scape).build()
+
+        # start, campaign, 3 quests and end
+        self.assertEqual(len(builder.nodes), 6)
+        campaign_node = builder.nodes[f"campaign: {CytoScape.generate_label(Category.objects.get(title='Campaign'))}"]
+        quest_nodes = [node for node in builder.nodes.values() if node.data_parent is campaign_node]
+        self.assertEqual(len(quest_nodes), 3)
+
+        # the saved map has the same elements
+        self.assertEqual(CytoElement.objects.all_for_scape(scape).nodes().count(), len(builder.nodes))
+        self.assertEqual(CytoElement.objects.all_for_scape(scape).count(), len(builder.nodes) + len(builder.edges))
+
+    def test_queries_do_not_depend_on_map_size(self):
+        # the first map is the primary map, which takes a different path when saved
+        self.make_campaign_map("Primary", 1)
+        small_map = self.make_campaign_map("Small", 2)
+        large_map = self.make_campaign_map("Large", 20)
+        graph = MapGraph()
+
+        with CaptureQueriesContext(connection) as small:
+            small_map.regenerate(graph)
+        with CaptureQueriesContext(connection) as large:
+            large_map.regenerate(graph)
+
+        self.assertEqual(len(small), len(large))
+        self.assertGreater(CytoElement.objects.all_for_scape(large_map).count(), 40)
+
+
+class IncrementalMapUpdateTest(TenantTestCase):
+
+    def setUp(self):
+        self.first_quest = baker.make(Quest, name="First")
+        self.campaign = baker.make(Category, title="Campaign")
+        self.campaign_quests = [baker.make(Quest, name=f"Campaign {i}", campaign=self.campaign) for i in range(3)]
+        for quest in self.campaign_quests:
+            Prereq.add_simple_prereq(quest, self.first_quest)
+        self.map = CytoScape.generate_map(self.first_quest, "Map")
+
+    def signature(self):
+        """ The map's elements, identified by their content instead of their ids """
+        def key(element):
+            return element and MapBuilder.node_key(element)
+
+        elements = CytoElement.objects.all_for_scape(self.map).select_related('data_parent', 'data_source', 'data_target')
+        return sorted(
+            (key(element), key(element.data_parent), key(element.data_source), key(element.data_target),
+             element.label or '', element.classes or '', element.href or '')
+            for element in elements
+        )
+
+    def assertUpdateMatchesRegenerate(self):
+        changed = self.map.update_elements()
+        updated = self.signature()
+        self.map.regenerate()
+        self.assertEqual(updated, self.signature())
+        return changed
+
+    def test_no_changes(self):
+        ids = set(CytoElement.objects.all_for_scape(self.map).values_list('id', flat=True))
+        last_regeneration = self.map.last_regeneration
+
+        self.assertEqual(self.map.update_elements(), 0)
+        self.assertSetEqual(set(CytoElement.objects.all_for_scape(self.map).values_list('id', flat=True)), ids)
+        self.assertEqual(self.map.last_regeneration, last_regeneration)
+
+    def test_new_reliant_quest(self):
+        new_quest = baker.make(Quest, name="New", max_repeats=-1)
+        Prereq.add_simple_prereq(new_quest, self.campaign_quests[0])
+        first_node_id = CytoElement.objects.get(scape=self.map, selector_id=f"Quest: {self.first_quest.id}").id
+
+        # the node, its edge and its repeat edge
+        self.assertEqual(self.map.update_elements(), 3)
+        self.assertIn(new_quest.get_absolute_url(), self.map.elements_json)
+        # existing elements are kept
+        self.assertTrue(CytoElement.objects.filter(id=first_node_id).exists())
+
+        self.map.refresh_from_db()
+        self.assertIn(new_quest.get_absolute_url(), self.map.elements_json)
+        self.assertUpdateMatchesRegenerate()
+
+    def test_removed_and_archived_quests(self):
+        Prereq.objects.filter(parent_object_id=self.campaign_quests[0].id).delete()
+        self.campaign_quests[1].archived = True
+        self.campaign_quests[1].save()
+
+        self.assertGreater(self.assertUpdateMatchesRegenerate(), 0)
+        self.assertNotIn(self.campaign_quests[0].get_absolute_url(), self.map.elements_json)
+        self.assertNotIn(self.campaign_quests[1].get_absolute_url(), self.map.elements_json)
+
+    def test_campaign_changes(self):
+        """ Changing the campaign's label replaces its node without losing the quests in it """
+        self.campaign_quests[0].xp = 10
+        self.campaign_quests[0].save()
+        self.assertUpdateMatchesRegenerate()
+
+        # a campaign with a common prereq and a reliant
+        reliant = baker.make(Quest, name="After campaign")
+        Prereq.add_simple_prereq(reliant, self.campaign)
+        self.assertUpdateMatchesRegenerate()
+
+    def test_update_maps_for_objects(self):
+        new_quest = baker.make(Quest, name="New")
+        Prereq.add_simple_prereq(new_quest, self.first_quest)
+        unrelated_map = CytoScape.generate_map(baker.make(Quest), "Unrelated")
+
+        # what the signal sends when the Prereq is saved
+        quest_content_type_id = ContentType.objects.get_for_model(Quest).id
+        report = update_maps_for_objects([[quest_content_type_id, new_quest.id], [quest_content_type_id, self.first_quest.id]])
+
+        self.assertEqual(report, {'maps': 1, 'changed': 2})
+        self.map.refresh_from_db()
+        self.assertIn(new_quest.get_absolute_url(), self.map.elements_json)
+        unrelated_map.refresh_from_db()
+        self.assertNotIn(new_quest.get_absolute_url(), unrelated_map.elements_json)
+
+    @patch('tenant_schemas_celery.task.TenantTask.apply_async')
+    def test_update_maps_for_objects__merged(self, apply_async):
+        """ Changes made while the task is waiting in the queue are merged into it, so the maps are only updated once """
+        cache.clear()
+        with self.captureOnCommitCallbacks(execute=True):
+            new_quest = baker.make(Quest, name="New")
+        with self.captureOnCommitCallbacks(execute=True):
+            Prereq.add_simple_prereq(new_quest, self.first_quest)
+        self.assertEqual(update_maps_for_objects.coalesce_counts(), {'sent': 1, 'merged': 1})
+
+        # run it like a worker, with the objects of the Quest's signal only
+        args = [[[ContentType.objects.get_for_model(Quest).id, new_quest.id]]]
+        apply_async.assert_any_call(args, None, queue='default')
+        update_maps_for_objects.before_start('task-id', args, {})
+        report = update_maps_for_objects(*args)
+
+        self.assertEqual(report, {'maps': 1, 'changed': 2})
+        self.map.refresh_from_db()
+        self.assertIn(new_quest.get_absolute_url(), self.map.elements_json)
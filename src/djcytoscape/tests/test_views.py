@@ -1,12 +1,16 @@
+from datetime import timedelta
+
 from django.contrib.auth import get_user_model
 from django.contrib.contenttypes.models import ContentType
 from django.urls import reverse
+from django.utils import timezone
 
 from django_tenants.test.cases import TenantTestCase
 from django_tenants.test.client import TenantClient
 from model_bakery import baker
 
 from djcytoscape.models import CytoScape
+from quest_manager.models import QuestSubmission
 
 from hackerspace_online.tests.utils import ViewTestUtilsMixin, generate_form_data
 
@@ -35,6 +39,8 @@ class ViewTests(ViewTestUtilsMixin, TenantTestCase):
         self.assertRedirectsLogin('djcytoscape:primary')
         self.assertRedirectsLogin('djcytoscape:quest_map', args=[1])
         self.assertRedirectsLogin('djcytoscape:quest_map_personalized', args=[1, 1])
+        self.assertRedirectsLogin('djcytoscape:quest_map_elements', args=[1])
+        self.assertRedirectsLogin('djcytoscape:quest_map_completed', args=[1, 1])
         self.assertRedirectsLogin('djcytoscape:quest_map_interlink', args=[1, 1, 1])
 
         self.assertRedirectsLogin('djcytoscape:list')
@@ -51,6 +57,8 @@ class ViewTests(ViewTestUtilsMixin, TenantTestCase):
 
         self.assert200('djcytoscape:index')
         self.assert200('djcytoscape:quest_map_personalized', args=[self.map.id, self.test_student1.id])
+        self.assert200('djcytoscape:quest_map_elements', args=[self.map.id])
+        self.assert200('djcytoscape:quest_map_completed', args=[self.map.id, self.test_student1.id])
         # need to build  interlinked maps to test this.  Do in own test
         # self.assert200('djcytoscape:quest_map_interlink', args=[1, 1, 1])
         self.assert200('djcytoscape:list')
@@ -71,6 +79,8 @@ class ViewTests(ViewTestUtilsMixin, TenantTestCase):
 
         self.assert200('djcytoscape:index')
         self.assert200('djcytoscape:quest_map_personalized', args=[self.map.id, self.test_student1.id])
+        self.assert200('djcytoscape:quest_map_elements', args=[self.map.id])
+        self.assert200('djcytoscape:quest_map_completed', args=[self.map.id, self.test_student1.id])
         # need to build  interlinked maps to test this.  Do in own test
         # self.assert200('djcytoscape:quest_map_interlink', args=[1, 1, 1])
         self.assert200('djcytoscape:list')
@@ -143,6 +153,82 @@ class ViewTests(ViewTestUtilsMixin, TenantTestCase):
         self.assertEqual(map_.initial_object_id, object_.id)
 
 
+class QuestMapJSONViewTests(ViewTestUtilsMixin, TenantTestCase):
+
+    def setUp(self):
+        self.client = TenantClient(self.tenant)
+        self.test_teacher = User.objects.create_user('test_teacher', is_staff=True)
+        self.test_student1 = User.objects.create_user('test_student')
+        self.test_student2 = User.objects.create_user('test_student2')
+        self.map = baker.make('djcytoscape.CytoScape')
+
+    def test_quest_map_page_does_not_include_elements(self):
+        """ The page only links to the elements and completed quests, which are loaded separately """
+        self.map.update_cache()
+        self.map.save()
+        self.client.force_login(self.test_student1)
+
+        response = self.client.get(reverse('djcytoscape:quest_map', args=[self.map.id]))
+
+        self.assertNotContains(response, self.map.elements_json)
+        self.assertContains(response, reverse('djcytoscape:quest_map_elements', args=[self.map.id]))
+        self.assertContains(response, reverse('djcytoscape:quest_map_completed', args=[self.map.id, self.test_student1.id]))
+
+    def test_quest_map_elements(self):
+        self.client.force_login(self.test_student1)
+
+        response = self.client.get(reverse('djcytoscape:quest_map_elements', args=[self.map.id]))
+
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertIn('ETag', response)
+        self.assertIn('Last-Modified', response)
+        self.assertIn('private', response['Cache-Control'])
+        data = response.json()
+        self.assertIn('elements', data)
+        self.assertIn('class_styles', data)
+
+    def test_quest_map_elements__not_modified(self):
+        """ The elements aren't sent again until the map is regenerated """
+        self.client.force_login(self.test_student1)
+        url = reverse('djcytoscape:quest_map_elements', args=[self.map.id])
+        etag = self.client.get(url)['ETag']
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        self.map.last_regeneration = timezone.now() + timedelta(minutes=1)
+        self.map.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_quest_map_elements__map_does_not_exist(self):
+        self.client.force_login(self.test_student1)
+        self.assert404('djcytoscape:quest_map_elements', args=[self.map.id + 1])
+
+    def test_quest_map_completed(self):
+        quest = baker.make('quest_manager.Quest')
+        baker.make(QuestSubmission, user=self.test_student1, quest=quest, is_completed=True, is_approved=True, _quantity=2)
+        baker.make(QuestSubmission, user=self.test_student1, is_completed=False)
+        self.client.force_login(self.test_student1)
+
+        response = self.client.get(reverse('djcytoscape:quest_map_completed', args=[self.map.id, self.test_student1.id]))
+
+        self.assertEqual(response.json(), {'completed_quests': [quest.id]})
+
+    def test_quest_map_completed__other_users(self):
+        """ Students can't see other students' completed quests, but staff can """
+        self.client.force_login(self.test_student2)
+        self.assert404('djcytoscape:quest_map_completed', args=[self.map.id, self.test_student1.id])
+        self.assert404('djcytoscape:quest_map_personalized', args=[self.map.id, self.test_student1.id])
+
+        self.client.force_login(self.test_teacher)
+        self.assert200('djcytoscape:quest_map_completed', args=[self.map.id, self.test_student1.id])
+
+        response = self.client.get(reverse('djcytoscape:quest_map_completed', args=[self.map.id, self.test_teacher.id]))
+        self.assertEqual(response.json(), {'completed_quests': []})
+
+
 class PrimaryViewTests(ViewTestUtilsMixin, TenantTestCase):
 
     def test_initial_map_generated_on_first_view(self):
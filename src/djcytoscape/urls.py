@@ -12,6 +12,8 @@ urlpatterns = [
 
     url(r'^(?P<scape_id>[0-9]+)/$', views.quest_map, name='quest_map'),
     url(r'^(?P<scape_id>[0-9]+)/(?P<user_id>[0-9]+)/$', views.quest_map_personalized, name='quest_map_personalized'),
+    url(r'^(?P<scape_id>[0-9]+)/elements/$', views.quest_map_elements, name='quest_map_elements'),
+    url(r'^(?P<scape_id>[0-9]+)/(?P<user_id>[0-9]+)/completed/$', views.quest_map_completed, name='quest_map_completed'),
     url(r'^(?P<ct_id>[0-9]+)/(?P<obj_id>[0-9]+)/(?P<originating_scape_id>[0-9]+)/$',
         views.quest_map_interlink, name='quest_map_interlink'),
     url(r'^(?P<pk>[0-9]+)/edit/$', views.ScapeUpdate.as_view(), name='update'),
@@ -5,9 +5,11 @@ from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib.contenttypes.models import ContentType
 from django.core.exceptions import ObjectDoesNotExist
-from django.http import Http404
+from django.http import Http404, HttpResponse, JsonResponse
 from django.shortcuts import render, redirect, get_object_or_404, reverse
+from django.utils.cache import patch_cache_control
 from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
 from django.views.generic import ListView
 from django.views.generic.edit import UpdateView, DeleteView, FormView
 from django.urls import reverse_lazy
@@ -17,6 +19,7 @@ from hackerspace_online.decorators import staff_member_required
 from quest_manager.models import QuestSubmission, Quest
 from tenant.views import NonPublicOnlyViewMixin, non_public_only_view
 
+from .builder import MapGraph
 from .models import CytoScape
 from .forms import GenerateQuestMapForm, QuestMapForm
 from .tasks import regenerate_all_maps
@@ -65,44 +68,88 @@ def quest_map(request, scape_id):
     return quest_map_personalized(request, scape_id, None)
 
 
+def get_personalized_user(request, user_id):
+    """ Other than staff, users can only see their own personalized map """
+    if user_id is None:
+        return request.user
+    user = get_object_or_404(User, id=user_id)
+    if user != request.user and not request.user.is_staff:
+        raise Http404()
+    return user
+
+
 @non_public_only_view
 @login_required
 def quest_map_personalized(request, scape_id, user_id):
-    if user_id is None:
-        user = request.user
+    user = get_personalized_user(request, user_id)
+    scape = get_object_or_404(CytoScape, id=scape_id)
+
+    # The map's elements and the user's completed quests are loaded separately by the page,
+    # so the elements (which are the same for everyone) can be cached by the browser
+    # do not personalize for staff accounts
+    personalized_user = None if user.is_staff else user
+    if personalized_user:
+        completed_quests_url = reverse('djcytoscape:quest_map_completed', args=[scape.id, personalized_user.id])
     else:
-        user = get_object_or_404(User, id=user_id)
-
-    # other than staff, only users can see their own personalized map
-    if user == request.user or request.user.is_staff:
-        # do not personalize for staff accounts
-        if not user.is_staff:
-            completed_qs = QuestSubmission.objects.all_completed(user=user, active_semester_only=False)
-            quest_ids = completed_qs.values_list('quest__id', flat=True)
-            # Evalute and remove doubels by converting to a set
-            quest_ids = set(quest_ids)
-            personalized_user = user
-        else:
-            quest_ids = None
-            personalized_user = None
+        completed_quests_url = None
+
+    context = {
+        'scape': scape,
+        'elements_url': reverse('djcytoscape:quest_map_elements', args=[scape.id]),
+        'completed_quests_url': completed_quests_url,
+        'fullscreen': True,
+        'personalized_user': personalized_user,
+    }
+
+    return render(request, 'djcytoscape/quest_map.html', context)
+
 
-        scape = get_object_or_404(CytoScape, id=scape_id)
+def quest_map_last_modified(request, scape_id):
+    return CytoScape.objects.filter(id=scape_id).values_list('last_regeneration', flat=True).first()
 
-        if scape.class_styles_json is None or scape.class_styles_json is None:
-            scape.update_cache()
 
-        context = {
-            'scape': scape,
-            'elements': scape.elements_json,
-            'class_styles': scape.class_styles_json,
-            'completed_quests': quest_ids,
-            'fullscreen': True,
-            'personalized_user': personalized_user,
-        }
+def quest_map_etag(request, scape_id):
+    last_regeneration = quest_map_last_modified(request, scape_id)
+    if last_regeneration is None:
+        return None
+    return f"{scape_id}-{last_regeneration.timestamp()}"
 
-        return render(request, 'djcytoscape/quest_map.html', context)
+
+@non_public_only_view
+@login_required
+@condition(etag_func=quest_map_etag, last_modified_func=quest_map_last_modified)
+def quest_map_elements(request, scape_id):
+    """ The map's elements and styles as JSON.  They only change when the map is regenerated, so the response has an
+    ETag and Last-Modified based on last_regeneration, and browsers can revalidate their copy instead of downloading it again.
+    """
+    scape = get_object_or_404(CytoScape, id=scape_id)
+
+    if scape.elements_json is None or scape.class_styles_json is None:
+        scape.update_cache()
+
+    # the cached json is already serialized, so don't decode and encode it again
+    content = f'{{"elements": {scape.elements_json}, "class_styles": {scape.class_styles_json}}}'
+    response = HttpResponse(content, content_type='application/json')
+    # maps are only for logged in users, so only the browser may store them
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+@non_public_only_view
+@login_required
+def quest_map_completed(request, scape_id, user_id):
+    """ The ids of the quests the user has completed, to mark on the map """
+    user = get_personalized_user(request, user_id)
+
+    if user.is_staff:
+        quest_ids = []
     else:
-        raise Http404()
+        completed_qs = QuestSubmission.objects.all_completed(user=user, active_semester_only=False)
+        quest_ids = sorted(set(completed_qs.order_by().values_list('quest_id', flat=True)))
+
+    response = JsonResponse({'completed_quests': quest_ids})
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
 
 
 @non_public_only_view
@@ -209,9 +256,10 @@ def regenerate_all(request):
         messages.warning(request, "You have a lot of maps, so the map regeneration is being processed in the background. It may take a few minutes.")  # noqa
         regenerate_all_maps.apply_async(args=[request.user.id], queue='default')
     else:
+        graph = MapGraph()
         for scape in CytoScape.objects.all():
             try:
-                scape.regenerate()
+                scape.regenerate(graph)
             except scape.InitialObjectDoesNotExist:
                 messages.warning(request, f"The initial object for the '{scape.name} Map' no longer exists. The map has now been removed too.")
 
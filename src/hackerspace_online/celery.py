@@ -43,6 +43,13 @@ app.conf.beat_schedule = {
             "queue": "default",
         }
     },
+    "Update cached tenant fields for all schemas hourly task": {
+        "task": "tenant.tasks.update_cached_fields_on_all_schemas",
+        "schedule": crontab(minute=30),
+        "options": {
+            "queue": "default",
+        }
+    },
 }
 
 
@@ -1,19 +1,16 @@
 from django.apps import apps
-# from django.contrib.contenttypes.models import ContentType
-from django.core.management.base import BaseCommand
-from django.db import connection
+from django.core.management.base import CommandError
+from django.db.models import Count, Q
 from django.db.models.base import Model
 from django.db.models.expressions import Value
-from django.db.models.fields import CharField, Field, TextField
+from django.db.models.fields import CharField, TextField
 from django.db.models.functions import Replace
-# from django.db.models import Case, F, Value, When
-
-from django_tenants.utils import schema_context
 
+from hackerspace_online.management.tenant_command import TenantCommand
 from tenant.models import Tenant
 
 
-class Command(BaseCommand):
+class Command(TenantCommand):
     help = 'Within the specified tenant (or "all") replace all occurances of --find "replace-me" with --replace "" '
 
     # app name, model name as dictionary key and field name as values
@@ -21,6 +18,7 @@ class Command(BaseCommand):
     field_types_to_check = [CharField, TextField]
 
     def add_arguments(self, parser):
+        super().add_arguments(parser)
 
         # positional argument for the tenants
         parser.add_argument('tenants', nargs='+', help='A space separated list of tenants, or all')
@@ -29,48 +27,68 @@ class Command(BaseCommand):
         parser.add_argument('--find', action='store', nargs='?', help='The next string to be replaced')
         parser.add_argument('--replace', action='store', nargs='?', default='', help='The text that will replace the find string')
 
-    def handle(self, *args, **options):
-
+    def get_schema_names(self, **options):
         tenant_names = options['tenants']
-        find_str = options['find']
-        replace_str = options['replace']
-
-        print("find: ", find_str)
-        print("replace: ", replace_str)
-
         if tenant_names[0].lower() == "all":
             tenants = Tenant.objects.exclude(name="public")
         else:
             # Note that this will cause mispelled tenant names to be ignored.
             # Would be better if mispelled names were caught and reported to the user
-            # For now, just hope they notice since the loop below prints all the
+            # For now, just hope they notice since the progress prints all the
             # tenants that are recognized
             tenants = Tenant.objects.filter(name__in=tenant_names)
 
-        for tenant in tenants:
-            print(f"Running replacement on tenant: {tenant.schema_name}")
-
-            with schema_context(tenant.schema_name):
-                print("Schema: ", connection.schema_name)
+        schema_names = list(tenants.order_by('id').values_list('schema_name', flat=True))
+        if not schema_names:  # no tenants found to loop through
+            print(f"No tenants recognized in the list provided: {tenant_names}")
+        return schema_names
 
-                # loop through the listed apps
-                for app_label in self.apps_to_check:
-                    app_config = apps.get_app_config(app_label)
-                    # print("App: ", app_config)
+    def handle(self, *args, **options):
+        if not options['find']:
+            raise CommandError("Nothing to replace, --find is required")
 
-                    # loop through all models in the app
-                    model: Model
-                    for model in app_config.get_models():
-                        # print("Model: ", model)
+        print("find: ", options['find'])
+        print("replace: ", options['replace'])
 
-                        # loop through all fields in the model
-                        field: Field
-                        for field in model._meta.get_fields():
-                            if type(field) in self.field_types_to_check:
-                                # https://docs.djangoproject.com/en/2.2/ref/models/database-functions/#replace
-                                model.objects.update(**{field.name: Replace(field.name, Value(find_str), Value(replace_str))})
-                                # print("Updated: ", num_updates)
-                                print("Field: ", field)
+        super().handle(*args, **options)
 
-        if not tenants:  # no tenants found to loop through
-            print(f"No tenants recognized in the list provided: {tenant_names}")
+    def handle_schema(self, schema_name, **options):
+        """
+        :return: dict of "app_label.Model.field": number of rows updated, for the fields that contained the find string
+        """
+        find_str = options['find']
+        replace_str = options['replace']
+        updated = {}
+
+        # loop through the listed apps
+        for app_label in self.apps_to_check:
+            app_config = apps.get_app_config(app_label)
+
+            # loop through all models in the app
+            model: Model
+            for model in app_config.get_models():
+                fields = [field.name for field in model._meta.get_fields() if type(field) in self.field_types_to_check]
+                if not fields:
+                    continue
+
+                # count the matching rows of every field in one query, so fields without the find string
+                # (usually most of them) are skipped instead of rewriting every row in the table
+                matches = model.objects.aggregate(**{
+                    field_name: Count('pk', filter=Q(**{f'{field_name}__contains': find_str})) for field_name in fields
+                })
+
+                for field_name, num_matches in matches.items():
+                    if not num_matches:
+                        continue
+                    # https://docs.djangoproject.com/en/2.2/ref/models/database-functions/#replace
+                    num_updates = model.objects.filter(**{f'{field_name}__contains': find_str}).update(
+                        **{field_name: Replace(field_name, Value(find_str), Value(replace_str))}
+                    )
+                    updated[f'{model._meta.label}.{field_name}'] = num_updates
+
+        return updated
+
+    def schema_done(self, schema_name, result):
+        print(f"Replaced on tenant: {schema_name}")
+        for field, num_updates in result.items():
+            print(f"Field: {field} ({num_updates} rows)")
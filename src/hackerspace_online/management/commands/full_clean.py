@@ -1,11 +1,10 @@
 from django.apps import apps
 from django.core.exceptions import ValidationError
-from django.core.management.base import BaseCommand
-from django_tenants.utils import schema_context
+from hackerspace_online.management.tenant_command import TenantCommand
 from tenant.models import Tenant
 
 
-class Command(BaseCommand):
+class Command(TenantCommand):
     """ Because model.save() does not call full_clean() there might be a couple of integrity issues because of that.
     This command can loop through every single tenant (unless specified) and call full_clean() to check for any issues.
     See "https://github.com/bytedeck/bytedeck/issues/1634" for more details.
@@ -50,6 +49,7 @@ class Command(BaseCommand):
             "Any validation errors are printed to the console.")
 
     def add_arguments(self, parser):
+        super().add_arguments(parser)
 
         # optional arguments
         parser.add_argument(
@@ -57,37 +57,42 @@ class Command(BaseCommand):
             help='A space separated list of tenant schemas. Specifies which tenant to loop through. Defaults to all tenants'
         )
 
-    def handle(self, *args, **options):
+    def get_schema_names(self, **options):
         tenant_names = options.get('tenants')
 
         tenants = Tenant.objects.filter(schema_name__in=tenant_names) if tenant_names else Tenant.objects.all()
 
         # querying models from these gives a relation error
         tenants = tenants.exclude(schema_name__in=['public'])
-
-        # loop through all tenants
-        for tenant in tenants:
-            # loop through all models inside tenant
-            with schema_context(tenant.schema_name):
-
-                # loop through each model
-                for app_name in self.LOCAL_APPS:
-                    for model in apps.get_app_config(app_name).get_models():
-
-                        # full clean each object in model
-                        for object_ in model.objects.all().iterator(chunk_size=100):
-                            try:
-                                object_.full_clean()
-                                object_.save()
-                            except ValidationError as e:
-                                exception_string = self.EXCEPTION_C + "Exception" + self.END_C
-                                tenant_string = self.TENANT_C + str(tenant.schema_name) + self.END_C
-                                object_string = self.OBJECT_C + str(object_) + self.END_C
-                                model_string = self.MODEL_C + model.__name__ + self.END_C
-                                error_type = self.EXCEPTION_C + type(e).__name__ + self.END_C
-
-                                # Exception found on cleaning "<Object Name>" (<Model Name>) of type <Error Name>: <Error Log>
-                                print(
-                                    f'{exception_string} found on {tenant_string} cleaning "{object_string}" ({model_string}) of type {error_type}:',
-                                    e
-                                )
+        return list(tenants.order_by('id').values_list('schema_name', flat=True))
+
+    def handle_schema(self, schema_name, **options):
+        """ :return: list of the validation errors found in the schema """
+        errors = []
+
+        # loop through each model
+        for app_name in self.LOCAL_APPS:
+            for model in apps.get_app_config(app_name).get_models():
+
+                # full clean each object in model
+                for object_ in model.objects.all().iterator(chunk_size=100):
+                    try:
+                        object_.full_clean()
+                        object_.save()
+                    except ValidationError as e:
+                        exception_string = self.EXCEPTION_C + "Exception" + self.END_C
+                        tenant_string = self.TENANT_C + str(schema_name) + self.END_C
+                        object_string = self.OBJECT_C + str(object_) + self.END_C
+                        model_string = self.MODEL_C + model.__name__ + self.END_C
+                        error_type = self.EXCEPTION_C + type(e).__name__ + self.END_C
+
+                        # Exception found on cleaning "<Object Name>" (<Model Name>) of type <Error Name>: <Error Log>
+                        errors.append(
+                            f'{exception_string} found on {tenant_string} cleaning "{object_string}" ({model_string}) of type {error_type}: {e}'
+                        )
+
+        return errors
+
+    def schema_done(self, schema_name, result):
+        for error in result:
+            print(error)
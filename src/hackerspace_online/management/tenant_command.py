@@ -0,0 +1,135 @@
+"""
+Base for management commands that do the same thing on every tenant's schema.
+
+Subclasses implement handle_schema(), which is called inside each schema's context, and optionally schema_done(), which
+is called in the main process with whatever handle_schema() returned:
+
+    class Command(TenantCommand):
+        def handle_schema(self, schema_name, **options):
+            return Quest.objects.count()
+
+        def schema_done(self, schema_name, result):
+            print(f"{schema_name} has {result} quests")
+
+    ./manage.py my_command --processes 8 --checkpoint /tmp/my_command.txt
+
+With --processes the schemas are split over a pool of worker processes, each with its own database connection.
+With --checkpoint each schema is written to the file when it is done, so if the command is interrupted (or fails on some
+schemas) running it again with the same file only picks up the schemas that are left. The file is removed once every
+schema has been done.
+"""
+import multiprocessing
+import os
+import traceback
+from functools import partial
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django_tenants.utils import get_public_schema_name, get_tenant_model, schema_context
+
+from utilities.metrics import QueryCounter
+
+# not passed on to the worker processes, they can't be pickled
+UNPICKLABLE_OPTIONS = ('stdout', 'stderr')
+
+
+def run_on_schema(command_class, options, schema_name):
+    """
+    Runs command_class().handle_schema() in the schema, in this process or in a worker process.
+    :return: tuple of the schema name, handle_schema()'s result or None, the traceback if it failed or None,
+     and the QueryCounter report
+    """
+    result, error = None, None
+    with schema_context(schema_name), QueryCounter() as counter:
+        try:
+            result = command_class().handle_schema(schema_name, **options)
+        except Exception:
+            error = traceback.format_exc()
+    return schema_name, result, error, counter.report()
+
+
+class TenantCommand(BaseCommand):
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--processes', type=int, default=1,
+            help='The number of schemas to work on at the same time, each in its own process. Defaults to 1'
+        )
+        parser.add_argument(
+            '--checkpoint', action='store',
+            help='A file to record the finished schemas in, so that an interrupted run can be resumed by running the '
+                 'command again with the same file'
+        )
+
+    def get_schema_names(self, **options):
+        """ :return: list of the schemas to run on, all tenants except public by default """
+        return list(
+            get_tenant_model().objects.exclude(
+                schema_name=get_public_schema_name()
+            ).order_by('id').values_list('schema_name', flat=True)
+        )
+
+    def handle_schema(self, schema_name, **options):
+        """ Does the work on one schema, the connection is already set to it. The result must be picklable. """
+        raise NotImplementedError('subclasses of TenantCommand must provide a handle_schema() method')
+
+    def schema_done(self, schema_name, result):
+        """ Called in the main process with what handle_schema() returned, in the order the schemas finish """
+        pass
+
+    def handle(self, *args, **options):
+        checkpoint = options['checkpoint']
+        done = self.read_checkpoint(checkpoint)
+        schema_names = [name for name in self.get_schema_names(**options) if name not in done]
+        if done:
+            self.stdout.write(f"Skipping {len(done)} schemas already done according to {checkpoint}")
+
+        worker_options = {key: value for key, value in options.items() if key not in UNPICKLABLE_OPTIONS}
+        results = self.run(schema_names, worker_options, options['processes'])
+
+        failed = []
+        durations = {}
+        for count, (schema_name, result, error, report) in enumerate(results, start=1):
+            progress = f"[{count}/{len(schema_names)}] {schema_name}"
+            if error:
+                failed.append(schema_name)
+                self.stderr.write(f"{progress} failed after {report['seconds']} sec:\n{error}")
+                continue
+
+            durations[schema_name] = report['seconds']
+            self.schema_done(schema_name, result)
+            if checkpoint:
+                with open(checkpoint, 'a') as checkpoint_file:
+                    checkpoint_file.write(f"{schema_name}\n")
+            self.stdout.write(f"{progress} done in {report['seconds']} sec with {report['queries']} queries")
+
+        slowest = sorted(durations, key=durations.get, reverse=True)[:5]
+        self.stdout.write(
+            f"Finished {len(durations)} schemas, slowest: "
+            + ", ".join(f"{name} ({durations[name]} sec)" for name in slowest)
+        )
+
+        if failed:
+            raise CommandError(f"Failed on {len(failed)} schemas: {', '.join(failed)}")
+        if checkpoint and os.path.exists(checkpoint):
+            os.remove(checkpoint)
+
+    def run(self, schema_names, options, processes):
+        """ :return: iterator of run_on_schema()'s results, as each schema finishes """
+        if processes <= 1 or len(schema_names) <= 1:
+            for schema_name in schema_names:
+                yield run_on_schema(type(self), options, schema_name)
+            return
+
+        # the workers are forked, they must not share the connection
+        connections.close_all()
+        with multiprocessing.Pool(min(processes, len(schema_names))) as pool:
+            yield from pool.imap_unordered(partial(run_on_schema, type(self), options), schema_names)
+
+    @staticmethod
+    def read_checkpoint(checkpoint):
+        """ :return: set of the schema names in the checkpoint file """
+        if not checkpoint or not os.path.exists(checkpoint):
+            return set()
+        with open(checkpoint) as checkpoint_file:
+            return {line.strip() for line in checkpoint_file if line.strip()}
@@ -5,6 +5,8 @@ from django.http import HttpResponseRedirect
 from django.core.exceptions import RequestDataTooBig
 from django.template.defaultfilters import filesizeformat
 
+from siteconfig.models import siteconfig_request_cache
+
 
 class ForceDebugCursorMiddleware:
     def __init__(self, get_response):
@@ -17,6 +19,26 @@ class ForceDebugCursorMiddleware:
         return response
 
 
+class SiteConfigCacheMiddleware:
+    """
+    Memoizes SiteConfig.get() for the duration of each request, see siteconfig.models.SiteConfigRequestCache.
+    When DEBUG is on, the number of memo/cache/database hits is added to the response in an X-SiteConfig-Cache header.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        siteconfig_request_cache.start()
+        try:
+            response = self.get_response(request)
+            if settings.DEBUG:
+                response['X-SiteConfig-Cache'] = ', '.join(f'{name}={count}' for name, count in siteconfig_request_cache.counts().items())
+        finally:
+            siteconfig_request_cache.stop()
+        return response
+
+
 class RequestDataTooBigMiddleware:
     """
     Custom middleware to handle requests that exceed the settings.DATA_UPLOAD_MAX_MEMORY_SIZE
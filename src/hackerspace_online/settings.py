@@ -214,6 +214,7 @@ TAGGIT_CASE_INSENSITIVE = True
 
 MIDDLEWARE = [
     'django_tenants.middleware.TenantMiddleware',
+    'hackerspace_online.middleware.SiteConfigCacheMiddleware',  # memoizes SiteConfig.get() per request
     # caching: https://docs.djangoproject.com/en/1.10/topics/cache/
     # 'django.middleware.cache.UpdateCacheMiddleware',
     # 'django.middleware.cache.FetchFromCacheMiddleware',
@@ -343,12 +344,51 @@ CELERY_RESULT_SERIALIZER = 'json'
 
 CELERY_TIMEZONE = TIME_ZONE
 CELERY_TASK_MAX_RETRIES = 10
-CELERY_TASKS_BUNCH_SIZE = 10
 
 # allowed delay between conditions met updates for all users:
 # In sec., wait before start next 'big' update for all conditions, if it's going to start - all other updates could be skipped
 CONDITIONS_UPDATE_COUNTDOWN = 60 * 1
 
+# Longest time in sec. that a TransactionAwareTask call stays pending, i.e. identical calls are merged into it,
+# if it's never started (see prerequisites.tasks.TransactionAwareTask)
+TASK_COALESCE_WINDOW = 60 * 10
+
+# Number of users whose available quests are evaluated together when recalculating conditions met for many users.
+CONDITIONS_UPDATE_BATCH_SIZE = 500
+
+# Longest time in sec. that the cached MarkDistribution (see courses.models) is kept before being rebuilt from the database,
+# so it can't drift from the marks for long if an update is lost.
+MARK_DISTRIBUTION_CACHE_TIMEOUT = 60 * 60
+
+# Number of notifications inserted per query when notifying many users at once, e.g. of a new announcement.
+NOTIFICATIONS_BULK_CREATE_BATCH_SIZE = 1000
+
+# Longest time in sec. that notifications.views.ajax_unread will wait for a change when long polling,
+# and how often it checks the cache while waiting.  Each waiting request holds a uwsgi worker thread (20 in uwsgi.ini),
+# so this is kept short, and well below the 60 sec. harakiri timeout; clients that long poll need about one thread each.
+NOTIFICATIONS_LONG_POLL_TIMEOUT = 10
+NOTIFICATIONS_LONG_POLL_INTERVAL = 1
+
+# Number of users whose notification emails are rendered and sent by one celery task, and how many times
+# sending a chunk of emails is retried before giving up on it
+NOTIFICATION_EMAILS_CHUNK_SIZE = 100
+NOTIFICATION_EMAILS_MAX_RETRIES = 3
+
+# Tasks run on every schema (see tenant.scheduler) have their start times spread over this many seconds,
+# and at most TENANT_TASKS_CONCURRENCY of them run at once, so some celery workers are always free for other tasks.
+# The others wait TENANT_TASKS_RETRY_DELAY seconds before trying again.
+# A task's slot is freed after TENANT_TASKS_SLOT_TIMEOUT seconds in case its worker dies without finishing it,
+# so it must be longer than any of these tasks take.
+TENANT_TASKS_WINDOW = 60 * 60
+TENANT_TASKS_CONCURRENCY = 2
+TENANT_TASKS_RETRY_DELAY = 60
+TENANT_TASKS_SLOT_TIMEOUT = 60 * 60 * 2
+
+# The redis broker delivers a task again if it isn't acknowledged within the visibility timeout (1 hour by default),
+# which includes the time a worker holds a task with a countdown.  It has to be longer than the tasks' countdowns,
+# i.e. the TENANT_TASKS_WINDOW plus a retry, or tasks scheduled near the end of the window would run (and email) twice.
+CELERY_BROKER_TRANSPORT_OPTIONS = {'visibility_timeout': 3 * (TENANT_TASKS_WINDOW + TENANT_TASKS_RETRY_DELAY)}
+
 
 # DATABASES #######################################################
 
@@ -480,6 +520,11 @@ TENANT_DEFAULT_OWNER_USERNAME = env('TENANT_DEFAULT_OWNER_USERNAME')
 TENANT_DEFAULT_OWNER_PASSWORD = env('TENANT_DEFAULT_OWNER_PASSWORD')
 TENANT_DEFAULT_OWNER_EMAIL = env('TENANT_DEFAULT_OWNER_EMAIL', default='')
 
+# New tenants are cloned from this schema, with its initial data, instead of being migrated and initialized from scratch.
+# It's built with `./manage.py build_tenant_template` and needs to be rebuilt after new migrations, until then it isn't used.
+# Tenant names can't include underscores, so it can't be a deck.  Blank to always create tenants from scratch.
+TENANT_TEMPLATE_SCHEMA = env('TENANT_TEMPLATE_SCHEMA', default='tenant_template')
+
 # See this: https://github.com/timberline-secondary/hackerspace/issues/388
 # The design choice for media files it serving all the media files from one directory instead of separate directory for each tenant.
 SILENCED_SYSTEM_CHECKS = ['django_tenants.W003']
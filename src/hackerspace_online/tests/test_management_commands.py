@@ -1,11 +1,15 @@
+import os
+import tempfile
 from io import StringIO
 from contextlib import redirect_stdout
+from unittest.mock import patch
 
 from django.apps import apps
 from django.contrib.auth import get_user_model
 from django.contrib.flatpages.models import FlatPage
 from django.contrib.sites.models import Site
 from django.core.management import call_command
+from django.core.management.base import CommandError
 from django.test import TestCase
 from django_tenants.test.cases import TenantTestCase
 from django_tenants.utils import tenant_context, get_public_schema_name, schema_context
@@ -13,6 +17,7 @@ from django_tenants.utils import tenant_context, get_public_schema_name, schema_
 from model_bakery import baker
 
 # from hackerspace_online.management.commands import find_replace
+from hackerspace_online.management.commands.find_replace import Command as FindReplaceCommand
 from quest_manager.models import Quest, Category
 from tenant.models import Tenant
 
@@ -75,6 +80,72 @@ class FindReplaceTest(TestCase, CommandMixin):
         # self.assertEqual(out, "In dry run mode (--write not passed)\n")
 
 
+class FindReplaceTenantTest(TenantTestCase, CommandMixin):
+    name = "find_replace"
+
+    def test_replaces_only_matching_fields(self):
+        quest = baker.make(Quest, name="Old name", instructions="Visit the old-site.com page")
+        other_quest = baker.make(Quest, name="Another quest", instructions="Nothing to see here")
+
+        with StringIO() as buf, redirect_stdout(buf):
+            self.call_command('all', '--find', 'old-site.com', '--replace', 'new-site.com')
+            log = buf.getvalue()
+
+        quest.refresh_from_db()
+        other_quest.refresh_from_db()
+        self.assertIn("Visit the new-site.com page", quest.instructions)
+        self.assertEqual(quest.name, "Old name")
+        self.assertNotIn("new", other_quest.instructions)
+
+        # fields without the find string aren't updated
+        self.assertIn("Field: quest_manager.Quest.instructions (1 rows)", log)
+        self.assertNotIn("quest_manager.Quest.name", log)
+
+    def test_find_is_required(self):
+        with StringIO() as buf, redirect_stdout(buf):
+            with self.assertRaises(CommandError):
+                self.call_command('all')
+
+
+class TenantCommandTest(TenantTestCase, CommandMixin):
+    """ The options TenantCommand adds to find_replace, full_clean etc. """
+    name = "find_replace"
+
+    def setUp(self):
+        checkpoint_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(checkpoint_dir.cleanup)
+        self.checkpoint = os.path.join(checkpoint_dir.name, 'checkpoint.txt')
+
+    def call_find_replace(self):
+        with StringIO() as buf, redirect_stdout(buf):
+            return self.call_command('all', '--find', 'old', '--replace', 'new', '--checkpoint', self.checkpoint)
+
+    def test_progress(self):
+        out = self.call_find_replace()
+        self.assertIn(f"[1/1] {self.tenant.schema_name} done in", out)
+        # removed once every schema is done
+        self.assertFalse(os.path.exists(self.checkpoint))
+
+    def test_checkpoint_resumes(self):
+        """ Schemas in the checkpoint file were done by a previous run, so they're skipped """
+        with open(self.checkpoint, 'w') as checkpoint_file:
+            checkpoint_file.write(f"{self.tenant.schema_name}\n")
+
+        with patch.object(FindReplaceCommand, 'handle_schema') as handle_schema:
+            out = self.call_find_replace()
+
+        handle_schema.assert_not_called()
+        self.assertIn("Skipping 1 schemas", out)
+
+    def test_failed_schema_is_not_checkpointed(self):
+        with patch.object(FindReplaceCommand, 'handle_schema', side_effect=Exception("oops")):
+            with self.assertRaisesMessage(CommandError, self.tenant.schema_name):
+                self.call_find_replace()
+
+        # so it's tried again when resuming
+        self.assertEqual(FindReplaceCommand.read_checkpoint(self.checkpoint), set())
+
+
 class InitDbTest(TestCase, CommandMixin):
     """ Note that this is NOT a TenantTestCase
     """
@@ -1,30 +1,257 @@
+import logging
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.utils import timezone
 from django_tenants.utils import schema_context
+
+from badges.models import Badge
+from djcytoscape.tasks import update_maps_for_objects
+from prerequisites.models import Prereq
+from prerequisites.tasks import update_conditions_for_quest, update_quest_conditions_all_users
 from quest_manager.admin import QuestResource
-from quest_manager.models import Quest
+from quest_manager.models import Category, Quest
+from quest_manager.signals import tidy_html
+from tags.models import UserTagXP
+from utilities.metrics import QueryCounter
 
 from .utils import library_schema_context
 
+logger = logging.getLogger(__name__)
+
+
+def get_quest_import_fields():
+    """ :return: names of the Quest fields that are copied, the same as QuestResource exports (except the relations) """
+    return [
+        field.attname for field in Quest._meta.concrete_fields
+        if field.name not in QuestResource.Meta.exclude
+    ]
+
 
 def import_quests_to(*, destination_schema, quest_import_ids):
     """
+    Copies the library's quests (and their campaigns and simple quest/badge prerequisites) to the destination schema,
+    the same way as exporting and importing them with QuestResource, but with a few bulk queries instead of a few per quest.
+
+    Quests that already exist in the destination (with the same import_id) are updated, new ones are created with
+    visible_to_students=False since they will be orphans.  Campaigns are matched by title and prerequisites by the
+    import_id of the quest or badge in the destination, the ones that don't exist there are skipped.
+
+    Everything is created in one transaction without sending post_save signals, so the available quests and the maps
+    are updated once at the end instead of for each object.
+
     :param destination_schema: schema to import the quest to
     :param quest_import_ids: list of quest import ids
+    :return: dict with the number of quests created and updated, campaigns and prereqs created,
+     and a QueryCounter report for each phase
+    """
+    report = {'created': 0, 'updated': 0, 'campaigns': 0, 'prereqs': 0, 'phases': {}}
+    fields = get_quest_import_fields()
+
+    with library_schema_context(), QueryCounter() as counter:
+        library_quests = list(
+            Quest.objects.select_related('campaign').filter(visible_to_students=True, import_id__in=quest_import_ids)
+        )
+        prereq_import_ids = get_simple_prereq_import_ids(library_quests)
+    report['phases']['export'] = counter.report(quests=len(library_quests))
+
+    with schema_context(destination_schema), transaction.atomic():
+        with QueryCounter() as counter:
+            resolved = resolve_import_ids(
+                [quest.import_id for quest in library_quests],
+                {import_id for import_ids in prereq_import_ids.values() for import_id in import_ids},
+            )
+        report['phases']['resolve'] = counter.report()
+
+        with QueryCounter() as counter:
+            campaign_ids = create_campaigns(library_quests)
+        report['campaigns'] = len(campaign_ids['created'])
+        report['phases']['campaigns'] = counter.report(campaigns=report['campaigns'])
+
+        with QueryCounter() as counter:
+            quest_ids, created_ids = create_quests(library_quests, fields, resolved, campaign_ids['all'])
+        report['created'] = len(created_ids)
+        report['updated'] = len(quest_ids) - len(created_ids)
+        report['phases']['quests'] = counter.report(quests=len(quest_ids))
+
+        with QueryCounter() as counter:
+            # prereqs can be one of the quests that were just imported
+            resolved['quests'].update(quest_ids)
+            prereqs = create_simple_prereqs(quest_ids, prereq_import_ids, resolved)
+        report['prereqs'] = len(prereqs)
+        report['phases']['prereqs'] = counter.report(prereqs=len(prereqs))
+
+        with QueryCounter() as counter:
+            update_after_import(list(quest_ids.values()), campaign_ids['created'], prereqs)
+        report['phases']['deferred'] = counter.report()
+
+    logger.info(f"Imported quests from the library to {destination_schema}: {report}")
+    return report
+
+
+def get_simple_prereq_import_ids(quests):
+    """
+    Same as QuestResource.dehydrate_prereq_import_ids() for all the quests at once
+    :return: dict of quest import_id: list of the import_ids of its quest and badge prerequisites
+    """
+    quest_content_type = ContentType.objects.get_for_model(Quest)
+    badge_content_type = ContentType.objects.get_for_model(Badge)
+    import_ids_by_id = {quest.id: quest.import_id for quest in quests}
+
+    prereqs = list(Prereq.objects.filter(
+        parent_content_type=quest_content_type,
+        parent_object_id__in=import_ids_by_id,
+        prereq_content_type__in=[quest_content_type, badge_content_type],
+    ).order_by('id').values_list('parent_object_id', 'prereq_content_type_id', 'prereq_object_id'))
+
+    # a prereq can be any quest or badge in the library, not only one of these quests
+    object_import_ids = {
+        quest_content_type.id: dict(Quest.objects.get_queryset(include_archived=True).filter(
+            id__in=[object_id for _, content_type_id, object_id in prereqs if content_type_id == quest_content_type.id]
+        ).values_list('id', 'import_id')),
+        badge_content_type.id: dict(Badge.objects.filter(
+            id__in=[object_id for _, content_type_id, object_id in prereqs if content_type_id == badge_content_type.id]
+        ).values_list('id', 'import_id')),
+    }
+
+    prereq_import_ids = {quest.import_id: [] for quest in quests}
+    for parent_id, content_type_id, object_id in prereqs:
+        import_id = object_import_ids[content_type_id].get(object_id)
+        if import_id:
+            prereq_import_ids[import_ids_by_id[parent_id]].append(import_id)
+    return prereq_import_ids
+
+
+def resolve_import_ids(quest_import_ids, prereq_import_ids):
+    """
+    Finds the quests and badges that already exist in the current schema, in one query each.
+    A prereq import_id is looked up as a quest first, then as a badge, the same as QuestResource.generate_simple_prereqs()
+    :return: dict with 'quests': {import_id: id}, 'quest_campaigns': {import_id: campaign_id}, and 'badges': {import_id: id}
     """
+    quests = Quest.objects.get_queryset(include_archived=True).filter(
+        import_id__in=set(quest_import_ids) | set(prereq_import_ids)
+    ).values_list('import_id', 'id', 'campaign_id')
 
-    with library_schema_context():
-        quests = Quest.objects.select_related('campaign').filter(visible_to_students=True, import_id__in=quest_import_ids)
-        export_data = QuestResource().export(quests)
+    resolved = {'quests': {}, 'quest_campaigns': {}}
+    for import_id, quest_id, campaign_id in quests:
+        resolved['quests'][import_id] = quest_id
+        resolved['quest_campaigns'][import_id] = campaign_id
+
+    badge_import_ids = set(prereq_import_ids) - set(resolved['quests'])
+    resolved['badges'] = dict(Badge.objects.filter(import_id__in=badge_import_ids).values_list('import_id', 'id'))
+    return resolved
+
+
+def create_campaigns(library_quests):
+    """
+    Same as QuestResource.generate_campaign(), campaigns are matched by title and created if they don't exist
+    :return: dict with 'all': {title: id} for the quests' campaigns, and 'created': list of the new campaigns' ids
+    """
+    library_campaigns = {quest.campaign.title: quest.campaign for quest in library_quests if quest.campaign}
+    campaign_ids = dict(Category.objects.filter(title__in=library_campaigns).values_list('title', 'id'))
+
+    new_campaigns = Category.objects.bulk_create([
+        Category(title=title, icon=campaign.icon.name)
+        for title, campaign in library_campaigns.items() if title not in campaign_ids
+    ])
+    campaign_ids.update({campaign.title: campaign.id for campaign in new_campaigns})
+    return {'all': campaign_ids, 'created': [campaign.id for campaign in new_campaigns]}
+
+
+def create_quests(library_quests, fields, resolved, campaign_ids):
+    """
+    Creates the quests that don't exist in the current schema yet and updates the others
+    :return: tuple of {import_id: id} for all the quests, and a list of the ids of the ones that were created
+    """
+    now = timezone.now()
+    new_quests, existing_quests = [], []
+    for library_quest in library_quests:
+        quest = Quest(**{field: getattr(library_quest, field) for field in fields})
+        # normally done by quest_pre_save_callback()
+        quest.instructions = tidy_html(quest.instructions)
+        quest.datetime_last_edit = now
+
+        existing_id = resolved['quests'].get(quest.import_id)
+        # quests without a campaign in the library keep their campaign
+        quest.campaign_id = campaign_ids.get(getattr(library_quest.campaign, 'title', None),
+                                             resolved['quest_campaigns'].get(quest.import_id))
+        if existing_id:
+            quest.id = existing_id
+            existing_quests.append(quest)
+        else:
+            quest.visible_to_students = False
+            quest.datetime_created = now
+            new_quests.append(quest)
+
+    Quest.objects.bulk_update(existing_quests, [field for field in fields if field != 'datetime_created'] + ['campaign'])
+    Quest.objects.bulk_create(new_quests)
+
+    quest_ids = {quest.import_id: quest.id for quest in existing_quests + new_quests}
+    return quest_ids, [quest.id for quest in new_quests]
+
+
+def create_simple_prereqs(quest_ids, prereq_import_ids, resolved):
+    """
+    Same as QuestResource.generate_simple_prereqs() for all the quests at once, prereqs the quests already have are skipped
+    :param quest_ids: {import_id: id} of the imported quests
+    :param prereq_import_ids: {quest import_id: list of the import_ids of its prereqs}
+    :return: list of the new Prereqs
+    """
+    quest_content_type = ContentType.objects.get_for_model(Quest)
+    badge_content_type = ContentType.objects.get_for_model(Badge)
+
+    existing = set(Prereq.objects.filter(
+        parent_content_type=quest_content_type, parent_object_id__in=quest_ids.values(),
+    ).values_list('parent_object_id', 'prereq_content_type_id', 'prereq_object_id'))
+
+    new_prereqs = []
+    for import_id, quest_id in quest_ids.items():
+        for prereq_import_id in prereq_import_ids.get(import_id, []):
+            if prereq_import_id in resolved['quests']:
+                prereq = (quest_id, quest_content_type.id, resolved['quests'][prereq_import_id])
+            elif prereq_import_id in resolved['badges']:
+                prereq = (quest_id, badge_content_type.id, resolved['badges'][prereq_import_id])
+            else:
+                continue
+
+            if prereq not in existing:
+                existing.add(prereq)
+                new_prereqs.append(Prereq(
+                    parent_content_type=quest_content_type,
+                    parent_object_id=quest_id,
+                    prereq_content_type_id=prereq[1],
+                    prereq_object_id=prereq[2],
+                ))
+
+    return Prereq.objects.bulk_create(new_prereqs)
+
+
+def update_after_import(quest_ids, campaign_ids, prereqs):
+    """
+    Does what the post_save signals of the imported objects would have done, once for all of them.
+    The tasks are sent when the transaction is committed.
+    """
+    quest_content_type_id = ContentType.objects.get_for_model(Quest).id
+    category_content_type_id = ContentType.objects.get_for_model(Category).id
 
-    dry_run = False
-    with schema_context(destination_schema):
-        res = QuestResource().import_data(export_data, dry_run=dry_run)
+    changed_objects = [[quest_content_type_id, quest_id] for quest_id in quest_ids]
+    changed_objects += [[category_content_type_id, campaign_id] for campaign_id in campaign_ids]
+    for prereq in prereqs:
+        changed_objects.append([prereq.prereq_content_type_id, prereq.prereq_object_id])
+    if changed_objects:
+        update_maps_for_objects.apply_async(args=[changed_objects], queue='default')
 
-        object_ids = []
-        for row in res.rows:
-            if row.new_record:
-                object_ids.append(row.object_id)
-        # Set visible_to_students to False for imported quests
-        # since the imported quests will be orphans
-        Quest.objects.filter(pk__in=object_ids).update(visible_to_students=False)
+    if not quest_ids:
+        return
 
-    return res
+    UserTagXP.invalidate_all()
+    update_quest_conditions_all_users.apply_async(
+        args=[1], queue='default', countdown=settings.CONDITIONS_UPDATE_COUNTDOWN
+    )
+    # users without a course aren't covered by update_quest_conditions_all_users
+    outside_course_ids = Quest.objects.get_queryset(include_archived=True).filter(
+        id__in=quest_ids, available_outside_course=True
+    ).values_list('id', flat=True)
+    for quest_id in outside_course_ids:
+        update_conditions_for_quest.apply_async(kwargs={'quest_id': quest_id, 'start_from_user_id': 1}, queue='default')
@@ -0,0 +1,99 @@
+from unittest.mock import patch
+
+from django.contrib.contenttypes.models import ContentType
+from model_bakery import baker
+
+from badges.models import Badge
+from library.importer import import_quests_to
+from library.tests.test_views import LibraryTenantTestCaseMixin
+from library.utils import library_schema_context
+from quest_manager.models import Category, Quest
+
+
+class ImportQuestsToTest(LibraryTenantTestCaseMixin):
+
+    def make_library_campaign(self, title, num_quests):
+        """ :return: import_ids of the campaign's quests, each one requires the previous one and the same badge """
+        with library_schema_context():
+            campaign = baker.make(Category, title=title)
+            badge = baker.make(Badge, name=f"{title} badge")
+            quests = baker.make(Quest, campaign=campaign, visible_to_students=True, _quantity=num_quests)
+            for previous_quest, quest in zip(quests, quests[1:]):
+                quest.add_simple_prereqs([previous_quest, badge])
+            return badge, [quest.import_id for quest in quests]
+
+    def import_quests(self, import_ids):
+        return import_quests_to(destination_schema=self.tenant.schema_name, quest_import_ids=import_ids)
+
+    def test_import(self):
+        library_badge, import_ids = self.make_library_campaign("Library campaign", 3)
+        # prereqs are matched by import_id, the library badge doesn't exist in this deck
+        local_badge = baker.make(Badge, import_id=library_badge.import_id)
+
+        report = self.import_quests(import_ids)
+
+        self.assertEqual(report['created'], 3)
+        self.assertEqual(report['campaigns'], 1)
+        self.assertEqual(report['prereqs'], 4)
+        self.assertEqual(set(report['phases']), {'export', 'resolve', 'campaigns', 'quests', 'prereqs', 'deferred'})
+
+        campaign = Category.objects.get(title="Library campaign")
+        quests = [Quest.objects.get(import_id=import_id) for import_id in import_ids]
+        for quest in quests:
+            self.assertEqual(quest.campaign, campaign)
+            # orphans until the teacher makes them visible
+            self.assertFalse(quest.visible_to_students)
+
+        self.assertEqual([p.get_prereq() for p in quests[0].prereqs()], [])
+        self.assertCountEqual([p.get_prereq() for p in quests[2].prereqs()], [quests[1], local_badge])
+
+    def test_import_existing_quests(self):
+        """ Existing quests are updated instead of duplicated, and their prereqs aren't added twice """
+        _, import_ids = self.make_library_campaign("Library campaign", 2)
+        self.import_quests(import_ids)
+        Quest.objects.filter(import_id__in=import_ids).update(xp=1234)
+
+        report = self.import_quests(import_ids)
+
+        self.assertEqual(report['created'], 0)
+        self.assertEqual(report['updated'], 2)
+        self.assertEqual(report['campaigns'], 0)
+        self.assertEqual(report['prereqs'], 0)
+        self.assertFalse(Quest.objects.filter(xp=1234).exists())
+        self.assertEqual(Quest.objects.get(import_id=import_ids[1]).prereqs().count(), 1)
+
+    def test_number_of_queries(self):
+        """ Doesn't depend on the number of quests """
+        _, small_import_ids = self.make_library_campaign("Small campaign", 2)
+        _, large_import_ids = self.make_library_campaign("Large campaign", 6)
+
+        small_report = self.import_quests(small_import_ids)
+        large_report = self.import_quests(large_import_ids)
+
+        for phase, phase_report in small_report['phases'].items():
+            self.assertEqual(phase_report['queries'], large_report['phases'][phase]['queries'], phase)
+
+    @patch('library.importer.UserTagXP.invalidate_all')
+    @patch('library.importer.update_conditions_for_quest.apply_async')
+    @patch('library.importer.update_quest_conditions_all_users.apply_async')
+    @patch('library.importer.update_maps_for_objects.apply_async')
+    def test_deferred_updates(self, update_maps, update_conditions, update_quest, invalidate_tag_xp):
+        """ The maps, available quests and tag XP are updated once, instead of by the post_save signals of each object """
+        _, import_ids = self.make_library_campaign("Library campaign", 3)
+        with library_schema_context():
+            Quest.objects.filter(import_id=import_ids[0]).update(available_outside_course=True)
+        for mock in (update_maps, update_conditions, update_quest, invalidate_tag_xp):
+            mock.reset_mock()
+
+        self.import_quests(import_ids)
+
+        update_maps.assert_called_once()
+        update_conditions.assert_called_once()
+        invalidate_tag_xp.assert_called_once()
+        # like update_cache_triggered_by_quests_available_outside_course()
+        update_quest.assert_called_once_with(
+            kwargs={'quest_id': Quest.objects.get(import_id=import_ids[0]).id, 'start_from_user_id': 1}, queue='default'
+        )
+        campaign = Category.objects.get(title="Library campaign")
+        changed_objects = update_maps.call_args.kwargs['args'][0]
+        self.assertIn([ContentType.objects.get_for_model(Category).id, campaign.id], changed_objects)
@@ -1,15 +1,20 @@
+import uuid
+
 from django.apps import apps
 from django.conf import settings
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
-from django.db import models
-from django.db.models import Q
+from django.core.cache import cache
+from django.db import connection, models, transaction
+from django.db.models.signals import post_delete, post_save
+from django.db.models import Q, prefetch_related_objects
 from django.urls import reverse
 from django.utils import timezone
 from django.utils.html import strip_tags
 from bs4 import BeautifulSoup
 
 from tenant.utils import get_root_url
+from utilities.metrics import QueryCounter
 
 from .signals import notify
 
@@ -49,13 +54,13 @@ class NotificationQuerySet(models.query.QuerySet):
 
     def mark_all_read(self, recipient):
         qs = self.get_unread().get_user(recipient)
-        qs.update(unread=False)
-        qs.update(time_read=timezone.now())
+        qs.update(unread=False, time_read=timezone.now())
+        UnreadNotifications.invalidate([recipient.id])
 
     def mark_all_unread(self, recipient):
         qs = self.get_read().get_user(recipient)
-        qs.update(unread=True)
-        qs.update(time_read=None)
+        qs.update(unread=True, time_read=None)
+        UnreadNotifications.invalidate([recipient.id])
 
     def get_unread(self):
         return self.filter(unread=True)
@@ -97,6 +102,81 @@ class NotificationManager(models.Manager):
         else:
             return None
 
+    def bulk_notify(self, sender, recipients, verb, icon="<i class='fa fa-info-circle'></i>",
+                    target=None, action=None, batch_size=None):
+        """
+        Creates the same notification for many recipients at once.  The content types are looked up once
+        and the notifications are inserted with bulk_create, in batches of NOTIFICATIONS_BULK_CREATE_BATCH_SIZE.
+        The sender is never notified about their own actions.
+
+        :param recipients: a queryset or iterable of Users
+        :return: throughput report, see utilities.metrics.QueryCounter.report()
+        """
+        batch_size = batch_size or settings.NOTIFICATIONS_BULK_CREATE_BATCH_SIZE
+
+        with QueryCounter() as counter:
+            # the same values for every recipient
+            fields = {
+                'verb': verb,
+                'font_icon': icon,
+                'sender_content_type': ContentType.objects.get_for_model(sender),
+                'sender_object_id': sender.id,
+            }
+            for option, obj in (('target', target), ('action', action)):
+                if obj is not None:
+                    fields[f'{option}_content_type'] = ContentType.objects.get_for_model(obj)
+                    fields[f'{option}_object_id'] = obj.id
+            fields.update(self.model.render_snapshot(sender, target, action))
+
+            if isinstance(recipients, models.QuerySet):
+                if isinstance(sender, recipients.model):
+                    recipients = recipients.exclude(pk=sender.pk)
+                recipient_ids = recipients.order_by().values_list('pk', flat=True).distinct()
+            else:
+                recipient_ids = [user.pk for user in recipients if user != sender]
+
+            notifications = [self.model(recipient_id=recipient_id, **fields) for recipient_id in recipient_ids]
+            self.bulk_create(notifications, batch_size=batch_size)
+            # bulk_create doesn't send post_save
+            UnreadNotifications.invalidate([notification.recipient_id for notification in notifications])
+
+        return counter.report(notifications=len(notifications))
+
+    def fill_snapshots(self, notifications):
+        """
+        Prepares a list of notifications to be displayed.  Notifications without a snapshot (created before they were
+        stored) have their sender, target and action objects loaded with one query per content type, instead of
+        three queries per notification, and their snapshots rendered and saved.
+
+        :param notifications: an iterable of notifications, e.g. a queryset or a page of one
+        :return: list of the notifications
+        """
+        notifications = list(notifications)
+        missing = [notification for notification in notifications if not notification.has_snapshot()]
+        if missing:
+            prefetch_related_objects(missing, 'sender_object', 'target_object', 'action_object')
+            for notification in missing:
+                notification.set_snapshot()
+            self.bulk_update(missing, self.model.SNAPSHOT_FIELDS)
+
+        if notifications:
+            root_url = get_root_url()
+            for notification in notifications:
+                notification.root_url = root_url
+        return notifications
+
+    def refresh_target_snapshots(self, target):
+        """ Update the snapshots of notifications about the target, e.g. after it was renamed
+        :return: the number of notifications updated
+        """
+        snapshot = self.model.render_snapshot(None, target)
+        target_text, target_url = snapshot['target_text'], snapshot['target_url']
+        return self.get_queryset().get_object_target(target).filter(
+            sender_text__isnull=False
+        ).exclude(
+            Q(target_text=target_text) & (Q(target_url=target_url) if target_url else Q(target_url__isnull=True))
+        ).update(target_text=target_text, target_url=target_url)
+
 
 class Notification(models.Model):
     sender_content_type = models.ForeignKey(ContentType, related_name='notify_sender', on_delete=models.CASCADE)
@@ -124,8 +204,23 @@ class Notification(models.Model):
     unread = models.BooleanField(default=True)
     time_read = models.DateTimeField(null=True, blank=True)
 
+    # Snapshot of the sender, target and action objects, rendered when the notification is created so it can be
+    # displayed without looking them up.  Notifications created before these fields existed have no sender_text,
+    # see NotificationManager.fill_snapshots()
+    sender_text = models.TextField(null=True, blank=True)
+    target_text = models.TextField(null=True, blank=True)
+    target_url = models.TextField(null=True, blank=True)
+    action_text = models.TextField(null=True, blank=True)
+
+    SNAPSHOT_FIELDS = ['sender_text', 'target_text', 'target_url', 'action_text']
+
     objects = NotificationManager()
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['target_content_type', 'target_object_id']),
+        ]
+
     def html_strip(string, char_limit=50, tag_size=1, resize_image=True, image_height=20, **kwargs) -> str:
         """
             Strips all html tags except img tags and imposes a length limit. Returns the input text without html tags save for img tag
@@ -197,35 +292,62 @@ class Notification(models.Model):
 
         return text + ("..." if limit_imposed else "")
 
-    def __str__(self):
+    @staticmethod
+    def render_snapshot(sender, target=None, action=None):
+        """ :return: dict of the SNAPSHOT_FIELDS for a notification about these objects """
         try:
-            target_url = self.target_object.get_absolute_url()
-
-            # Is this the right place to do this?
-            if 'commented on' in self.verb:
-                target_url += f'#comment-{self.action_object_id}'
-        except AttributeError:
+            target_url = target.get_absolute_url()
+        except Exception:
+            # no target, or it doesn't have a url
             target_url = None
 
-        action = self.action_object
+        return {
+            'sender_text': str(sender),
+            'target_text': None if target is None else str(target),
+            'target_url': target_url,
+            # uses custom strip
+            'action_text': None if action is None else Notification.html_strip(action),
+        }
+
+    def has_snapshot(self):
+        return self.sender_text is not None
+
+    def set_snapshot(self):
+        for field, value in self.render_snapshot(self.sender_object, self.target_object, self.action_object).items():
+            setattr(self, field, value)
+
+    def save(self, *args, **kwargs):
+        if self._state.adding and not self.has_snapshot():
+            self.set_snapshot()
+        super().save(*args, **kwargs)
+
+    def get_target_url(self):
+        target_url = self.target_url
+
+        # Is this the right place to do this?
+        if target_url and 'commented on' in self.verb:
+            target_url += f'#comment-{self.action_object_id}'
+        return target_url
 
-        # uses custom strip
-        action = Notification.html_strip(action)
+    def __str__(self):
+        if not self.has_snapshot():
+            self.set_snapshot()
 
         # absolute url needed for when notifications are sent via email
-        root_url = get_root_url()
+        # NotificationManager.fill_snapshots() sets root_url so it's only looked up once for a list of notifications
+        root_url = getattr(self, 'root_url', None) or get_root_url()
         context = {
-            "sender": self.sender_object,
+            "sender": self.sender_text,
             "verb": self.verb,
-            "action": action,  # notif text
-            "target": self.target_object,  # basically quest name
+            "action": self.action_text,  # notif text
+            "target": self.target_text,  # basically quest name
             "verify_read": "{}{}".format(root_url, reverse('notifications:read', kwargs={"id": self.id})),
-            "target_url": target_url,
+            "target_url": self.get_target_url(),
         }
 
         url_common_part = "%(sender)s %(verb)s <a href='%(verify_read)s?next=%(target_url)s'>" % context
-        if self.target_object:
-            if self.action_object:
+        if self.target_text is not None:
+            if self.action_text is not None:
                 url = url_common_part + ' <em>%(target)s</em> with "%(action)s"</a>' % context
             else:
                 url = url_common_part + " <em>%(target)s</em></a>" % context
@@ -239,53 +361,29 @@ class Notification(models.Model):
         self.save()
 
     def get_url(self):
-        # print("***** NOTIFICATION.get_url **********")
-        try:
-            target_url = self.target_object.get_absolute_url()
-
-            if 'commented on' in self.verb:
-                target_url += f'#comment-{self.action_object_id}'
-        except:  # noqa
-            # TODO make this except explicit, don't remember what it's doing
-            target_url = reverse('notifications:list')
-
         context = {
             "verify_read": reverse('notifications:read', kwargs={"id": self.id}),
-            "target_url": target_url
+            "target_url": self.get_target_url() or reverse('notifications:list'),
         }
 
         return "%(verify_read)s?next=%(target_url)s" % context
 
     def get_link(self):
-        # print("***** NOTIFICATION.get_link **********")
-        # try:
-        #     target_url = self.target_object.get_absolute_url()
-        # except:
-        #     target_url = reverse('notifications:list')
-
-        # if len(str(self.action_object)) > 50:
-        #     action = str(self.action_object)[:50] + "..."
-        # else:
-        #     action = str(self.action_object)
-
-        # action = strip_tags(action)
-
-        action = Notification.html_strip(str(self.action_object))
+        if not self.has_snapshot():
+            self.set_snapshot()
 
         context = {
-            "sender": self.sender_object,
+            "sender": self.sender_text,
             "verb": self.verb,
-            "action": action,
-            "target": self.target_object,
-            # "verify_read": reverse('notifications:read', kwargs={"id":self.id}),
-            # "target_url": target_url,
+            "action": self.action_text,
+            "target": self.target_text,
             "url": self.get_url(),
             "icon": self.font_icon
         }
 
         url_common_part = "<a href='%(url)s'>%(icon)s&nbsp;&nbsp; %(sender)s %(verb)s" % context
-        if self.target_object:
-            if self.action_object:
+        if self.target_text is not None:
+            if self.action_text is not None:
                 url = url_common_part + ' <em>%(target)s</em> with "%(action)s"</a>' % context
             else:
                 url = url_common_part + " <em>%(target)s</em></a>" % context
@@ -295,6 +393,82 @@ class Notification(models.Model):
         return url
 
 
+class UnreadNotifications:
+    """
+    A user's unread notification count and the pre-rendered links shown in the notifications menu, cached so the
+    menu (which is polled by every open tab) can be served without querying the database.
+
+    The cache is dropped when the user's notifications are created, read or deleted (once the change is committed),
+    and filled again by the next request.  Each time it's filled it gets a new version, which is used as the ETag of
+    the polling view.
+    """
+    LIMIT = 15  # more links than this would go off the bottom of the screen
+    TIMEOUT = 60 * 60
+
+    @staticmethod
+    def cache_key(user_id):
+        return f'{connection.schema_name}-unread-notifications-{user_id}'
+
+    @staticmethod
+    def new_version():
+        return uuid.uuid4().hex
+
+    @classmethod
+    def peek(cls, user_id):
+        """ The cached data without querying the database, or None if the user has nothing cached """
+        return cache.get(cls.cache_key(user_id))
+
+    @classmethod
+    def get(cls, user):
+        """
+        :return: dict with the unread 'count', up to LIMIT rendered 'notifications' (link, id and whether they are
+         'removable'), the 'limit', and the 'version' of this data
+        """
+        data = cls.peek(user.id)
+        if data is None:
+            unread = Notification.objects.all_unread(user)
+            # announcements are removed from the list by reading them, not by dismissing them
+            announcement_ct = ContentType.objects.get_for_model(apps.get_model('announcements.Announcement'))
+            data = {
+                'count': unread.count(),
+                'notifications': [
+                    {
+                        'link': str(note.get_link()),
+                        'id': str(note.id),
+                        'removable': note.target_content_type_id != announcement_ct.id,
+                    }
+                    for note in Notification.objects.fill_snapshots(unread[:cls.LIMIT])
+                ],
+                'limit': cls.LIMIT,
+                'version': cls.new_version(),
+            }
+            cache.set(cls.cache_key(user.id), data, cls.TIMEOUT)
+        return data
+
+    @classmethod
+    def invalidate(cls, user_ids):
+        """ Drop the users' cached data once the current transaction is committed, so the next request counts the
+        notifications again, including the ones changed in the transaction.  Dropping it instead of updating it in place
+        means concurrent changes can't overwrite each other. """
+        keys = [cls.cache_key(user_id) for user_id in set(user_ids)]
+        transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def notification_saved(sender, instance, created, **kwargs):
+    # a new unread notification, or one that was read, marked unread again or otherwise edited
+    if instance.unread or not created:
+        UnreadNotifications.invalidate([instance.recipient_id])
+
+
+def notification_deleted(sender, instance, **kwargs):
+    if instance.unread:
+        UnreadNotifications.invalidate([instance.recipient_id])
+
+
+post_save.connect(notification_saved, sender=Notification)
+post_delete.connect(notification_deleted, sender=Notification)
+
+
 def new_notification(sender, **kwargs):
     """
     Creates notification when a signal is sent with notify.send(sender, **kwargs)
@@ -310,7 +484,7 @@ def new_notification(sender, **kwargs):
                "<i class='fa fa-comment-o fa-flip-horizontal fa-stack-1x'></i>" + \
                "<i class='fa fa-ban fa-stack-2x text-danger'></i>" + \
             "</span>"
-    :return:
+    :return: throughput report of the notifications created, see Notification.objects.bulk_notify()
     """
     # signal = kwargs.pop('signal', None)
     kwargs.pop('signal', None)
@@ -319,38 +493,17 @@ def new_notification(sender, **kwargs):
     icon = kwargs.pop('icon', "<i class='fa fa-info-circle'></i>")
     affected_users = kwargs.pop('affected_users', [recipient, ])
 
-    # try:
-    #     affected_users = kwargs.pop('affected_users')
-    # except:
-    #     affected_users = [recipient, ]
-
     if affected_users is None:
         affected_users = [recipient, ]
 
-    for u in affected_users:
-        # don't send a notification to yourself/themself
-        if u == sender:
-            pass
-        else:
-            new_note = Notification(
-                recipient=u,
-                verb=verb,
-                sender_content_type=ContentType.objects.get_for_model(sender),
-                sender_object_id=sender.id,
-                font_icon=icon,
-            )
-            # Set the target if provided.
-            for option in ("target", "action"):
-                # obj = kwargs.pop(option, None) #don't want to remove option with pop
-                try:
-                    obj = kwargs[option]
-                    if obj is not None:
-                        setattr(new_note, "%s_content_type" % option, ContentType.objects.get_for_model(obj))
-                        setattr(new_note, "%s_object_id" % option, obj.id)
-                except:  # noqa
-                    # TODO make this except explicit, don't remember what it's doing
-                    pass
-            new_note.save()
+    return Notification.objects.bulk_notify(
+        sender,
+        affected_users,
+        verb,
+        icon=icon,
+        target=kwargs.get('target'),
+        action=kwargs.get('action'),
+    )
 
 
 notify.connect(new_notification)
@@ -366,6 +519,12 @@ def deleted_object_receiver(sender, **kwargs):
     Notification.objects.get_queryset().get_object_anywhere(object).delete()
 
 
+def updated_target_receiver(sender, instance, created, **kwargs):
+    """ Keeps the snapshots of notifications about the instance up to date, e.g. if it's renamed """
+    if not created:
+        Notification.objects.refresh_target_snapshots(instance)
+
+
 def notify_rank_up(notified_user, old_xp, new_xp):
     """ notifies user if they've ranked up.
     Mainly used alongside other notify.send
@@ -1,84 +1,168 @@
+import itertools
+import logging
+import smtplib
+
+from django.conf import settings
 from django.urls import reverse
 from django.contrib.auth import get_user_model
 from django.core import mail
 from django.core.mail import EmailMultiAlternatives
 from django.template.loader import get_template
-from django_tenants.utils import get_tenant_model, tenant_context
 
+from courses.models import CourseStudent
 from hackerspace_online.celery import app
 from quest_manager.models import QuestSubmission
 
 from profile_manager.models import Profile
 
 from siteconfig.models import SiteConfig
+from tenant.scheduler import PRIORITY_MAINTENANCE, TenantMaintenanceTask, schedule_on_all_tenants
+from utilities.metrics import QueryCounter
 
 from .models import Notification
 
+logger = logging.getLogger(__name__)
+
 User = get_user_model()
 
 
 @app.task(name='notifications.tasks.email_notification_to_users_on_all_schemas')
 def email_notification_to_users_on_all_schemas():
-    for tenant in get_tenant_model().objects.exclude(schema_name='public'):
-        with tenant_context(tenant):
-            root_url = tenant.get_root_url()
-            email_notifications_to_users_on_schema.apply_async(args=[root_url], queue='default')
+    num_schemas = schedule_on_all_tenants(
+        email_notifications_to_users_on_schema,
+        args_for_tenant=lambda tenant: [tenant.get_root_url()],
+    )
 
-    return "Scheduled email_notifications_to_users_on_schema for all schemas"
+    return f"Scheduled email_notifications_to_users_on_schema for {num_schemas} schemas"
 
 
-@app.task(name='notifications.tasks.email_notifications_to_users_on_schema')
+@app.task(base=TenantMaintenanceTask, name='notifications.tasks.email_notifications_to_users_on_schema')
 def email_notifications_to_users_on_schema(root_url):
+    """ Splits the users to email into chunks of NOTIFICATION_EMAILS_CHUNK_SIZE, which are rendered and sent
+    in parallel by the celery workers """
+    users_to_email = Profile.objects.get_mailing_list(for_notification_email=True)
+    user_ids = list(users_to_email.values_list('id', flat=True))
 
-    notification_emails = get_notification_emails(root_url)
-    connection = mail.get_connection()
-    connection.send_messages(notification_emails)
-    # send_email_notification_tenant.delay(root_url)
+    num_chunks = 0
+    for chunk in chunked(user_ids, settings.NOTIFICATION_EMAILS_CHUNK_SIZE):
+        email_notifications_to_users.apply_async(args=[root_url, chunk], priority=PRIORITY_MAINTENANCE, queue='default')
+        num_chunks += 1
+
+    return f"Scheduled notification emails to {len(user_ids)} users in {num_chunks} chunks"
+
+
+@app.task(base=TenantMaintenanceTask, name='notifications.tasks.email_notifications_to_users')
+def email_notifications_to_users(root_url, user_ids):
+    """ Renders and sends the notification emails for these users, as they are generated
 
-    return f"Sent {len(notification_emails)} notification emails"
+    Returns:
+        dict: throughput report, see utilities.metrics.QueryCounter.report(), plus the number of emails that 'failed'
+    """
+    with QueryCounter() as counter:
+        users = User.objects.filter(id__in=user_ids).order_by('id')
+        sent, failed = send_in_chunks(generate_notification_emails(users, root_url))
+
+    report = {**counter.report(emails=sent), 'failed': failed}
+    logger.info(f"Task notifications.tasks.email_notifications_to_users: {report}")
+    return report
+
+
+def chunked(iterable, size):
+    """ Yields lists of at most size items from any iterable, without loading all of it """
+    iterator = iter(iterable)
+    chunk = list(itertools.islice(iterator, size))
+    while chunk:
+        yield chunk
+        chunk = list(itertools.islice(iterator, size))
+
+
+def send_in_chunks(messages, chunk_size=None, max_retries=None):
+    """ Sends the emails over one reused connection, chunk_size at a time, as they are generated.
+    The emails are sent one by one, so if one fails only it and the rest of its chunk are retried over a new connection,
+    and the ones that were already delivered aren't sent twice.  After max_retries failures in a chunk, the rest of
+    it is given up on and the next chunk is sent.
+
+    :param messages: iterable of EmailMessages, e.g. a generator
+    :return: (number of emails sent, number of emails that failed)
+    """
+    chunk_size = chunk_size or settings.NOTIFICATION_EMAILS_CHUNK_SIZE
+    max_retries = settings.NOTIFICATION_EMAILS_MAX_RETRIES if max_retries is None else max_retries
+
+    connection = mail.get_connection()
+    sent = failed = 0
+    try:
+        for chunk in chunked(messages, chunk_size):
+            position = attempt = 0
+            while position < len(chunk):
+                try:
+                    connection.open()
+                    for message in chunk[position:]:
+                        sent += connection.send_messages([message]) or 0
+                        position += 1
+                except (smtplib.SMTPException, OSError):
+                    attempt += 1
+                    logger.warning(
+                        f"Sending {len(chunk) - position} notification emails failed (attempt {attempt})", exc_info=True
+                    )
+                    connection.close()
+                    if attempt > max_retries:
+                        failed += len(chunk) - position
+                        break
+    finally:
+        connection.close()
+
+    return sent, failed
 
 
 def get_notification_emails(root_url):
     users_to_email = Profile.objects.get_mailing_list(for_notification_email=True)
+    return list(generate_notification_emails(users_to_email, root_url))
+
+
+def generate_notification_emails(users, root_url):
+    """ Yields the notification email of each user that has something to be notified about.
+    The users are processed in chunks of NOTIFICATION_EMAILS_CHUNK_SIZE, and the unread notifications and current courses
+    of each chunk are loaded with grouped queries.
+    """
+    html_template = get_template('notifications/email_notifications.html')
+    subject = f'{SiteConfig.get().site_name_short} Notifications'
+    profile_edit_url = reverse('profiles:profile_edit_own')
 
-    notification_emails = []
+    for chunk in chunked(users, settings.NOTIFICATION_EMAILS_CHUNK_SIZE):
+        user_ids = [user.id for user in chunk]
+        enrolled_user_ids = set(CourseStudent.objects.current_courses_for_users(user_ids).values_list('user_id', flat=True))
 
-    for user in users_to_email:
-        email = generate_notification_email(user, root_url)
-        if email:
-            notification_emails.append(email)
+        unread_by_user_id = {}
+        unread = Notification.objects.get_queryset().filter(recipient_id__in=user_ids).get_unread()
+        for notification in Notification.objects.fill_snapshots(unread):
+            unread_by_user_id.setdefault(notification.recipient_id, []).append(notification)
 
-    return notification_emails
+        for user in chunk:
+            # Do not generate email notification for users that are not currently enrolled
+            if not user.is_staff and user.id not in enrolled_user_ids:
+                continue
+
+            unread_notifications = unread_by_user_id.get(user.id, [])
+            submissions_awaiting_approval = None
+            if user.is_staff:
+                submissions_awaiting_approval = QuestSubmission.objects.all_awaiting_approval(teacher=user)
+
+            if unread_notifications or submissions_awaiting_approval:
+                text_content = str(unread_notifications)
+
+                html_content = html_template.render({
+                    'user': user,
+                    'notifications': unread_notifications,
+                    'submissions': submissions_awaiting_approval,
+                    'root_url': root_url,
+                    'profile_edit_url': profile_edit_url,
+                })
+                email_msg = EmailMultiAlternatives(subject, text_content, to=[user.email])
+                email_msg.attach_alternative(html_content, "text/html")
+
+                yield email_msg
 
 
 def generate_notification_email(user, root_url):
     """Generate an email notification from user"""
-    html_template = get_template('notifications/email_notifications.html')
-    subject = f'{SiteConfig.get().site_name_short} Notifications'
-    to_email_address = user.email
-    unread_notifications = Notification.objects.all_unread(user)
-    submissions_awaiting_approval = None
-
-    if user.is_staff:
-        submissions_awaiting_approval = QuestSubmission.objects.all_awaiting_approval(teacher=user)
-
-    # Do not generate email notification for users that are not currently enrolled
-    if not user.is_staff and not user.profile.has_current_course:
-        return None
-
-    if unread_notifications or submissions_awaiting_approval:
-        text_content = str(unread_notifications)
-
-        html_content = html_template.render({
-            'user': user,
-            'notifications': unread_notifications,
-            'submissions': submissions_awaiting_approval,
-            'root_url': root_url,
-            'profile_edit_url': reverse('profiles:profile_edit_own')
-        })
-        email_msg = EmailMultiAlternatives(subject, text_content, to=[to_email_address])
-        email_msg.attach_alternative(html_content, "text/html")
-
-        return email_msg
-    else:
-        return None
+    return next(generate_notification_emails([user], root_url), None)
@@ -1,11 +1,17 @@
 from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 
 from django_tenants.test.cases import TenantTestCase
 from unittest import TestCase
 from model_bakery import baker
 from model_bakery.recipe import Recipe
 
-from notifications.models import Notification, new_notification
+from notifications.models import Notification, UnreadNotifications, new_notification
+
+User = get_user_model()
 
 
 class NotificationModelTest(TenantTestCase):
@@ -97,6 +103,174 @@ class NotificationModelTest(TenantTestCase):
         self.assertTrue(comment_hash in notification.get_url())
         self.assertTrue(comment_hash in str(notification))
 
+    def test_new_notification__affected_users(self):
+        """ Everyone affected is notified once, except the sender """
+        students = baker.make(User, _quantity=3)
+        announcement = baker.make('announcements.Announcement')
+
+        report = new_notification(
+            self.teacher,
+            target=announcement,
+            recipient=self.teacher,
+            affected_users=User.objects.filter(id__in=[self.teacher.id] + [s.id for s in students]),
+            verb="posted",
+        )
+
+        self.assertEqual(report['notifications'], 3)
+        self.assertIn('notifications_per_sec', report)
+        self.assertFalse(Notification.objects.filter(recipient=self.teacher, verb="posted").exists())
+        for student in students:
+            notification = Notification.objects.get(recipient=student)
+            self.assertEqual(notification.target_object, announcement)
+            self.assertEqual(notification.sender_object, self.teacher)
+            self.assertIsNone(notification.action_object_id)
+            self.assertIsNotNone(notification.timestamp)
+
+    def test_bulk_notify__queries_do_not_depend_on_recipients(self):
+        target = baker.make('announcements.Announcement')
+        # content types are cached after the first lookup
+        ContentType.objects.get_for_models(User, target)
+        reports = [
+            Notification.objects.bulk_notify(self.teacher, baker.make(User, _quantity=quantity), "posted", target=target)
+            for quantity in [2, 20]
+        ]
+        self.assertEqual(reports[0]['queries'], reports[1]['queries'])
+
+        # but the notifications are inserted in batches
+        recipients = baker.make(User, _quantity=25)
+        report = Notification.objects.bulk_notify(self.teacher, recipients, "posted", target=target, batch_size=10)
+        self.assertEqual(report['notifications'], 25)
+        # one insert per batch (plus setting the search path for each cursor)
+        self.assertEqual(report['queries'], reports[1]['queries'] * 3)
+
+
+class NotificationSnapshotTest(TenantTestCase):
+
+    def setUp(self):
+        self.teacher = baker.make(User, is_staff=True)
+        self.student = baker.make(User)
+        self.announcement = baker.make('announcements.Announcement', title="Original")
+        self.comment = baker.make('comments.Comment', text="<p>Some <b>comment</b></p>")
+        Notification.objects.bulk_notify(
+            self.student, [self.teacher], "commented on", target=self.announcement, action=self.comment
+        )
+        self.notification = Notification.objects.get(recipient=self.teacher, verb="commented on")
+
+    def test_bulk_notify_snapshot(self):
+        self.assertEqual(self.notification.sender_text, str(self.student))
+        self.assertEqual(self.notification.target_text, "Original")
+        self.assertEqual(self.notification.action_text, "Some comment")
+        self.assertIn(f'#comment-{self.comment.id}', self.notification.get_url())
+
+        # rendered without looking up the sender, target or action
+        with self.assertNumQueries(0):
+            link = self.notification.get_link()
+        self.assertIn("<em>Original</em>", link)
+
+    def test_save_snapshot(self):
+        """ Notifications that aren't created with bulk_notify get their snapshot when they are created """
+        notification = baker.make(Notification, target_object=self.announcement)
+        self.assertEqual(notification.target_text, "Original")
+        self.assertEqual(notification.target_url, self.announcement.get_absolute_url())
+
+    def test_fill_snapshots(self):
+        """ Notifications without a snapshot are rendered the same, from objects loaded per content type """
+        expected = [self.notification.get_link(), str(self.notification)]
+        baker.make(Notification, sender_object=self.student, target_object=self.announcement, _quantity=3)
+        notifications = Notification.objects.get_queryset().get_object_target(self.announcement).order_by('id')
+
+        captures = []
+        for quantity in [1, 4]:
+            Notification.objects.update(**{field: None for field in Notification.SNAPSHOT_FIELDS})
+            with CaptureQueriesContext(connection) as capture:
+                filled = Notification.objects.fill_snapshots(notifications[:quantity])
+            captures.append(len(capture))
+        self.assertEqual(captures[0], captures[1])
+
+        self.assertFalse(notifications.filter(sender_text=None).exists())
+        self.assertEqual([filled[0].get_link(), str(filled[0])], expected)
+
+    def test_refresh_target_snapshots(self):
+        self.announcement.title = "Renamed"
+        self.announcement.save()
+
+        self.notification.refresh_from_db()
+        self.assertEqual(self.notification.target_text, "Renamed")
+        # already up to date
+        self.assertEqual(Notification.objects.refresh_target_snapshots(self.announcement), 0)
+
+
+class UnreadNotificationsTest(TenantTestCase):
+
+    def setUp(self):
+        self.teacher = baker.make(User, is_staff=True)
+        self.student = baker.make(User)
+        cache.clear()
+
+    def notify(self, quantity=1):
+        with self.captureOnCommitCallbacks(execute=True):
+            for _ in range(quantity):
+                Notification.objects.bulk_notify(self.teacher, [self.student], "tested")
+
+    def test_get__cached(self):
+        self.notify(2)
+        data = UnreadNotifications.get(self.student)
+        self.assertEqual(data['count'], 2)
+        self.assertEqual(len(data['notifications']), 2)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(UnreadNotifications.get(self.student), data)
+
+    def test_added(self):
+        data = UnreadNotifications.get(self.student)
+        self.notify(2)
+
+        self.assertIsNone(UnreadNotifications.peek(self.student.id))
+        updated = UnreadNotifications.get(self.student)
+        self.assertEqual(updated['count'], 2)
+        self.assertNotEqual(updated['version'], data['version'])
+
+    def test_added__after_commit(self):
+        """ Until the notifications are committed, a request would count them again without them """
+        UnreadNotifications.get(self.student)
+        with self.captureOnCommitCallbacks() as callbacks:
+            Notification.objects.bulk_notify(self.teacher, [self.student], "tested")
+            self.assertIsNotNone(UnreadNotifications.peek(self.student.id))
+
+        for callback in callbacks:
+            callback()
+        self.assertIsNone(UnreadNotifications.peek(self.student.id))
+
+    def test_removed(self):
+        self.notify(3)
+        first, second, third = Notification.objects.filter(recipient=self.student).order_by('id')
+        data = UnreadNotifications.get(self.student)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            second.mark_read()
+        updated = UnreadNotifications.get(self.student)
+        self.assertEqual(updated['count'], 2)
+        self.assertNotEqual(updated['version'], data['version'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            third.delete()
+        self.assertEqual(UnreadNotifications.get(self.student)['count'], 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Notification.objects.get_queryset().mark_all_read(self.student)
+        self.assertEqual(UnreadNotifications.get(self.student)['count'], 0)
+
+    def test_removed__more_than_limit(self):
+        """ When a listed notification is read, the next unread one takes its place """
+        self.notify(UnreadNotifications.LIMIT + 2)
+        UnreadNotifications.get(self.student)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Notification.objects.filter(recipient=self.student).order_by('-id').first().mark_read()
+        data = UnreadNotifications.get(self.student)
+        self.assertEqual(data['count'], UnreadNotifications.LIMIT + 1)
+        self.assertEqual(len(data['notifications']), UnreadNotifications.LIMIT)
+
 
 class NotificationModel_html_strip_Test(TestCase):
     """
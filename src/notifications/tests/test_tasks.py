@@ -1,5 +1,10 @@
+import smtplib
+
 from django.contrib.auth import get_user_model
+from django.core import mail
 from django.core.mail import EmailMultiAlternatives
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from unittest.mock import patch
 
 from model_bakery import baker
@@ -7,7 +12,7 @@ from django_tenants.test.cases import TenantTestCase
 
 from notifications import tasks
 from notifications.models import Notification
-from notifications.tasks import generate_notification_email, get_notification_emails
+from notifications.tasks import generate_notification_email, generate_notification_emails, get_notification_emails, send_in_chunks
 from siteconfig.models import SiteConfig
 
 User = get_user_model()
@@ -165,3 +170,62 @@ class NotificationTasksTests(TenantTestCase):
         # Should not get email because they are not enrolled in any courses
         emails = get_notification_emails(root_url)
         self.assertEqual(len(emails), 0)
+
+    def test_email_notifications_to_users__chunk(self):
+        """ Emails are sent to the users with unread notifications """
+        baker.make(Notification, recipient=self.test_student1)
+        mail.outbox = []
+
+        report = tasks.email_notifications_to_users('https://test.com', [self.test_student1.id, self.test_student2.id])
+
+        self.assertEqual(report['emails'], 1)
+        self.assertEqual(report['failed'], 0)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, [self.test_student1.email])
+
+    def test_generate_notification_emails__queries_do_not_depend_on_users(self):
+        captures = []
+        for student in [self.test_student1, self.test_student2]:
+            baker.make(Notification, recipient=student, _quantity=3)
+            with CaptureQueriesContext(connection) as capture:
+                emails = list(generate_notification_emails(User.objects.filter(is_staff=False), 'https://test.com'))
+            captures.append(len(capture))
+
+        self.assertEqual(len(emails), 2)
+        self.assertEqual(captures[0], captures[1])
+
+    def test_send_in_chunks(self):
+        emails = (EmailMultiAlternatives("Subject", "Body", to=[f"user{i}@email.com"]) for i in range(5))
+        mail.outbox = []
+
+        self.assertEqual(send_in_chunks(emails, chunk_size=2), (5, 0))
+        self.assertEqual(len(mail.outbox), 5)
+
+    def test_send_in_chunks__retries(self):
+        """ A chunk that fails is retried, and given up on if it keeps failing """
+        emails = [EmailMultiAlternatives("Subject", "Body", to=[f"user{i}@email.com"]) for i in range(5)]
+        # one call per email
+        results = [smtplib.SMTPServerDisconnected(), 1, 1, smtplib.SMTPServerDisconnected(), smtplib.SMTPServerDisconnected(), 1]
+
+        with patch('django.core.mail.backends.locmem.EmailBackend.send_messages', side_effect=results) as send_messages:
+            self.assertEqual(send_in_chunks(emails, chunk_size=2, max_retries=1), (3, 2))
+
+        self.assertEqual(send_messages.call_count, 6)
+
+    def test_send_in_chunks__partly_sent(self):
+        """ If sending fails partway through a chunk, the emails that were already sent aren't sent again """
+        emails = [EmailMultiAlternatives("Subject", "Body", to=[f"user{i}@email.com"]) for i in range(5)]
+        mail.outbox = []
+        send_messages = mail.backends.locmem.EmailBackend.send_messages
+        failures = [emails[2]]
+
+        def fail_once(backend, messages):
+            if messages[0] in failures:
+                failures.remove(messages[0])
+                raise smtplib.SMTPServerDisconnected()
+            return send_messages(backend, messages)
+
+        with patch('django.core.mail.backends.locmem.EmailBackend.send_messages', autospec=True, side_effect=fail_once):
+            self.assertEqual(send_in_chunks(emails, chunk_size=5, max_retries=1), (5, 0))
+
+        self.assertEqual([email.to for email in mail.outbox], [email.to for email in emails])
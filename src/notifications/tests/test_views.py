@@ -35,6 +35,7 @@ class NotificationViewTests(ViewTestUtilsMixin, TenantTestCase):
         self.assertRedirectsLogin('notifications:read_all')
 
         self.assertRedirectsLogin('notifications:ajax')  # this doesn't make sense.  Should 404
+        self.assertRedirectsLogin('notifications:ajax_unread')
         self.assertRedirectsLogin('notifications:ajax_mark_read')  # this doesn't make sense.  Should 404
 
     def test_all_notification_page_status_codes_for_students(self):
@@ -111,3 +112,49 @@ class NotificationViewTests(ViewTestUtilsMixin, TenantTestCase):
             HTTP_X_REQUESTED_WITH='XMLHttpRequest',
         )
         self.assertEqual(response.status_code, 200)
+
+    def test_ajax_unread(self):
+        self.client.force_login(self.test_student1)
+        baker.make('notifications.Notification', recipient=self.test_student1)
+
+        response = self.client.get(reverse('notifications:ajax_unread'))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['count'], 1)
+        self.assertEqual(response['ETag'], f'"{response.json()["version"]}"')
+        self.assertIn('private', response['Cache-Control'])
+
+    def test_ajax_unread__not_modified(self):
+        """ Nothing is sent if nothing has changed since the client's version """
+        self.client.force_login(self.test_student1)
+        etag = self.client.get(reverse('notifications:ajax_unread'))['ETag']
+
+        response = self.client.get(reverse('notifications:ajax_unread'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        response = self.client.get(reverse('notifications:ajax_unread'), {'version': etag.strip('"'), 'wait': 'bad'})
+        self.assertEqual(response.status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            baker.make('notifications.Notification', recipient=self.test_student1)
+        response = self.client.get(reverse('notifications:ajax_unread'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['count'], 1)
+
+    def test_ajax_unread__long_poll(self):
+        """ Waits for a change until the timeout, then responds with 304 """
+        self.client.force_login(self.test_student1)
+        etag = self.client.get(reverse('notifications:ajax_unread'))['ETag']
+
+        with self.settings(NOTIFICATIONS_LONG_POLL_TIMEOUT=0.2, NOTIFICATIONS_LONG_POLL_INTERVAL=0.1):
+            response = self.client.get(reverse('notifications:ajax_unread'), {'wait': 30}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_ajax_unread__long_poll_not_finite(self):
+        """ nan and inf can't be used to wait forever """
+        self.client.force_login(self.test_student1)
+        etag = self.client.get(reverse('notifications:ajax_unread'))['ETag']
+
+        with self.settings(NOTIFICATIONS_LONG_POLL_TIMEOUT=0.2, NOTIFICATIONS_LONG_POLL_INTERVAL=0.1):
+            for wait in ['nan', 'inf', '-inf', '-5']:
+                response = self.client.get(reverse('notifications:ajax_unread'), {'wait': wait}, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 304)
@@ -1,16 +1,19 @@
-import json
+import math
+import time
 
+from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
-from django.contrib.contenttypes.models import ContentType
 from django.core.paginator import EmptyPage, PageNotAnInteger, Paginator
 from django.http import HttpResponse, JsonResponse
 from django.shortcuts import Http404, HttpResponseRedirect, redirect, render
 from django.urls import reverse
 from django.utils import timezone
+from django.utils.cache import patch_cache_control
+from django.utils.http import parse_etags, quote_etag
 from tenant.views import non_public_only_view
 
-from .models import Notification
+from .models import Notification, UnreadNotifications
 
 
 @non_public_only_view
@@ -27,6 +30,7 @@ def list(request):
         notifications = paginator.page(1)
     except EmptyPage:
         notifications = paginator.page(paginator.num_pages)
+    notifications.object_list = Notification.objects.fill_snapshots(notifications.object_list)
 
     context = {
         'notifications': notifications,
@@ -38,7 +42,7 @@ def list(request):
 @non_public_only_view
 @login_required
 def list_unread(request):
-    notifications = Notification.objects.all_unread(request.user)
+    notifications = Notification.objects.fill_snapshots(Notification.objects.all_unread(request.user))
     context = {
         "notifications": notifications,
     }
@@ -85,39 +89,50 @@ def read(request, id):
 @login_required
 def ajax(request):
     if request.is_ajax() and request.method == "POST":
-
-        limit = 15
-        notifications = Notification.objects.all_unread(request.user)
-        count = notifications.count()
-        # limit number of items else the list in the menu will go off
-        # the bottom of the screen and can't get the links at the bottom...
-        notifications = notifications[:limit]
-        notes = []
-        for note in notifications:
-            removable = note.target_content_type != ContentType.objects.get(
-                app_label="announcements",
-                model='announcement'
-            )
-            notes.append(
-                {
-                    'link': str(note.get_link()),
-                    'id': str(note.id),
-                    'removable': removable,
-                }
-            )
-
-        data = {
-            "notifications": notes,
-            "count": count,
-            "limit": limit,
-        }
-        json_data = json.dumps(data)
-
-        return HttpResponse(json_data, content_type='application/json')
+        data = UnreadNotifications.get(request.user)
+        return JsonResponse(data={key: data[key] for key in ["notifications", "count", "limit"]})
     else:
         raise Http404
 
 
+@non_public_only_view
+@login_required
+def ajax_unread(request):
+    """ The unread count and the links for the notifications menu, from the cache.
+
+    Supports conditional requests: if the If-None-Match header (or ?version=) matches the current version, responds
+    with 304 Not Modified.  With ?wait=<seconds> (up to NOTIFICATIONS_LONG_POLL_TIMEOUT) it waits for a change before
+    responding, only checking the cache in the meantime.  A waiting request holds on to a worker, see the setting.
+    """
+    client_etags = parse_etags(request.headers.get('If-None-Match', ''))
+    if request.GET.get('version'):
+        client_etags.append(quote_etag(request.GET['version']))
+
+    try:
+        wait = float(request.GET.get('wait', 0))
+    except ValueError:
+        wait = 0
+    if not math.isfinite(wait):
+        wait = 0
+    wait = min(max(wait, 0), settings.NOTIFICATIONS_LONG_POLL_TIMEOUT)
+    deadline = time.monotonic() + wait
+
+    data = UnreadNotifications.peek(request.user.id)
+    while data is not None and quote_etag(data['version']) in client_etags:
+        if time.monotonic() >= deadline:
+            response = HttpResponse(status=304)
+            response['ETag'] = quote_etag(data['version'])
+            return response
+        time.sleep(settings.NOTIFICATIONS_LONG_POLL_INTERVAL)
+        data = UnreadNotifications.peek(request.user.id)
+
+    data = UnreadNotifications.get(request.user)
+    response = JsonResponse(data)
+    response['ETag'] = quote_etag(data['version'])
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
 @non_public_only_view
 @login_required
 def ajax_mark_read(request):
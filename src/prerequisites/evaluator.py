@@ -0,0 +1,236 @@
+from collections import defaultdict, namedtuple
+
+from django.contrib.contenttypes.models import ContentType
+
+from prerequisites.models import IsAPrereqMixin, Prereq
+
+# One side of a Prereq: [NOT] object xN
+PrereqTerm = namedtuple('PrereqTerm', ['content_type_id', 'object_id', 'count', 'invert'])
+
+
+class PrereqGraph:
+    """
+    The whole Prereq table compiled into an in-memory AND/OR/NOT expression graph, loaded with a single query.
+
+    Each parent object, keyed by (content_type_id, object_id), has a list of Prereq ids that must ALL be met.
+    Each Prereq is a clause of one term, or two terms joined by OR.  A term can point at another Prereq,
+    which is how chains of more than two OR conditions are built.
+    """
+
+    def __init__(self):
+        self.prereq_content_type_id = ContentType.objects.get_for_model(Prereq).id
+        self.parents = defaultdict(list)  # (parent_content_type_id, parent_object_id) -> [prereq_id, ...]
+        self.clauses = {}  # prereq_id -> (PrereqTerm, PrereqTerm or None)
+        self.parent_of = {}  # prereq_id -> (parent_content_type_id, parent_object_id)
+        self.reliant = defaultdict(set)  # (content_type_id, object_id) -> {prereq_id, ...} that rely on it
+
+        rows = Prereq.objects.values_list(
+            'id', 'parent_content_type_id', 'parent_object_id',
+            'prereq_content_type_id', 'prereq_object_id', 'prereq_count', 'prereq_invert',
+            'or_prereq_content_type_id', 'or_prereq_object_id', 'or_prereq_count', 'or_prereq_invert',
+        )
+        for (prereq_id, parent_ct_id, parent_id,
+             ct_id, object_id, count, invert,
+             or_ct_id, or_object_id, or_count, or_invert) in rows:
+            term = PrereqTerm(ct_id, object_id, count, invert)
+            # same test as Prereq.condition_met()
+            or_term = PrereqTerm(or_ct_id, or_object_id, or_count, or_invert) if or_object_id and or_ct_id else None
+            self.clauses[prereq_id] = (term, or_term)
+            self.parents[(parent_ct_id, parent_id)].append(prereq_id)
+            self.parent_of[prereq_id] = (parent_ct_id, parent_id)
+            self.reliant[(ct_id, object_id)].add(prereq_id)
+            if or_term is not None:
+                self.reliant[(or_ct_id, or_object_id)].add(prereq_id)
+
+    def prereq_ids_for(self, parent_content_type_id, parent_object_id):
+        return self.parents.get((parent_content_type_id, parent_object_id), [])
+
+    def reliant_parents(self, keys, parent_content_type_id=None):
+        """
+        The reverse index: the parents whose prerequisites might no longer have the same result when any of the
+        given objects change.  That is the parent of every Prereq relying on them (the same rows as
+        Prereq.objects.all_reliant_on()), followed transitively through Prereqs that are used as prerequisites.
+
+        :param keys: (content_type_id, object_id) of the changed prerequisite objects
+        :param parent_content_type_id: optional, to only return parents of one model
+        :return: a set of (parent_content_type_id, parent_object_id)
+        """
+        parents = set()
+        seen = set()
+        to_visit = [tuple(key) for key in keys]
+        while to_visit:
+            key = to_visit.pop()
+            if key in seen:
+                continue
+            seen.add(key)
+            for prereq_id in self.reliant.get(key, ()):
+                parents.add(self.parent_of[prereq_id])
+                to_visit.append((self.prereq_content_type_id, prereq_id))
+        if parent_content_type_id is not None:
+            parents = {parent for parent in parents if parent[0] == parent_content_type_id}
+        return parents
+
+    def leaf_terms(self, prereq_ids):
+        """ All terms that are not themselves Prereqs, reachable from the given prereq ids """
+        terms = set()
+        seen = set()
+        to_visit = list(prereq_ids)
+        while to_visit:
+            prereq_id = to_visit.pop()
+            if prereq_id in seen or prereq_id not in self.clauses:
+                continue
+            seen.add(prereq_id)
+            for term in self.clauses[prereq_id]:
+                if term is None:
+                    continue
+                if term.content_type_id == self.prereq_content_type_id:
+                    to_visit.append(term.object_id)
+                else:
+                    terms.add(term)
+        return terms
+
+
+class PrereqFacts:
+    """
+    Whether each user meets each leaf term of the graph, fetched with grouped queries per prerequisite model
+    (see IsAPrereqMixin.prereq_counts_for_users).  Models that don't implement the bulk method fall back to
+    condition_met_as_prerequisite() for each user.
+    """
+
+    def __init__(self, users, terms):
+        self.users = list(users)
+        self.existing = {}  # content_type_id -> set of object ids that exist
+        self.counts = {}  # content_type_id -> {(user_id, object_id): count}, or None if not supported
+        self.uses_num_required = {}  # content_type_id -> bool
+        self._fallback = {}  # (user_id, PrereqTerm) -> bool
+
+        object_ids_by_ct = defaultdict(set)
+        for term in terms:
+            object_ids_by_ct[term.content_type_id].add(term.object_id)
+
+        user_ids = [user.id for user in self.users]
+        for ct_id, object_ids in object_ids_by_ct.items():
+            model = ContentType.objects.get_for_id(ct_id).model_class()
+            if not IsAPrereqMixin.model_is_registered(model):
+                self.existing[ct_id] = {}
+                continue
+            # The GFK uses the base manager, so archived quests etc. still exist as prerequisites
+            objects = model._base_manager.in_bulk(object_ids)
+            self.existing[ct_id] = objects
+            self.uses_num_required[ct_id] = model.prereq_uses_num_required
+            self.counts[ct_id] = model.prereq_counts_for_users(user_ids, list(objects)) if objects else {}
+
+        terms_by_ct = defaultdict(list)
+        for term in terms:
+            terms_by_ct[term.content_type_id].append(term)
+        for ct_id, ct_terms in terms_by_ct.items():
+            if self.counts.get(ct_id, {}) is not None:
+                continue
+            for term in ct_terms:
+                obj = self.existing[ct_id].get(term.object_id)
+                if obj is None:
+                    continue
+                for user in self.users:
+                    self._fallback[(user.id, term)] = obj.condition_met_as_prerequisite(user, term.count)
+
+    def add(self, user_id, content_type_id, object_id, count=1):
+        """ Records that the user got `count` more of the object since the facts were loaded, e.g. a badge they were just granted """
+        counts = self.counts.get(content_type_id)
+        if counts is not None and object_id in self.existing.get(content_type_id, {}):
+            counts[(user_id, object_id)] = counts.get((user_id, object_id), 0) + count
+
+    def exists(self, term):
+        return term.object_id in self.existing.get(term.content_type_id, {})
+
+    def met(self, user_id, term):
+        """ Whether the user meets the term, ignoring `invert`.  Assumes the term's object exists. """
+        counts = self.counts.get(term.content_type_id)
+        if counts is None:
+            return self._fallback[(user_id, term)]
+        count = counts.get((user_id, term.object_id), 0)
+        if self.uses_num_required[term.content_type_id]:
+            return count >= term.count
+        return count > 0
+
+
+class PrereqEvaluator:
+    """
+    Evaluates prerequisites for many parent objects and users at once, giving the same results as
+    Prereq.objects.all_conditions_met(parent_object, user) for each pair, but with a handful of queries in total
+    instead of several queries per Prereq, per parent object, per user.
+
+    Usage:
+        evaluator = PrereqEvaluator()
+        met = evaluator.conditions_met(Quest, users, quest_ids)  # {user_id: set of met quest ids}
+    """
+
+    def __init__(self, graph=None):
+        self.graph = graph or PrereqGraph()
+
+    def facts_for(self, parent_model, users, parent_ids):
+        """ The facts needed to evaluate the parent objects for the users, to reuse with conditions_met(facts=...) """
+        parent_ct_id = ContentType.objects.get_for_model(parent_model).id
+        prereq_ids = {
+            prereq_id for parent_id in parent_ids for prereq_id in self.graph.prereq_ids_for(parent_ct_id, parent_id)
+        }
+        return PrereqFacts(users, self.graph.leaf_terms(prereq_ids))
+
+    def conditions_met(self, parent_model, users, parent_ids, no_prereq_means=True, facts=None):
+        """
+        :param parent_model: a model class implementing HasPrereqsMixin
+        :param users: an iterable of users
+        :param parent_ids: ids of the parent_model objects to check
+        :param no_prereq_means: see PrereqManager.all_conditions_met()
+        :param facts: optional, the PrereqFacts from facts_for() with the same users and parent objects
+        :return: a dict {user_id: set of parent ids whose prerequisites have all been met by that user}
+        """
+        users = list(users)
+        parent_ids = list(parent_ids)
+        parent_ct_id = ContentType.objects.get_for_model(parent_model).id
+
+        prereq_ids_by_parent = {parent_id: self.graph.prereq_ids_for(parent_ct_id, parent_id) for parent_id in parent_ids}
+        if facts is None:
+            facts = self.facts_for(parent_model, users, parent_ids)
+
+        met = {}
+        for user in users:
+            clause_cache = {}
+            met[user.id] = {
+                parent_id for parent_id, prereq_ids in prereq_ids_by_parent.items()
+                if self._all_met(prereq_ids, user.id, facts, clause_cache, no_prereq_means)
+            }
+        return met
+
+    def _all_met(self, prereq_ids, user_id, facts, clause_cache, no_prereq_means):
+        if not prereq_ids:
+            return no_prereq_means
+        return all(self._clause_met(prereq_id, user_id, facts, clause_cache) for prereq_id in prereq_ids)
+
+    def _clause_met(self, prereq_id, user_id, facts, clause_cache):
+        """ Mirrors Prereq.condition_met() """
+        if prereq_id in clause_cache:
+            return clause_cache[prereq_id]
+        # guard against a Prereq that (indirectly) requires itself
+        clause_cache[prereq_id] = False
+
+        term, or_term = self.graph.clauses[prereq_id]
+        result = self._term_met(term, user_id, facts, clause_cache)
+        if result is not None and or_term is not None:
+            or_result = self._term_met(or_term, user_id, facts, clause_cache)
+            result = None if or_result is None else (result or or_result)
+
+        # a missing prereq object means the Prereq can't be met
+        clause_cache[prereq_id] = bool(result)
+        return clause_cache[prereq_id]
+
+    def _term_met(self, term, user_id, facts, clause_cache):
+        """ :return: True/False after applying NOT, or None if the term's object doesn't exist """
+        if term.content_type_id == self.graph.prereq_content_type_id:
+            if term.object_id not in self.graph.clauses:
+                return None
+            result = self._clause_met(term.object_id, user_id, facts, clause_cache)
+        else:
+            if not facts.exists(term):
+                return None
+            result = facts.met(user_id, term)
+        return not result if term.invert else result
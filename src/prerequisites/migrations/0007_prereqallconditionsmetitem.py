@@ -0,0 +1,33 @@
+# Generated by Django 3.2.25 on 2026-10-17 19:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('prerequisites', '0006_auto_20220629_1807'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PrereqAllConditionsMetItem',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('object_id', models.PositiveIntegerField()),
+                ('conditions_met', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='items', to='prerequisites.prereqallconditionsmet')),
+            ],
+            options={
+                'ordering': ['id'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='prereqallconditionsmet',
+            index=models.Index(fields=['user', 'model_name'], name='prerequisit_user_id_46fd15_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='prereqallconditionsmetitem',
+            constraint=models.UniqueConstraint(fields=('conditions_met', 'object_id'), name='unique_prereq_conditions_met_item'),
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 3.2.25 on 2026-10-17 19:41
+
+import json
+
+from django.db import migrations
+
+
+def ids_to_items(apps, schema_editor):
+    """ Move the ids stored as a str(list) in PrereqAllConditionsMet.ids to PrereqAllConditionsMetItem rows """
+    PrereqAllConditionsMet = apps.get_model('prerequisites', 'PrereqAllConditionsMet')
+    PrereqAllConditionsMetItem = apps.get_model('prerequisites', 'PrereqAllConditionsMetItem')
+    db_alias = schema_editor.connection.alias
+
+    items = []
+    for cache_id, ids in PrereqAllConditionsMet.objects.using(db_alias).values_list('id', 'ids').iterator():
+        try:
+            object_ids = json.loads(ids or '[]')
+        except ValueError:
+            # can't be trusted, delete it and it will be recalculated the next time it's needed
+            PrereqAllConditionsMet.objects.using(db_alias).filter(id=cache_id).delete()
+            continue
+        items.extend(
+            PrereqAllConditionsMetItem(conditions_met_id=cache_id, object_id=object_id) for object_id in set(object_ids)
+        )
+    PrereqAllConditionsMetItem.objects.using(db_alias).bulk_create(items, batch_size=1000)
+
+
+def items_to_ids(apps, schema_editor):
+    PrereqAllConditionsMet = apps.get_model('prerequisites', 'PrereqAllConditionsMet')
+    PrereqAllConditionsMetItem = apps.get_model('prerequisites', 'PrereqAllConditionsMetItem')
+    db_alias = schema_editor.connection.alias
+
+    ids_by_cache = {}
+    for cache_id, object_id in PrereqAllConditionsMetItem.objects.using(db_alias).values_list('conditions_met_id', 'object_id'):
+        ids_by_cache.setdefault(cache_id, []).append(object_id)
+
+    caches = list(PrereqAllConditionsMet.objects.using(db_alias).all())
+    for cache in caches:
+        cache.ids = str(ids_by_cache.get(cache.id, []))
+    PrereqAllConditionsMet.objects.using(db_alias).bulk_update(caches, ['ids'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('prerequisites', '0007_prereqallconditionsmetitem'),
+    ]
+
+    operations = [
+        migrations.RunPython(ids_to_items, items_to_ids),
+    ]
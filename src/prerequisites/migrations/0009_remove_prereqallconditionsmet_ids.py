@@ -0,0 +1,17 @@
+# Generated by Django 3.2.25 on 2026-10-17 19:42
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('prerequisites', '0008_prereqallconditionsmetitem_data'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='prereqallconditionsmet',
+            name='ids',
+        ),
+    ]
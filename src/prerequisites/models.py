@@ -1,4 +1,3 @@
-import json
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
 from django.conf import settings
@@ -113,9 +112,15 @@ class IsAPrereqMixin:
     2. if the model does not have a name field, then override the autocomplete_search_fields()  and dal_autocomplete_search_fields methods
      (see implementation below)
     3. implement the `condition_met_as_prerequisite(user, num_required)` method to the model class
+    4. optionally, implement the `prereq_counts_for_users(user_ids, object_ids)` class method so the bulk
+     evaluator in prerequisites.evaluator can check the prerequisite for many users without a query per user
 
     """
 
+    # Set to False on models whose condition_met_as_prerequisite() ignores `num_required`,
+    # so the bulk evaluator treats any count > 0 as met.
+    prereq_uses_num_required = True
+
     def condition_met_as_prerequisite(self, user, num_required):
         """
         Defines what it means for the user to meet this prerequisite.  For this Mixin to be any use, the implementing
@@ -127,6 +132,18 @@ class IsAPrereqMixin:
         """
         raise NotImplementedError(f"{self.__class__.__name__} model must implement a condition_met_as_prerequisite() method")
 
+    @classmethod
+    def prereq_counts_for_users(cls, user_ids, object_ids):
+        """
+        Bulk version of condition_met_as_prerequisite() used by prerequisites.evaluator.PrereqEvaluator.
+        The prerequisite is met when the count is >= num_required (or > 0 if prereq_uses_num_required is False).
+        :param user_ids: ids of the users to check
+        :param object_ids: ids of the objects of this model being used as prerequisites
+        :return: a dict {(user_id, object_id): count}, missing pairs count as 0.
+        Return None (the default) to have the evaluator fall back to condition_met_as_prerequisite() for each user.
+        """
+        return None
+
     def is_used_prereq(self):
         """
         :return: True if this object has been assigned as a prerequisite to at least one another object.
@@ -545,37 +562,140 @@ class Prereq(IsAPrereqMixin, models.Model):
         return new_prereq
 
 
+class PrereqAllConditionsMetManager(models.Manager):
+
+    def for_users(self, model_name, user_ids):
+        """ :return: a dict {user_id: cache} for users that already have a cache, deleting any duplicate caches """
+        caches = {}
+        duplicate_ids = []
+        for cache in self.get_queryset().filter(model_name=model_name, user_id__in=user_ids).order_by('id'):
+            if cache.user_id in caches:
+                duplicate_ids.append(cache.id)
+            else:
+                caches[cache.user_id] = cache
+        if duplicate_ids:
+            self.get_queryset().filter(id__in=duplicate_ids).delete()
+        return caches
+
+    def met_ids(self, user, model_name):
+        """ :return: a values queryset of the cached ids, to be used as a subquery, e.g. `filter(pk__in=met_ids)` """
+        return PrereqAllConditionsMetItem.objects.filter(
+            conditions_met__user=user, conditions_met__model_name=model_name
+        ).values('object_id')
+
+    def bulk_set_ids(self, model_name, ids_by_user_id, batch_size=500):
+        """ Replaces the cached ids for many users at once.  Only the ids that changed are inserted or deleted.
+        :param ids_by_user_id: a dict {user_id: list of ids}
+        :return: a tuple of the number of caches (updated, created)
+        """
+        caches = self.for_users(model_name, list(ids_by_user_id))
+        new_caches = [
+            self.model(user_id=user_id, model_name=model_name) for user_id in ids_by_user_id if user_id not in caches
+        ]
+        # Postgres returns the pks of bulk created objects
+        for cache in self.bulk_create(new_caches, batch_size=batch_size):
+            caches[cache.user_id] = cache
+
+        wanted = {(caches[user_id].id, object_id) for user_id, ids in ids_by_user_id.items() for object_id in ids}
+        existing = {}
+        items = PrereqAllConditionsMetItem.objects.filter(conditions_met__in=list(caches.values()))
+        for item_id, cache_id, object_id in items.values_list('id', 'conditions_met_id', 'object_id'):
+            existing[(cache_id, object_id)] = item_id
+
+        to_delete = [item_id for key, item_id in existing.items() if key not in wanted]
+        PrereqAllConditionsMetItem.objects.filter(id__in=to_delete).delete()
+        PrereqAllConditionsMetItem.objects.bulk_create(
+            [PrereqAllConditionsMetItem(conditions_met_id=cache_id, object_id=object_id)
+             for cache_id, object_id in wanted if (cache_id, object_id) not in existing],
+            batch_size=batch_size, ignore_conflicts=True,
+        )
+        return len(ids_by_user_id) - len(new_caches), len(new_caches)
+
+    def bulk_update_id(self, model_name, object_id, met_user_ids, user_ids, batch_size=500):
+        """ Adds object_id to the caches of users in met_user_ids and removes it from the other users in user_ids.
+        Users without a cache are skipped, their full cache will be calculated when it's first needed.
+        :return: the number of caches that changed
+        """
+        met_user_ids = set(met_user_ids)
+        caches = self.for_users(model_name, user_ids)
+        has_id = set(
+            PrereqAllConditionsMetItem.objects.filter(conditions_met__in=list(caches.values()), object_id=object_id)
+            .values_list('conditions_met_id', flat=True)
+        )
+        to_add = [cache.id for user_id, cache in caches.items() if user_id in met_user_ids and cache.id not in has_id]
+        to_remove = [cache.id for user_id, cache in caches.items() if user_id not in met_user_ids and cache.id in has_id]
+
+        PrereqAllConditionsMetItem.objects.bulk_create(
+            [PrereqAllConditionsMetItem(conditions_met_id=cache_id, object_id=object_id) for cache_id in to_add],
+            batch_size=batch_size, ignore_conflicts=True,
+        )
+        PrereqAllConditionsMetItem.objects.filter(conditions_met_id__in=to_remove, object_id=object_id).delete()
+        return len(to_add) + len(to_remove)
+
+
 class PrereqAllConditionsMet(models.Model):
     """This is a cache of the Prereq.objects.all_conditions_met(obj, user) method which is super innefficient and clunky
     but also critical to how this site works.
 
+    One of these exists per user and model once the cache has been calculated, and the ids of the objects whose
+    conditions are met are stored as indexed PrereqAllConditionsMetItem rows, so they can be used in a subquery.
+
     It is recalulated asynchronously using celery (see tasks.py).
     """
 
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
-    # these next two fields look like a custom Generic Foreign Key implementation?
-    ids = models.TextField(default='[]')  # str representation of a list of ids for the model, e.g '[25, 34, 55, 56, 77]'
     model_name = models.CharField(max_length=256)  # model name as a string with .get_model_name()
 
+    objects = PrereqAllConditionsMetManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'model_name']),
+        ]
+
     def add_id(self, new_id):
-        ids = self.get_ids()
-        if new_id not in ids:
-            ids.append(new_id)
-            self.set_ids(ids)
+        PrereqAllConditionsMetItem.objects.bulk_create(
+            [PrereqAllConditionsMetItem(conditions_met=self, object_id=new_id)], ignore_conflicts=True
+        )
 
     def remove_id(self, id_to_remove):
-        ids = self.get_ids()
-        if id_to_remove in ids:
-            ids.remove(id_to_remove)
-            self.set_ids(ids)
+        self.items.filter(object_id=id_to_remove).delete()
 
     def get_ids(self):
-        if self.ids:
-            return json.loads(self.ids)
-        return PrereqAllConditionsMet.ids.default
+        return list(self.items.values_list('object_id', flat=True))
+
+    def update_ids(self, checked_ids, met_ids):
+        """ Adds the met ids and removes the rest of checked_ids, any other cached ids are left alone.
+        :return: the number of ids that were added or removed
+        """
+        met_ids = set(met_ids)
+        has_ids = set(self.items.filter(object_id__in=checked_ids).values_list('object_id', flat=True))
+        to_add = [object_id for object_id in met_ids if object_id not in has_ids]
+        to_remove = [object_id for object_id in has_ids if object_id not in met_ids]
+
+        PrereqAllConditionsMetItem.objects.bulk_create(
+            [PrereqAllConditionsMetItem(conditions_met=self, object_id=object_id) for object_id in to_add], ignore_conflicts=True
+        )
+        self.items.filter(object_id__in=to_remove).delete()
+        return len(to_add) + len(to_remove)
 
     def set_ids(self, id_list=None):
         if id_list is None:
             id_list = []
-        self.ids = str(id_list)
-        self.save()
+        self.items.exclude(object_id__in=id_list).delete()
+        PrereqAllConditionsMetItem.objects.bulk_create(
+            [PrereqAllConditionsMetItem(conditions_met=self, object_id=object_id) for object_id in id_list], ignore_conflicts=True
+        )
+
+
+class PrereqAllConditionsMetItem(models.Model):
+    """The id of one object whose prerequisites have all been met, in a PrereqAllConditionsMet cache"""
+
+    conditions_met = models.ForeignKey(PrereqAllConditionsMet, related_name='items', on_delete=models.CASCADE)
+    object_id = models.PositiveIntegerField()
+
+    class Meta:
+        ordering = ['id']
+        constraints = [
+            models.UniqueConstraint(fields=['conditions_met', 'object_id'], name='unique_prereq_conditions_met_item'),
+        ]
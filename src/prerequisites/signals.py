@@ -1,11 +1,19 @@
 from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
 from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 
 from badges.models import Badge
+from courses.models import Rank
 from prerequisites.models import Prereq, HasPrereqsMixin
-from prerequisites.tasks import update_conditions_for_quest, update_quest_conditions_all_users, update_quest_conditions_for_user
+from prerequisites.tasks import (
+    update_conditions_for_quest,
+    update_quest_conditions_all_users,
+    update_quest_conditions_for_prereq_objects,
+    update_quest_conditions_for_user,
+)
+from profile_manager.signals import xp_changed
 from quest_manager.models import Quest, QuestSubmission
 from djcytoscape.models import CytoScape
 
@@ -20,6 +28,20 @@ User = get_user_model()
 #     update_quest_conditions_for_user.apply_async(args=[instance.user_id], queue='default')
 
 
+def changed_prereq_objects(instance):
+    """ :return: [content_type_id, object_id] pairs of the prerequisite objects whose conditions can be affected
+    when the instance (a BadgeAssertion or QuestSubmission) is saved or deleted.
+    """
+    if isinstance(instance, QuestSubmission):
+        objects = [instance.quest]
+        # a campaign prereq is met when all of its quests are
+        if instance.quest.campaign_id:
+            objects.append(instance.quest.campaign)
+    else:
+        objects = [instance.badge]
+    return [[ContentType.objects.get_for_model(obj).id, obj.id] for obj in objects]
+
+
 @receiver([post_save, post_delete], dispatch_uid="prerequisites.signals.update_cache_triggered_by_task_completion")
 def update_cache_triggered_by_task_completion(sender, instance, *args, **kwargs):
     """ When a user completes a task (e.g. earns a badge, has a quest submission approved or rejected, or joins a course)
@@ -36,8 +58,6 @@ def update_cache_triggered_by_task_completion(sender, instance, *args, **kwargs)
     list_of_models = ('BadgeAssertion', 'QuestSubmission', 'CourseStudent')
 
     if sender.__name__ in list_of_models:
-        # TODO Since the cache is only for quests (as prereq parent object), only need to send for affected quests, not ALL quests?
-
         # To prevent triggering update_quest_conditions_for_user more than once,
         # we check if the QuestSubmission is complete and approved.
         # When both conditions are met, that would be the only time we want to update available quests
@@ -45,7 +65,29 @@ def update_cache_triggered_by_task_completion(sender, instance, *args, **kwargs)
         if isinstance(instance, QuestSubmission) and (instance.is_completed is False or instance.is_approved is False):
             return
 
-        update_quest_conditions_for_user.apply_async(args=[instance.user_id], queue='default')
+        if sender.__name__ == 'CourseStudent':
+            # The previous grade/block/course aren't known after the save, and joining a course is rare,
+            # so recalculate everything
+            update_quest_conditions_for_user.apply_async(args=[instance.user_id], queue='default')
+        else:
+            # Only the quests that rely on the badge/quest can change
+            update_quest_conditions_for_prereq_objects.apply_async(
+                args=[instance.user_id, changed_prereq_objects(instance)], queue='default'
+            )
+
+
+@receiver(xp_changed, dispatch_uid="prerequisites.signals.update_cache_triggered_by_xp_change")
+def update_cache_triggered_by_xp_change(sender, changes, **kwargs):
+    """ When users' XP changes, the quests that rely on the Ranks with XP thresholds that were crossed
+    (in either direction) need to be re-evaluated.
+    """
+    ranks = list(Rank.objects.values_list('id', 'xp'))
+    rank_content_type_id = ContentType.objects.get_for_model(Rank).id
+    for profile, old_xp, new_xp in changes:
+        low, high = sorted([old_xp, new_xp])
+        crossed = [[rank_content_type_id, rank_id] for rank_id, rank_xp in ranks if low < rank_xp <= high]
+        if crossed:
+            update_quest_conditions_for_prereq_objects.apply_async(args=[profile.user_id, crossed], queue='default')
 
 
 # Don't need post_delete, it doesn't affect on result and will be updated on next all conditions update
@@ -1,51 +1,226 @@
+import hashlib
+import json
 import logging
+import threading
+import time
 import traceback
+from contextlib import contextmanager
 
 from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
 from django.core.cache import cache
-from django.db import transaction
+from django.db import connection, transaction
 from django.db.utils import OperationalError
 
 from tenant_schemas_celery.task import TenantTask
 
 from courses.models import CourseStudent
 from hackerspace_online.celery import app
-from prerequisites.models import Prereq, PrereqAllConditionsMet
+from prerequisites.evaluator import PrereqEvaluator, PrereqGraph
+from prerequisites.models import PrereqAllConditionsMet
 from quest_manager.models import Quest
+from utilities.metrics import QueryCounter
 
 logger = logging.getLogger(__name__)
 
 
 User = get_user_model()
 
+# see suppress_tasks()
+_local = threading.local()
+
+
+@contextmanager
+def suppress_tasks():
+    """
+    TransactionAwareTasks called in this thread while in the block aren't sent at all, e.g. by the signals of the initial
+    data loaded into the tenant template schema, which isn't a tenant that the tasks could run on.
+    """
+    previous = getattr(_local, 'suppressed', False)
+    _local.suppressed = True
+    try:
+        yield
+    finally:
+        _local.suppressed = previous
+
 
 class TransactionAwareTask(TenantTask):
+    """
+    Sends the task once the current transaction is committed.
+
+    Tasks that are idempotent can opt in to having identical calls (same task, args and schema) coalesced with
+    `coalesce=True`: while one is waiting in the queue, the others are dropped because it will see their changes anyway,
+    e.g. approving ten submissions for one student only recalculates their available quests once.  A call is pending
+    until it starts running, or for at most TASK_COALESCE_WINDOW seconds in case it's lost.  See coalesce_counts() for
+    how many calls were merged.
+
+    With `merge_first_arg=True` as well, calls only have to have the same args after the first one, which must be a list:
+    the lists of the dropped calls are kept in the cache, and the pending call runs with all of them combined.
+    """
     abstract = True
+    coalesce = False
+    merge_first_arg = False
+    MERGE_LOCK_TIMEOUT = 10
+    MERGE_LOCK_WAIT = 1
 
-    def apply_async(self, *args, **kwargs):
+    def apply_async(self, args=None, kwargs=None, **options):
+        if getattr(_local, 'suppressed', False):
+            return None
         try:
-            transaction.on_commit(lambda: super(TransactionAwareTask, self).apply_async(*args, **kwargs))
+            transaction.on_commit(lambda: self.send_coalesced(args, kwargs, **options))
         except OperationalError:
             logger.info(traceback.format_exc())
-            countdown = kwargs.get('countdown', 60)
-            kwargs['countdown'] = countdown * 2
-            return super().apply_async(*args, **kwargs)
+            countdown = options.get('countdown', 60)
+            options['countdown'] = countdown * 2
+            return super().apply_async(args, kwargs, **options)
         except Exception:
             logger.error(traceback.format_exc())
 
+    def send_coalesced(self, args=None, kwargs=None, **options):
+        """ Sends the task unless an identical call is already pending, :return: the AsyncResult, or None if merged """
+        coalesce = self.coalesce
+        if coalesce and self.merge_first_arg and not self.add_to_merged(args, kwargs):
+            # the pending call won't see this one's list, so it's sent on its own
+            coalesce = False
+        if coalesce and not cache.add(self.pending_key(args, kwargs), True, settings.TASK_COALESCE_WINDOW):
+            self.count_coalesced('merged')
+            return None
+        try:
+            result = super().apply_async(args, kwargs, **options)
+        except Exception:
+            # it was never sent, so identical calls mustn't wait for it
+            if coalesce:
+                cache.delete(self.pending_key(args, kwargs))
+            raise
+        self.count_coalesced('sent')
+        return result
+
+    def before_start(self, task_id, args, kwargs):
+        # changes made from now on won't be seen by this run, so the next identical call needs to be sent
+        if self.coalesce:
+            cache.delete(self.pending_key(args, kwargs))
+
+    def __call__(self, *args, **kwargs):
+        if self.coalesce and self.merge_first_arg:
+            # after before_start(), so calls merged from now on are sent again
+            merged = self.take_merged(args, kwargs)
+            if merged is None:
+                raise self.retry(countdown=self.MERGE_LOCK_TIMEOUT)
+            unique = {json.dumps(item, default=str): item for item in merged + list(args[0])}
+            args = (list(unique.values()),) + args[1:]
+        return super().__call__(*args, **kwargs)
+
+    def pending_key(self, args, kwargs):
+        if self.merge_first_arg:
+            args = list(args or [])[1:]
+        call = json.dumps([list(args or []), kwargs or {}], sort_keys=True, default=str)
+        return f'{connection.schema_name}-task-pending-{self.name}-{hashlib.md5(call.encode()).hexdigest()}'
+
+    def merged_key(self, args, kwargs):
+        """ The lists of the calls merged into the pending one, see merge_first_arg """
+        return f'{self.pending_key(args, kwargs)}-merged'
+
+    def acquire_merge_lock(self, merged_key):
+        """ :return: True if the lock was acquired within MERGE_LOCK_WAIT seconds """
+        deadline = time.monotonic() + self.MERGE_LOCK_WAIT
+        while not cache.add(f'{merged_key}-lock', True, self.MERGE_LOCK_TIMEOUT):
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.05)
+        return True
+
+    def add_to_merged(self, args, kwargs):
+        """ :return: True if the call's list was added to the merged ones, False if the lock was taken for too long """
+        key = self.merged_key(args, kwargs)
+        if not self.acquire_merge_lock(key):
+            return False
+        try:
+            # kept until a call takes it, even if the pending call was lost
+            cache.set(key, (cache.get(key) or []) + list(args[0]), None)
+        finally:
+            cache.delete(f'{key}-lock')
+        return True
+
+    def take_merged(self, args, kwargs):
+        """ :return: the lists of the merged calls combined, and removes them, or None if the lock was taken for too long """
+        key = self.merged_key(args, kwargs)
+        if not self.acquire_merge_lock(key):
+            return None
+        try:
+            merged = cache.get(key) or []
+            cache.delete(key)
+        finally:
+            cache.delete(f'{key}-lock')
+        return merged
+
+    def counter_key(self, counter):
+        return f'{connection.schema_name}-task-coalesce-{self.name}-{counter}'
+
+    def count_coalesced(self, counter):
+        key = self.counter_key(counter)
+        cache.add(key, 0, None)
+        try:
+            cache.incr(key)
+        except ValueError:
+            # evicted between add and incr
+            cache.set(key, 1, None)
+
+    def coalesce_counts(self):
+        """ :return: dict with the number of calls of this task that were 'sent' and 'merged' into a pending one """
+        counts = cache.get_many([self.counter_key(counter) for counter in ('sent', 'merged')])
+        return {counter: counts.get(self.counter_key(counter), 0) for counter in ('sent', 'merged')}
+
+
+def batches(user_ids, batch_size=None):
+    """ Splits a list of user ids into lists of at most CONDITIONS_UPDATE_BATCH_SIZE """
+    batch_size = batch_size or settings.CONDITIONS_UPDATE_BATCH_SIZE
+    for i in range(0, len(user_ids), batch_size):
+        yield user_ids[i:i + batch_size]
+
+
+def recalculate_quest_conditions(user_ids, evaluator=None):
+    """Recalculates the cache of available quests (PrereqAllConditionsMet) for a whole cohort of users at once.
+    The prerequisite graph is loaded once, each batch of users has its facts loaded with grouped queries,
+    and the caches are written with bulk_update/bulk_create.
 
-@app.task(base=TransactionAwareTask, bind=True, name='prerequisites.tasks.update_conditions_for_quest', max_retries=settings.CELERY_TASK_MAX_RETRIES)  # noqa
+    Args:
+        user_ids (list): ids of the users to recalculate
+        evaluator (PrereqEvaluator): optional, to reuse an already compiled prerequisite graph
+
+    Returns:
+        dict: throughput report, see utilities.metrics.QueryCounter.report()
+    """
+    with QueryCounter() as counter:
+        evaluator = evaluator or PrereqEvaluator()
+        quest_ids = list(Quest.objects.values_list('id', flat=True))
+        num_users = 0
+        for batch in batches(list(user_ids)):
+            users = list(User.objects.filter(id__in=batch))
+            met = evaluator.conditions_met(Quest, users, quest_ids)
+            ids_by_user_id = {
+                user_id: [pk for pk in quest_ids if pk in met_quest_ids] for user_id, met_quest_ids in met.items()
+            }
+            PrereqAllConditionsMet.objects.bulk_set_ids(Quest.get_model_name(), ids_by_user_id)
+            num_users += len(users)
+    return counter.report(users=num_users)
+
+
+@app.task(base=TransactionAwareTask, bind=True, name='prerequisites.tasks.update_conditions_for_quest', max_retries=settings.CELERY_TASK_MAX_RETRIES, coalesce=True)  # noqa
 def update_conditions_for_quest(self, quest_id, start_from_user_id):
     """Cycles through all relevant users and adds this quest to their cache of available quests (PrereqAllConditionsMet), if they meet the prereqs,
-    or removes it if they don't. This is done in bunches of users (CELERY_TASKS_BUNCH_SIZE), recursively.
+    or removes it if they don't. Users are evaluated in batches (CONDITIONS_UPDATE_BATCH_SIZE) and each batch of caches is
+    written with a single bulk_update.
 
     If the quest is available outside a course, it will update the cache for ALL users, otherwise it will only update
     students who are currently registered in a course.
 
     Args:
         quest_id (int): The quest with updated prerequisites (i.e this quest is the parent_object of an updated Prereq),
-        start_from_user_id (int): user_id to start with for the next bunch of calculations
+        start_from_user_id (int): user_id to start with
+
+    Returns:
+        dict: throughput report, see utilities.metrics.QueryCounter.report()
     """
     quest = Quest.objects.filter(id=quest_id).first()
     if not quest:
@@ -61,61 +236,35 @@ def update_conditions_for_quest(self, quest_id, start_from_user_id):
     # for example, when prereqs are updated, one might be deleted and two more added, that will result in 3 signals!
     cache.set(cache_key, True, 1)
 
-    if quest.available_outside_course:
-        users = User.objects.all()
-    else:
-        users = CourseStudent.objects.all_users_for_active_semester()
+    with QueryCounter() as counter:
+        if quest.available_outside_course:
+            users = User.objects.all()
+        else:
+            users = CourseStudent.objects.all_users_for_active_semester()
+        user_ids = list(users.order_by('id').filter(id__gte=start_from_user_id).values_list('id', flat=True))
 
-    users = users.order_by('id').filter(id__gte=start_from_user_id)[:settings.CELERY_TASKS_BUNCH_SIZE]
-    user = None
+        evaluator = PrereqEvaluator()
+        num_changed = 0
+        for batch in batches(user_ids):
+            users = list(User.objects.filter(id__in=batch))
+            met = evaluator.conditions_met(Quest, users, [quest.id])
+            met_user_ids = [user_id for user_id, met_quest_ids in met.items() if quest.id in met_quest_ids]
+            num_changed += PrereqAllConditionsMet.objects.bulk_update_id(Quest.get_model_name(), quest.id, met_user_ids, batch)
 
-    for user in users:
-        try:
-            quest_prereq_cache, created = PrereqAllConditionsMet.objects.get_or_create(
-                user=user,
-                model_name=Quest.get_model_name(),
-            )
-        except PrereqAllConditionsMet.MultipleObjectsReturned:
-            # why are there multiple?  Delete cache and regenerate new for this user
-            caches = PrereqAllConditionsMet.objects.filter(user=user, model_name=Quest.get_model_name())
-            caches.delete()
-            # do full recalc for the user:
-            update_quest_conditions_for_user.apply_async(args=[user.id], queue='default')
-            # carry on with the next user
-            continue
-
-        if Prereq.objects.all_conditions_met(quest, user):
-            quest_prereq_cache.add_id(quest.id)
-        else:
-            quest_prereq_cache.remove_id(quest.id)
-
-    else:
-        # finished the previous bunch, call the next bunch recursively
-        # or maybe there were no users in the bunch... check that too
-        if user:
-            # user is the last user that was updated, increment by 1
-            minimum_user_id = user.id + 1
-            user = User.objects.filter(id__gte=minimum_user_id).values('id').first()
-            if user:
-                # there are more users, so keep going.
-                self.apply_async(
-                    queue='default',
-                    # doesn't seem necessary, each group of 10 only takes about 0.1 seconds?
-                    countdown=1,  # delay a bit to give some time for the last group to finish, so we don't hog all the resources.
-                    kwargs={'quest_id': quest.id, 'start_from_user_id': minimum_user_id}
-                )
     # Return value is displayed at the end of the celery log
-    return quest.name
+    return {'quest': quest.name, 'changed': num_changed, **counter.report(users=len(user_ids))}
 
 
-@app.task(base=TransactionAwareTask, bind=True, name='prerequisites.tasks.update_quest_conditions_for_user', max_retries=settings.CELERY_TASK_MAX_RETRIES)  # noqa
+@app.task(base=TransactionAwareTask, bind=True, name='prerequisites.tasks.update_quest_conditions_for_user', max_retries=settings.CELERY_TASK_MAX_RETRIES, coalesce=True)  # noqa
 def update_quest_conditions_for_user(self, user_id):
     user = User.objects.filter(id=user_id).first()
     if not user:
         return None
-    pk_met_list = [obj.pk for obj in Quest.objects.all() if Prereq.objects.all_conditions_met(obj, user)]
-    met_list, created = PrereqAllConditionsMet.objects.update_or_create(
-        user=user, model_name=Quest.get_model_name(), defaults={'ids': str(pk_met_list)})
+    quest_ids = list(Quest.objects.values_list('id', flat=True))
+    met_quest_ids = PrereqEvaluator().conditions_met(Quest, [user], quest_ids)[user.id]
+    pk_met_list = [pk for pk in quest_ids if pk in met_quest_ids]
+    PrereqAllConditionsMet.objects.bulk_set_ids(Quest.get_model_name(), {user.id: pk_met_list})
+    met_list = PrereqAllConditionsMet.objects.get(user=user, model_name=Quest.get_model_name())
 
     logger.info(f"Task prerequisites.tasks.update_quest_conditions_for_user: Cache of available quests udpated for {user.username}")
     # Return value is displayed at the end of the celery log
@@ -123,13 +272,65 @@ def update_quest_conditions_for_user(self, user_id):
     return met_list.id
 
 
+@app.task(base=TransactionAwareTask, bind=True, name='prerequisites.tasks.update_quest_conditions_for_prereq_objects', max_retries=settings.CELERY_TASK_MAX_RETRIES, coalesce=True)  # noqa
+def update_quest_conditions_for_prereq_objects(self, user_id, prereq_objects):
+    """Updates the user's cache of available quests (PrereqAllConditionsMet) after some of their prerequisite objects changed,
+    e.g. a quest submission was approved or a badge was granted.  Only the quests that rely on those objects, directly or
+    through other Prereqs (see PrereqGraph.reliant_parents()), are re-evaluated instead of every quest.
+
+    If the user doesn't have a cache yet, the whole cache is calculated instead, and every quest counts as re-evaluated.
+
+    Args:
+        user_id (int): the user whose conditions changed
+        prereq_objects (list): [content_type_id, object_id] pairs of the changed prerequisite objects
+
+    Returns:
+        dict: {'quests': number of quests re-evaluated, 'changed': number of quests added or removed from the cache,
+            or None when the whole cache was calculated}
+    """
+    user = User.objects.filter(id=user_id).first()
+    if not user:
+        return None
+
+    met_list = PrereqAllConditionsMet.objects.for_users(Quest.get_model_name(), [user.id]).get(user.id)
+    if met_list is None:
+        update_quest_conditions_for_user(user.id)
+        return {'quests': Quest.objects.count(), 'changed': None}
+
+    graph = PrereqGraph()
+    affected = graph.reliant_parents(prereq_objects, ContentType.objects.get_for_model(Quest).id)
+    quest_ids = list(Quest.objects.filter(id__in=[object_id for _, object_id in affected]).values_list('id', flat=True))
+    if not quest_ids:
+        return {'quests': 0, 'changed': 0}
+
+    met_quest_ids = PrereqEvaluator(graph).conditions_met(Quest, [user], quest_ids)[user.id]
+    changed = met_list.update_ids(quest_ids, met_quest_ids)
+    return {'quests': len(quest_ids), 'changed': changed}
+
+
+@app.task(base=TransactionAwareTask, bind=True, name='prerequisites.tasks.update_quest_conditions_for_users', max_retries=settings.CELERY_TASK_MAX_RETRIES)  # noqa
+def update_quest_conditions_for_users(self, user_ids):
+    """Recalculates the cache of available quests for a cohort of users at once, see recalculate_quest_conditions()
+
+    Returns:
+        dict: throughput report, e.g. {'users': 1500, 'seconds': 3.2, 'queries': 40, 'users_per_sec': 468.8, 'queries_per_user': 0.03}
+    """
+    report = recalculate_quest_conditions(user_ids)
+    logger.info(f"Task prerequisites.tasks.update_quest_conditions_for_users: {report}")
+    return report
+
+
 @app.task(base=TransactionAwareTask, bind=True, name='prerequisites.tasks.update_quest_conditions_all_users', max_retries=settings.CELERY_TASK_MAX_RETRIES)  # noqa
 def update_quest_conditions_all_users(self, start_from_user_id):
-    """Cycles through all quests for all users to update the cache of available quests (PreqAllConditionsMet)
-    This is done in bunches of users (CELERY_TASKS_BUNCH_SIZE), recursively.
+    """Recalculates the cache of available quests (PreqAllConditionsMet) for all users currently in a course.
+    The whole cohort is evaluated in this task, in batches of CONDITIONS_UPDATE_BATCH_SIZE users that share
+    one compiled prerequisite graph, instead of queueing a task per user.
 
     Args:
-        user_id to start with for the next bunch of calculations
+        start_from_user_id (int): user_id to start with
+
+    Returns:
+        dict: throughput report, see utilities.metrics.QueryCounter.report()
     """
 
     if start_from_user_id == 1 and cache.get('update_conditions_all_task_waiting'):
@@ -140,21 +341,8 @@ def update_quest_conditions_all_users(self, start_from_user_id):
 
     # only cycle through users currently in a course
     users = CourseStudent.objects.all_users_for_active_semester()
-    users = users.order_by('id').filter(id__gte=start_from_user_id)
-
-    users = list(users.values_list('id', flat=True)[:settings.CELERY_TASKS_BUNCH_SIZE])  # noqa
-    for uid in users:
-        update_quest_conditions_for_user.apply_async(args=[uid], queue='default')
-
-    # Perform a recursive call to start the next chunk of users
-    # It gets the last user id in the list users[-1] and continues the next chunk with the next user id (+1).
-    # For example if the chunk size is 5 users,
-    # This method will first run
-    #    update_quest_conditions_for_user.apply_async(args=[uid], queue='default')
-    # on the first 5 usersr in the list e.g. [1, 2, 3, 4, 5].
-    # Then, this code gets the next user id by taking the last id in the list (5)
-    # and adding one (6) and then recursively calling itself starting with user
-    # id = 6.
-    if users:
-        user = User.objects.filter(id__gte=users[-1] + 1).values('id').first()
-        user and self.apply_async(args=[user['id']], queue='default', countdown=5)
+    user_ids = users.order_by('id').filter(id__gte=start_from_user_id).values_list('id', flat=True)
+
+    report = recalculate_quest_conditions(user_ids)
+    logger.info(f"Task prerequisites.tasks.update_quest_conditions_all_users: {report}")
+    return report
@@ -0,0 +1,140 @@
+from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from django_tenants.test.cases import TenantTestCase
+from model_bakery import baker
+
+from badges.models import Badge, BadgeAssertion
+from courses.models import Block, Course, CourseStudent, Grade, Rank
+from prerequisites.evaluator import PrereqEvaluator, PrereqGraph
+from prerequisites.models import Prereq
+from quest_manager.models import Category, Quest, QuestSubmission
+from siteconfig.models import SiteConfig
+
+User = get_user_model()
+
+
+class PrereqEvaluatorTest(TenantTestCase):
+
+    def setUp(self):
+        self.sem = SiteConfig.get().active_semester
+        self.users = baker.make(User, _quantity=4)
+
+        self.quest_a = baker.make(Quest, name="A")
+        self.quest_b = baker.make(Quest, name="B", max_repeats=-1)
+        self.archived_quest = baker.make(Quest, name="Archived", archived=True)
+        self.badge = baker.make(Badge, name="Badge")
+        self.rank = baker.make(Rank, name="Rank 100", xp=100)
+        self.grade = baker.make(Grade, name="Grade 99", value=99)
+        self.block = baker.make(Block)
+        self.course = baker.make(Course)
+        self.campaign = baker.make(Category)
+        baker.make(Quest, name="Campaign 1", campaign=self.campaign)
+        baker.make(Quest, name="Campaign 2", campaign=self.campaign)
+
+        # user 0: completed A twice, has the badge, enough XP, and is in the grade/block/course
+        user = self.users[0]
+        self.approve(user, self.quest_a, 2)
+        BadgeAssertion.objects.create(user=user, badge=self.badge, semester=self.sem, do_not_grant_xp=True)
+        user.profile.xp_cached = 150
+        user.profile.save()
+        CourseStudent.objects.create(user=user, semester=self.sem, block=self.block, course=self.course, grade_fk=self.grade)
+        for quest in self.campaign.quest_set.all():
+            self.approve(user, quest)
+
+        # user 1: completed A once and B, plus the archived quest (which doesn't count)
+        self.approve(self.users[1], self.quest_a)
+        self.approve(self.users[1], self.quest_b)
+        self.approve(self.users[1], self.archived_quest)
+
+        # user 2: only completed the archived quest, user 3: nothing
+        self.approve(self.users[2], self.archived_quest)
+
+        self.parents = []
+
+        def parent(**prereq_kwargs):
+            quest = baker.make(Quest)
+            Prereq.objects.create(parent_object=quest, **prereq_kwargs)
+            self.parents.append(quest)
+            return quest
+
+        parent(prereq_object=self.quest_a)
+        parent(prereq_object=self.quest_a, prereq_count=2)
+        parent(prereq_object=self.quest_a, prereq_invert=True)
+        parent(prereq_object=self.quest_b, or_prereq_object=self.badge)
+        parent(prereq_object=self.quest_b, or_prereq_object=self.badge, or_prereq_invert=True)
+        parent(prereq_object=self.archived_quest)
+        parent(prereq_object=self.rank, prereq_count=5)
+        parent(prereq_object=self.grade)
+        parent(prereq_object=self.block)
+        parent(prereq_object=self.course, prereq_invert=True)
+        parent(prereq_object=self.campaign)
+
+        # a chained OR through a named Prereq: quest_b OR badge OR rank
+        named = Prereq.objects.create(
+            name="B or Badge", parent_object=self.quest_b, prereq_object=self.quest_b, or_prereq_object=self.badge
+        )
+        parent(prereq_object=named, or_prereq_object=self.rank)
+
+        # two prereqs on one parent must both be met (AND)
+        and_parent = parent(prereq_object=self.quest_a)
+        Prereq.objects.create(parent_object=and_parent, prereq_object=self.quest_b)
+
+        # prereq object that has since been deleted
+        deleted_quest = baker.make(Quest)
+        parent(prereq_object=self.quest_a, or_prereq_object=deleted_quest)
+        deleted_quest.delete()
+
+        self.no_prereqs = baker.make(Quest)
+        self.parents.append(self.no_prereqs)
+
+    def approve(self, user, quest, times=1):
+        for _ in range(times):
+            baker.make(QuestSubmission, user=user, quest=quest, semester=self.sem, is_completed=True, is_approved=True)
+
+    def test_same_results_as_all_conditions_met(self):
+        parent_ids = [quest.id for quest in self.parents]
+        met = PrereqEvaluator().conditions_met(Quest, self.users, parent_ids)
+
+        for user in self.users:
+            expected = {quest.id for quest in self.parents if Prereq.objects.all_conditions_met(quest, user)}
+            self.assertSetEqual(met[user.id], expected)
+
+    def test_no_prereq_means(self):
+        met = PrereqEvaluator().conditions_met(Quest, self.users[:1], [self.no_prereqs.id], no_prereq_means=False)
+        self.assertSetEqual(met[self.users[0].id], set())
+
+    def test_queries_do_not_depend_on_number_of_users(self):
+        parent_ids = [quest.id for quest in self.parents]
+        graph = PrereqGraph()
+
+        with CaptureQueriesContext(connection) as one_user:
+            PrereqEvaluator(graph).conditions_met(Quest, self.users[:1], parent_ids)
+        with CaptureQueriesContext(connection) as all_users:
+            PrereqEvaluator(graph).conditions_met(Quest, self.users, parent_ids)
+
+        self.assertEqual(len(one_user), len(all_users))
+
+    def test_self_referencing_prereq(self):
+        """ A Prereq that requires itself can't be met, and doesn't recurse forever """
+        quest = baker.make(Quest)
+        prereq = Prereq.objects.create(parent_object=quest, prereq_object=self.quest_a)
+        Prereq.objects.filter(id=prereq.id).update(prereq_content_type=ContentType.objects.get_for_model(Prereq), prereq_object_id=prereq.id)
+        met = PrereqEvaluator().conditions_met(Quest, self.users, [quest.id])
+        self.assertSetEqual(met[self.users[0].id], set())
+
+    def test_reliant_parents(self):
+        """ The reverse index matches Prereq.objects.all_reliant_on(), followed through named Prereqs """
+        graph = PrereqGraph()
+        quest_ct_id = ContentType.objects.get_for_model(Quest).id
+        for obj in [self.quest_a, self.badge, self.rank, self.campaign]:
+            key = (ContentType.objects.get_for_model(obj).id, obj.id)
+            expected = {(prereq.parent_content_type_id, prereq.parent_object_id) for prereq in Prereq.objects.all_reliant_on(obj)}
+            self.assertTrue(expected.issubset(graph.reliant_parents([key])))
+
+        # the badge is also a prereq through the named "B or Badge" Prereq
+        badge_parents = graph.reliant_parents([(ContentType.objects.get_for_model(Badge).id, self.badge.id)], quest_ct_id)
+        self.assertIn((quest_ct_id, self.parents[11].id), badge_parents)
+        self.assertNotIn((quest_ct_id, self.parents[0].id), badge_parents)
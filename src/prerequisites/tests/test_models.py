@@ -9,6 +9,7 @@ from django_tenants.test.cases import TenantTestCase
 from model_bakery import baker
 
 from prerequisites.models import IsAPrereqMixin, Prereq, PrereqAllConditionsMet
+from quest_manager.models import Quest
 
 User = get_user_model()
 
@@ -291,16 +292,22 @@ class PrereqAllConditionsMetModelTest(TenantTestCase):
     def test_object_creation(self):
         self.assertIsInstance(self.prereq_cache, PrereqAllConditionsMet)
         self.assertEqual(self.prereq_cache.user, self.student)
-        self.assertEqual(self.prereq_cache.ids, '[]')
+        self.assertEqual(self.prereq_cache.get_ids(), [])
 
     def test_get_ids_when_empty(self):
         self.assertEqual([], self.prereq_cache.get_ids())
 
     def test_get_ids(self):
         ids = [1, 2, 3, 4, 5]
-        self.prereq_cache.ids = str(ids)
+        self.prereq_cache.set_ids(ids)
         self.assertEqual(ids, self.prereq_cache.get_ids())
 
+    def test_set_ids_replaces_ids(self):
+        self.prereq_cache.set_ids([1, 2, 3])
+        self.prereq_cache.set_ids([3, 4])
+        self.assertEqual(sorted(self.prereq_cache.get_ids()), [3, 4])
+        self.assertEqual(self.prereq_cache.items.count(), 2)
+
     def test_add_id(self):
         self.assertEqual(len(self.prereq_cache.get_ids()), 0)
 
@@ -312,8 +319,13 @@ class PrereqAllConditionsMetModelTest(TenantTestCase):
         self.assertEqual(len(self.prereq_cache.get_ids()), 2)
         self.assertEqual(self.prereq_cache.get_ids(), [100, 101])
 
+    def test_add_existing_id(self):
+        self.prereq_cache.add_id(100)
+        self.prereq_cache.add_id(100)
+        self.assertEqual(self.prereq_cache.get_ids(), [100])
+
     def test_remove_id(self):
-        self.prereq_cache.ids = str([1, 2, 3, 4, 5])
+        self.prereq_cache.set_ids([1, 2, 3, 4, 5])
         self.assertIn(1, self.prereq_cache.get_ids())
 
         self.prereq_cache.remove_id(1)
@@ -321,9 +333,18 @@ class PrereqAllConditionsMetModelTest(TenantTestCase):
 
     def test_remove_id_that_doesnt_exist(self):
         ids = [1, 2, 3, 4, 5]
-        self.prereq_cache.ids = str(ids)
+        self.prereq_cache.set_ids(ids)
         self.assertNotIn(6, self.prereq_cache.get_ids())
 
         self.prereq_cache.remove_id(6)
         self.assertNotIn(6, self.prereq_cache.get_ids())
         self.assertEqual(len(self.prereq_cache.get_ids()), len(ids))
+
+    def test_met_ids(self):
+        """ The cached ids can be used as a subquery """
+        quests = baker.make('quest_manager.Quest', _quantity=3)
+        self.prereq_cache.set_ids([quests[0].id, quests[2].id])
+        met_ids = PrereqAllConditionsMet.objects.met_ids(self.student, 'fake_model_name')
+        self.assertQuerysetEqual(
+            Quest.objects.filter(pk__in=met_ids).order_by('id'), [quests[0], quests[2]], transform=lambda x: x
+        )
@@ -8,9 +8,11 @@ from unittest.mock import patch
 from model_bakery import baker
 
 from badges.models import Badge, BadgeAssertion
-from courses.models import CourseStudent, Semester
+from courses.models import CourseStudent, Rank, Semester
 from prerequisites.models import Prereq
-from quest_manager.models import Quest, QuestSubmission
+from profile_manager.models import Profile
+from profile_manager.signals import xp_changed
+from quest_manager.models import Category, Quest, QuestSubmission
 from djcytoscape.models import CytoScape
 
 User = get_user_model()
@@ -37,7 +39,7 @@ class PrerequisitesSignalsTest(TenantTestCase):
                                          user=self.student,
                                          active=False)
 
-    @patch('prerequisites.signals.update_quest_conditions_for_user.apply_async')
+    @patch('prerequisites.signals.update_quest_conditions_for_prereq_objects.apply_async')
     def test_update_conditions_met_for_user_triggered_by_badge_assertion_on_create(self, task):
         """
         Creation of a new badge assertion (granting a badge to a student) should trigger a signal
@@ -45,7 +47,7 @@ class PrerequisitesSignalsTest(TenantTestCase):
         baker.make(BadgeAssertion, user=self.student, do_not_grant_xp=True, semester=self.sem)
         self.assertEqual(task.call_count, 1)
 
-    @patch('prerequisites.signals.update_quest_conditions_for_user.apply_async')
+    @patch('prerequisites.signals.update_quest_conditions_for_prereq_objects.apply_async')
     def test_update_conditions_met_for_user_triggered_by_badge_assertion_on_update(self, task):
         """
         Updating a new badge assertion (granting a badge to a student) should trigger a signal
@@ -54,7 +56,7 @@ class PrerequisitesSignalsTest(TenantTestCase):
         self.badge_assertion.save()
         self.assertEqual(task.call_count, 1)
 
-    @patch('prerequisites.signals.update_quest_conditions_for_user.apply_async')
+    @patch('prerequisites.signals.update_quest_conditions_for_prereq_objects.apply_async')
     def test_update_conditions_met_for_user_triggered_by_quest_summission_on_create(self, task):
         """
         Creation of a new quest_submission (when starting a quest) should NOT trigger a signal
@@ -62,7 +64,7 @@ class PrerequisitesSignalsTest(TenantTestCase):
         baker.make(QuestSubmission, user=self.student, is_completed=False)
         self.assertEqual(task.call_count, 0)
 
-    @patch('prerequisites.signals.update_quest_conditions_for_user.apply_async')
+    @patch('prerequisites.signals.update_quest_conditions_for_prereq_objects.apply_async')
     def test_update_conditions_met_for_user_triggered_by_quest_summission_on_update(self, task):
         """
         Updating a quest_submission (when completing a quest) should trigger a signal
@@ -72,6 +74,41 @@ class PrerequisitesSignalsTest(TenantTestCase):
         self.quest_submission.save()
         self.assertEqual(task.call_count, 1)
 
+    @patch('prerequisites.signals.update_quest_conditions_for_prereq_objects.apply_async')
+    def test_quest_submission_sends_quest_and_campaign(self, task):
+        """
+        Only the approved quest, and its campaign, are sent to be re-evaluated
+        """
+        campaign = baker.make(Category)
+        quest = baker.make(Quest, campaign=campaign)
+        submission = baker.make(QuestSubmission, user=self.student, quest=quest, is_completed=False)
+        submission.is_approved = True
+        submission.is_completed = True
+        submission.save()
+
+        task.assert_called_once_with(args=[self.student.id, [
+            [ContentType.objects.get_for_model(Quest).id, quest.id],
+            [ContentType.objects.get_for_model(Category).id, campaign.id],
+        ]], queue='default')
+
+    @patch('prerequisites.signals.update_quest_conditions_for_prereq_objects.apply_async')
+    def test_update_conditions_met_for_user_triggered_by_rank_crossed(self, task):
+        """
+        Only XP changes that cross a Rank's threshold, up or down, should trigger a signal with the crossed Ranks
+        """
+        rank = baker.make(Rank, name='Rank 100000', xp=100000)
+        rank_ct_id = ContentType.objects.get_for_model(Rank).id
+        profile = self.student.profile
+
+        xp_changed.send(sender=Profile, changes=[(profile, 100001, 150000)])
+        self.assertEqual(task.call_count, 0)
+
+        xp_changed.send(sender=Profile, changes=[(profile, 99999, 100000)])
+        task.assert_called_once_with(args=[self.student.id, [[rank_ct_id, rank.id]]], queue='default')
+
+        xp_changed.send(sender=Profile, changes=[(profile, 120000, 90000)])
+        self.assertEqual(task.call_count, 2)
+
     @patch('prerequisites.signals.update_quest_conditions_for_user.apply_async')
     def test_update_conditions_met_for_user_triggered_by_course_student_on_create(self, task):
         with patch('profile_manager.models.Profile.xp_invalidate_cache') as callback:
@@ -1 +1,187 @@
-# When prereq is changed, id is added/removed from cache
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+
+from django_tenants.test.cases import TenantTestCase
+from model_bakery import baker
+
+from courses.models import CourseStudent
+from prerequisites.models import Prereq, PrereqAllConditionsMet
+from prerequisites.tasks import (
+    recalculate_quest_conditions,
+    suppress_tasks,
+    update_conditions_for_quest,
+    update_quest_conditions_all_users,
+    update_quest_conditions_for_prereq_objects,
+    update_quest_conditions_for_user,
+    update_quest_conditions_for_users,
+)
+from quest_manager.models import Quest, QuestSubmission
+from siteconfig.models import SiteConfig
+
+User = get_user_model()
+
+
+class BatchedQuestConditionsTest(TenantTestCase):
+
+    def setUp(self):
+        self.sem = SiteConfig.get().active_semester
+        self.students = baker.make(User, _quantity=3)
+        for student in self.students:
+            baker.make(CourseStudent, user=student, semester=self.sem)
+
+        self.quest = baker.make(Quest, name="First")
+        self.reliant_quest = baker.make(Quest, name="Reliant")
+        Prereq.add_simple_prereq(self.reliant_quest, self.quest)
+
+        # only the first student has completed the prereq
+        baker.make(QuestSubmission, user=self.students[0], quest=self.quest, is_completed=True, is_approved=True, semester=self.sem)
+
+    def get_cached_ids(self, user):
+        return PrereqAllConditionsMet.objects.get(user=user, model_name=Quest.get_model_name()).get_ids()
+
+    def test_recalculate_quest_conditions_matches_single_user_task(self):
+        recalculate_quest_conditions([student.id for student in self.students])
+        batched = {student.id: self.get_cached_ids(student) for student in self.students}
+
+        for student in self.students:
+            update_quest_conditions_for_user(student.id)
+            self.assertEqual(batched[student.id], self.get_cached_ids(student))
+
+        self.assertIn(self.reliant_quest.id, batched[self.students[0].id])
+        self.assertNotIn(self.reliant_quest.id, batched[self.students[1].id])
+
+    def test_recalculate_quest_conditions_updates_existing_caches(self):
+        """ Existing caches are updated in place, and duplicates removed """
+        student = self.students[0]
+        baker.make(PrereqAllConditionsMet, user=student, model_name=Quest.get_model_name(), _quantity=2)
+
+        recalculate_quest_conditions([student.id])
+
+        self.assertEqual(PrereqAllConditionsMet.objects.filter(user=student).count(), 1)
+        self.assertIn(self.reliant_quest.id, self.get_cached_ids(student))
+
+    def test_recalculate_quest_conditions_report(self):
+        with self.settings(CONDITIONS_UPDATE_BATCH_SIZE=2):
+            report = recalculate_quest_conditions([student.id for student in self.students])
+
+        self.assertEqual(report['users'], 3)
+        for key in ['seconds', 'queries', 'users_per_sec', 'queries_per_user']:
+            self.assertIn(key, report)
+        self.assertEqual(PrereqAllConditionsMet.objects.filter(user__in=self.students).count(), 3)
+
+    def test_update_quest_conditions_all_users(self):
+        report = update_quest_conditions_all_users(1)
+
+        self.assertEqual(report['users'], 3)
+        self.assertIn(self.reliant_quest.id, self.get_cached_ids(self.students[0]))
+        self.assertNotIn(self.reliant_quest.id, self.get_cached_ids(self.students[2]))
+
+    def test_update_conditions_for_quest(self):
+        """ The quest is added to or removed from existing caches, users without a cache are skipped """
+        PrereqAllConditionsMet.objects.create(user=self.students[0], model_name=Quest.get_model_name())
+        PrereqAllConditionsMet.objects.create(user=self.students[1], model_name=Quest.get_model_name()).add_id(self.reliant_quest.id)
+
+        report = update_conditions_for_quest(quest_id=self.reliant_quest.id, start_from_user_id=1)
+
+        self.assertEqual(report['changed'], 2)
+        self.assertEqual(self.get_cached_ids(self.students[0]), [self.reliant_quest.id])
+        self.assertEqual(self.get_cached_ids(self.students[1]), [])
+        self.assertFalse(PrereqAllConditionsMet.objects.filter(user=self.students[2]).exists())
+
+    def test_recalculate_quest_conditions_only_writes_changes(self):
+        """ Items that are still met are kept rather than rewritten """
+        student = self.students[0]
+        recalculate_quest_conditions([student.id])
+        cache = PrereqAllConditionsMet.objects.get(user=student, model_name=Quest.get_model_name())
+        item_ids = set(cache.items.values_list('id', flat=True))
+
+        recalculate_quest_conditions([student.id])
+
+        self.assertSetEqual(set(cache.items.values_list('id', flat=True)), item_ids)
+
+    def test_update_quest_conditions_for_prereq_objects(self):
+        """ Only quests reliant on the changed objects are re-evaluated, other cached ids are left alone """
+        student = self.students[1]
+        unrelated_quest = baker.make(Quest, name="Unrelated")
+        Prereq.add_simple_prereq(unrelated_quest, baker.make(Quest))
+        cache = PrereqAllConditionsMet.objects.create(user=student, model_name=Quest.get_model_name())
+        # stale: the student hasn't completed the unrelated quest's prereq, but it isn't affected by this change
+        cache.add_id(unrelated_quest.id)
+
+        baker.make(QuestSubmission, user=student, quest=self.quest, is_completed=True, is_approved=True, semester=self.sem)
+        report = update_quest_conditions_for_prereq_objects(
+            student.id, [[ContentType.objects.get_for_model(Quest).id, self.quest.id]]
+        )
+
+        self.assertEqual(report, {'quests': 1, 'changed': 1})
+        self.assertSetEqual(set(self.get_cached_ids(student)), {unrelated_quest.id, self.reliant_quest.id})
+
+    def test_update_quest_conditions_for_prereq_objects_without_cache(self):
+        """ Users without a cache have their whole cache calculated """
+        student = self.students[0]
+        report = update_quest_conditions_for_prereq_objects(
+            student.id, [[ContentType.objects.get_for_model(Quest).id, self.quest.id]]
+        )
+        self.assertIn(self.reliant_quest.id, self.get_cached_ids(student))
+        self.assertEqual(report, {'quests': Quest.objects.count(), 'changed': None})
+
+
+@patch('tenant_schemas_celery.task.TenantTask.apply_async')
+class TransactionAwareTaskTest(TenantTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = baker.make(User)
+
+    def test_identical_calls_are_coalesced(self, apply_async):
+        """ Identical calls made in one transaction are sent once, when it's committed """
+        with self.captureOnCommitCallbacks(execute=True):
+            for _ in range(10):
+                update_quest_conditions_for_user.apply_async(args=[self.user.id], queue='default')
+            update_quest_conditions_for_user.apply_async(args=[self.user.id + 1], queue='default')
+            apply_async.assert_not_called()
+
+        self.assertEqual(apply_async.call_count, 2)
+        apply_async.assert_any_call([self.user.id], None, queue='default')
+        self.assertEqual(update_quest_conditions_for_user.coalesce_counts(), {'sent': 2, 'merged': 9})
+
+    def test_calls_are_sent_again_once_started(self, apply_async):
+        """ A call made after the pending one started running needs to be sent, it might have missed the changes """
+        with self.captureOnCommitCallbacks(execute=True):
+            update_quest_conditions_for_user.apply_async(args=[self.user.id])
+        update_quest_conditions_for_user.before_start('task-id', [self.user.id], {})
+        with self.captureOnCommitCallbacks(execute=True):
+            update_quest_conditions_for_user.apply_async(args=[self.user.id])
+
+        self.assertEqual(apply_async.call_count, 2)
+        self.assertEqual(update_quest_conditions_for_user.coalesce_counts(), {'sent': 2, 'merged': 0})
+
+    def test_failed_send_is_not_pending(self, apply_async):
+        """ If the task couldn't be sent, e.g. the broker is down, identical calls are still sent """
+        apply_async.side_effect = [ConnectionError(), None]
+        with self.assertRaises(ConnectionError):
+            update_quest_conditions_for_user.send_coalesced([self.user.id])
+        update_quest_conditions_for_user.send_coalesced([self.user.id])
+
+        self.assertEqual(apply_async.call_count, 2)
+
+    def test_suppress_tasks(self, apply_async):
+        with self.captureOnCommitCallbacks(execute=True):
+            with suppress_tasks():
+                update_quest_conditions_for_user.apply_async(args=[self.user.id])
+            update_quest_conditions_for_user.apply_async(args=[self.user.id + 1])
+
+        apply_async.assert_called_once()
+        self.assertEqual(apply_async.call_args.args[0], [self.user.id + 1])
+
+    def test_not_coalesced_by_default(self, apply_async):
+        """ Only tasks with coalesce=True drop identical calls """
+        self.assertFalse(update_quest_conditions_for_users.coalesce)
+        with self.captureOnCommitCallbacks(execute=True):
+            for _ in range(3):
+                update_quest_conditions_for_users.apply_async(args=[[self.user.id]])
+
+        self.assertEqual(apply_async.call_count, 3)
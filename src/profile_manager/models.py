@@ -1,4 +1,5 @@
 # import re
+from collections import defaultdict
 
 from django.conf import settings
 from django.contrib import messages
@@ -13,12 +14,14 @@ from django.urls import reverse
 from django.utils import timezone
 from django.utils.functional import cached_property
 
+import numpy
 from django_resized import ResizedImageField
 from django_tenants.utils import get_public_schema_name
 
 from badges.models import BadgeAssertion
-from courses.models import CourseStudent, Rank
+from courses.models import CourseStudent, MarkDistribution, Rank
 from notifications.signals import notify
+from profile_manager.signals import xp_changed
 from quest_manager.models import Quest, QuestSubmission
 from siteconfig.models import SiteConfig
 from utilities.models import RestrictedFileField
@@ -50,6 +53,11 @@ class ProfileQuerySet(models.query.QuerySet):
         return self.filter(user__is_active=False)
 
 
+def _as_datetime64(dt):
+    """ A timezone aware datetime as a UTC numpy.datetime64, so datetimes from different timezones compare correctly """
+    return numpy.datetime64(timezone.make_naive(dt, timezone.utc), 'us')
+
+
 class ProfileManager(models.Manager):
     def get_queryset(self):
         return ProfileQuerySet(self.model, using=self._db).select_related('user')
@@ -63,6 +71,73 @@ class ProfileManager(models.Manager):
         qs = self.all_students().filter(user__in=courses_user_list, user__is_active=True)
         return qs
 
+    def bulk_xp_invalidate_cache(self, profiles, batch_size=500):
+        """
+        Same as calling Profile.xp_invalidate_cache() for each profile, but the XP from quests, badges and course
+        adjustments is calculated for all users with one grouped query each, and the profiles are saved with bulk_update.
+        xp_changed is sent once, with all the profiles whose XP changed.
+
+        :return: the number of profiles whose XP changed
+        """
+        profiles = list(profiles)
+        user_ids = [profile.user_id for profile in profiles]
+
+        quest_xp = QuestSubmission.objects.calculate_xp_for_users(user_ids)
+        badge_xp = BadgeAssertion.objects.calculate_xp_for_users(user_ids)
+        adjustment_xp = CourseStudent.objects.calculate_xp_for_users(user_ids)
+
+        # in the same order as Profile.current_courses(), since the mark is calculated from the first course
+        courses_by_user_id = defaultdict(list)
+        current_courses = CourseStudent.objects.current_courses_for_users(user_ids).order_by('user_id', *CourseStudent._meta.ordering)
+        for course_student in current_courses:
+            courses_by_user_id[course_student.user_id].append(course_student)
+        fraction_complete = SiteConfig.get().active_semester.fraction_complete() if courses_by_user_id else None
+
+        changed = []
+        for profile in profiles:
+            old_xp = profile.xp_cached
+            profile.xp_cached = quest_xp.get(profile.user_id, 0) + badge_xp.get(profile.user_id, 0) + adjustment_xp.get(profile.user_id, 0)
+            profile.mark_cached = profile.mark(courses_by_user_id[profile.user_id], fraction_complete)
+            if profile.xp_cached != old_xp:
+                changed.append((profile, old_xp, profile.xp_cached))
+
+        self.bulk_update(profiles, ['xp_cached', 'mark_cached'], batch_size=batch_size)
+        MarkDistribution.update_profiles(profiles)
+        if changed:
+            xp_changed.send(sender=self.model, changes=changed)
+        return len(changed)
+
+    def xp_series_for_users(self, user_ids, datetimes):
+        """
+        Same as calling Profile.xp_to_date() for each of the datetimes and each of the users, but the users' submissions
+        and assertions are fetched once and each series is built with a prefix sum over the datetimes.
+
+        :param datetimes: timezone aware datetimes, in any order
+        :return: a dict {user_id: [xp at each of the datetimes]} with an entry for every user
+        """
+        user_ids = list(user_ids)
+        rows = {user_id: row for row, user_id in enumerate(user_ids)}
+        cutoffs = numpy.array([_as_datetime64(dt) for dt in datetimes], dtype='datetime64[us]')
+        order = numpy.argsort(cutoffs, kind='stable')
+
+        events = QuestSubmission.objects.xp_events_for_users(user_ids) + BadgeAssertion.objects.xp_events_for_users(user_ids)
+        # xp earned at or before a datetime counts for it and every later datetime, so add each event's xp to the
+        # first datetime it counts for and take the running sum.  Events after the last datetime land in a spare column.
+        xp_grid = numpy.zeros((len(user_ids), len(cutoffs) + 1), dtype=numpy.int64)
+        if events:
+            event_user_ids, event_times, event_xps = zip(*events)
+            event_times = numpy.array([_as_datetime64(dt) for dt in event_times], dtype='datetime64[us]')
+            columns = numpy.searchsorted(cutoffs[order], event_times, side='left')
+            numpy.add.at(xp_grid, ([rows[user_id] for user_id in event_user_ids], columns), event_xps)
+        sorted_series = numpy.cumsum(xp_grid[:, :-1], axis=1)
+
+        series = numpy.empty_like(sorted_series)
+        series[:, order] = sorted_series
+        # xp adjustments from the users' current courses don't have a date, so they count for every datetime
+        adjustment_xp = CourseStudent.objects.calculate_xp_for_users(user_ids)
+        series += numpy.array([adjustment_xp.get(user_id, 0) for user_id in user_ids], dtype=numpy.int64)[:, numpy.newaxis]
+        return {user_id: series[row].tolist() for user_id, row in rows.items()}
+
     def get_mailing_list(
         self,
         *,
@@ -349,12 +424,15 @@ class Profile(models.Model):
     #################################
 
     def xp_invalidate_cache(self):
+        old_xp = self.xp_cached
         xp = QuestSubmission.objects.calculate_xp(self.user)
         xp += BadgeAssertion.objects.calculate_xp(self.user)
         xp += CourseStudent.objects.calculate_xp(self.user)
         self.xp_cached = xp
         self.mark_cached = self.mark()
         self.save()
+        if xp != old_xp:
+            xp_changed.send(sender=self.__class__, changes=[(self, old_xp, xp)])
         return xp
 
     def xp_per_course(self):
@@ -363,6 +441,10 @@ class Profile(models.Model):
             return 0
         return self.xp_cached / course_count
 
+    def xp_series(self, datetimes):
+        """ Same as [self.xp_to_date(dt) for dt in datetimes], see ProfileManager.xp_series_for_users() """
+        return Profile.objects.xp_series_for_users([self.user_id], datetimes)[self.user_id]
+
     def xp_to_date(self, date):
         # TODO: Combine this with other methods?
         xp = QuestSubmission.objects.calculate_xp_to_date(self.user, date)
@@ -371,11 +453,16 @@ class Profile(models.Model):
         xp += CourseStudent.objects.calculate_xp(self.user)
         return xp
 
-    def mark(self):
-        courses = self.current_courses()
+    def mark(self, courses=None, fraction_complete=None):
+        """
+        :param courses: optional, the user's current courses if they've already been fetched
+        :param fraction_complete: optional, the active semester's fraction_complete() if it's already been calculated
+        """
+        if courses is None:
+            courses = self.current_courses()
         cap_at_100 = SiteConfig.get().cap_marks_at_100_percent
         if courses:
-            mark = courses[0].calc_mark(self.xp_cached) / len(courses)
+            mark = courses[0].calc_mark(self.xp_cached, fraction_complete) / len(courses)
             if cap_at_100:
                 return min(mark, 100)
             else:
@@ -457,6 +544,19 @@ def create_profile(sender, **kwargs):
                 verb='.  New user registered: ')
 
 
+@receiver(post_save, sender=Profile)
+def update_mark_distribution(sender, instance, **kwargs):
+    """ Keep the cached MarkDistribution up to date with the student's mark_cached and is_test_account """
+    MarkDistribution.update_profiles([instance])
+
+
+@receiver(post_save, sender=User)
+def update_mark_distribution_for_user(sender, instance, created, update_fields=None, **kwargs):
+    """ Inactive users and staff aren't counted in the MarkDistribution.  Logins only save last_login, so skip those. """
+    if not created and update_fields != frozenset(['last_login']):
+        MarkDistribution.update_profiles(Profile.objects.filter(user=instance))
+
+
 @receiver(post_delete, sender=Profile)
 def post_delete_user(sender, instance, *args, **kwargs):
     """If a profile is deleted, then that to cascade and delete profile as well.
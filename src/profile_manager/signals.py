@@ -0,0 +1,5 @@
+from django.dispatch import Signal
+
+# Sent when users' cached XP changes, by Profile.xp_invalidate_cache() and ProfileManager.bulk_xp_invalidate_cache(),
+# with `changes`: a list of (profile, old_xp, new_xp)
+xp_changed = Signal()
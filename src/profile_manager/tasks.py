@@ -1,6 +1,6 @@
 from hackerspace_online.celery import app
+from tenant.scheduler import TenantMaintenanceTask, schedule_on_all_tenants
 
-from django_tenants.utils import tenant_context, get_tenant_model
 from .models import Profile
 
 
@@ -9,22 +9,18 @@ def invalidate_profile_xp_cache_in_all_schemas():
     """
     Dispatcher task that calls invalidate_xp_cache_on_schema for each schema
     """
-    for tenant in get_tenant_model().objects.exclude(schema_name="public"):
-        with tenant_context(tenant):
-            invalidate_profile_xp_cache_on_schema.apply_async(queue='default')
+    num_schemas = schedule_on_all_tenants(invalidate_profile_xp_cache_on_schema)
 
-    return "Scheduled invalidate_profile_xp_cache_on_schema for all schemas"
+    return f"Scheduled invalidate_profile_xp_cache_on_schema for {num_schemas} schemas"
 
 
-@app.task(name="profile_manager.tasks.invalidate_profile_xp_cache_on_schema")
+@app.task(base=TenantMaintenanceTask, name="profile_manager.tasks.invalidate_profile_xp_cache_on_schema")
 def invalidate_profile_xp_cache_on_schema():
     """
     Invalidate xp cache of all profiles for a schema to recalculate xp
     """
 
-    profiles_qs = Profile.objects.all_for_active_semester()
+    profiles = list(Profile.objects.all_for_active_semester())
+    num_changed = Profile.objects.bulk_xp_invalidate_cache(profiles)
 
-    for profile in profiles_qs:
-        profile.xp_invalidate_cache()
-
-    return f"Successfully invalidated {profiles_qs.count()} profiles."
+    return f"Successfully invalidated {len(profiles)} profiles, {num_changed} had their XP changed."
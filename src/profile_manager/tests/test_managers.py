@@ -1,8 +1,14 @@
+from datetime import datetime, timedelta
+
 from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 from django_tenants.test.cases import TenantTestCase
 
 from model_bakery import baker
 
+from badges.models import BadgeAssertion
 from profile_manager.models import Profile
 from siteconfig.models import SiteConfig
 from courses.models import CourseStudent, Course
@@ -67,3 +73,123 @@ class ProfileManagerTest(TenantTestCase):
         expected_qs = [user.username for user in expected_qs]
 
         self.assertEqual(set(qs), set(expected_qs))
+
+
+class BulkXpInvalidateCacheTest(TenantTestCase):
+
+    def setUp(self):
+        self.active_semester = SiteConfig.get().active_semester
+        self.course = baker.make(Course, xp_for_100_percent=500)
+        self.students = baker.make(User, _quantity=4)
+
+        capped_quest = baker.make('quest_manager.Quest', xp=10, max_xp=15, max_repeats=-1)
+        entered_quest = baker.make('quest_manager.Quest', xp=5, max_xp=-1, xp_can_be_entered_by_students=True)
+        badge = baker.make('badges.Badge', xp=7)
+
+        for index, student in enumerate(self.students[:3]):
+            baker.make(CourseStudent, user=student, course=self.course, semester=self.active_semester, xp_adjustment=index)
+            # 2 approvals of the capped quest, 20 XP capped to 15
+            for _ in range(2):
+                self.approve(student, capped_quest)
+            # the greater of the quest's xp and the requested xp
+            self.approve(student, entered_quest, xp_requested=index * 10)
+            baker.make('badges.BadgeAssertion', user=student, badge=badge, semester=self.active_semester)
+
+        # doesn't count: not granting xp
+        self.approve(self.students[0], entered_quest, xp_requested=100, do_not_grant_xp=True)
+
+    def approve(self, user, quest, **kwargs):
+        baker.make('quest_manager.QuestSubmission', user=user, quest=quest, semester=self.active_semester,
+                   is_completed=True, is_approved=True, **kwargs)
+
+    def test_same_as_xp_invalidate_cache(self):
+        profiles = list(Profile.objects.filter(user__in=self.students))
+        Profile.objects.filter(user__in=self.students).update(xp_cached=999, mark_cached=999)
+
+        Profile.objects.bulk_xp_invalidate_cache(Profile.objects.filter(user__in=self.students))
+        bulk = {profile.user_id: (profile.xp_cached, profile.mark_cached) for profile in Profile.objects.filter(user__in=self.students)}
+
+        for profile in profiles:
+            profile.xp_invalidate_cache()
+            self.assertEqual(bulk[profile.user_id], (profile.xp_cached, profile.mark_cached))
+
+        self.assertEqual(bulk[self.students[0].id][0], 15 + 5 + 7 + 0)
+        self.assertEqual(bulk[self.students[2].id][0], 15 + 20 + 7 + 2)
+        self.assertEqual(bulk[self.students[3].id], (0, None))
+
+    def test_returns_number_changed(self):
+        self.assertEqual(Profile.objects.bulk_xp_invalidate_cache(Profile.objects.filter(user__in=self.students)), 3)
+        self.assertEqual(Profile.objects.bulk_xp_invalidate_cache(Profile.objects.filter(user__in=self.students)), 0)
+
+    def test_queries_do_not_depend_on_number_of_profiles(self):
+        SiteConfig.get()
+
+        def invalidate(students):
+            profiles = Profile.objects.filter(user__in=students)
+            profiles.update(xp_cached=999)
+            profiles = list(profiles)
+            with CaptureQueriesContext(connection) as context:
+                Profile.objects.bulk_xp_invalidate_cache(profiles)
+            return len(context)
+
+        self.assertEqual(invalidate(self.students[:1]), invalidate(self.students))
+
+
+class XpSeriesTest(TenantTestCase):
+
+    def setUp(self):
+        self.active_semester = SiteConfig.get().active_semester
+        self.students = baker.make(User, _quantity=3)
+        self.start = timezone.make_aware(datetime(2021, 9, 6, 23, 59, 59, 999999))
+        self.datetimes = [self.start + timedelta(days=day) for day in range(10)]
+
+        capped_quest = baker.make('quest_manager.Quest', xp=10, max_xp=25, max_repeats=-1)
+        entered_quest = baker.make('quest_manager.Quest', xp=5, max_xp=-1, xp_can_be_entered_by_students=True)
+        badge = baker.make('badges.Badge', xp=7)
+
+        for index, student in enumerate(self.students[:2]):
+            baker.make(CourseStudent, user=student, semester=self.active_semester, xp_adjustment=index * 3)
+            # 3 approvals of the capped quest on days 0, 2 and 4, the last only earns 5 XP
+            for day in [0, 2, 4]:
+                self.approve(student, capped_quest, day)
+            # approved exactly at the end of day 3, so it counts for day 3
+            self.approve(student, entered_quest, 3, xp_requested=index * 10)
+            # approved after the last datetime
+            self.approve(student, entered_quest, 12)
+            assertion = baker.make('badges.BadgeAssertion', user=student, badge=badge, semester=self.active_semester)
+            BadgeAssertion.objects.filter(id=assertion.id).update(timestamp=self.start + timedelta(days=5, hours=-1))
+
+        # don't count: not granting xp, and no time_approved
+        self.approve(self.students[0], entered_quest, 1, do_not_grant_xp=True)
+        baker.make('quest_manager.QuestSubmission', user=self.students[0], quest=entered_quest, semester=self.active_semester,
+                   is_completed=True, is_approved=True, time_approved=None)
+
+    def approve(self, user, quest, day, **kwargs):
+        baker.make('quest_manager.QuestSubmission', user=user, quest=quest, semester=self.active_semester,
+                   is_completed=True, is_approved=True, time_approved=self.start + timedelta(days=day), **kwargs)
+
+    def test_same_as_xp_to_date(self):
+        series = Profile.objects.xp_series_for_users([student.id for student in self.students], self.datetimes)
+
+        for student in self.students:
+            expected = [student.profile.xp_to_date(dt) for dt in self.datetimes]
+            self.assertListEqual(series[student.id], expected)
+            self.assertListEqual(student.profile.xp_series(self.datetimes), expected)
+
+        self.assertListEqual(series[self.students[1].id], [13, 13, 23, 33, 38, 45, 45, 45, 45, 45])
+        self.assertListEqual(series[self.students[2].id], [0] * 10)
+
+    def test_unordered_datetimes(self):
+        datetimes = self.datetimes[::-1] + [self.start]
+        expected = [self.students[0].profile.xp_to_date(dt) for dt in datetimes]
+        self.assertListEqual(self.students[0].profile.xp_series(datetimes), expected)
+
+    def test_queries_do_not_depend_on_number_of_datetimes_or_users(self):
+        SiteConfig.get()
+
+        def series(students, datetimes):
+            with CaptureQueriesContext(connection) as context:
+                Profile.objects.xp_series_for_users([student.id for student in students], datetimes)
+            return len(context)
+
+        self.assertEqual(series(self.students[:1], self.datetimes[:1]), series(self.students, self.datetimes))
@@ -1,11 +1,11 @@
 import uuid
-import json
+from collections import defaultdict, namedtuple
 
 from django.conf import settings
 from django.contrib.contenttypes.fields import GenericRelation
 from django.core.exceptions import ObjectDoesNotExist, MultipleObjectsReturned
 from django.db import models
-from django.db.models import Count, DateTimeField, ExpressionWrapper, F, Max, Q, Sum
+from django.db.models import Count, DateTimeField, Exists, ExpressionWrapper, F, Max, Q, Sum
 from django.db.models.functions import Greatest
 from django.urls import reverse
 from django.utils import timezone, datetime_safe
@@ -21,6 +21,8 @@ from tags.models import TagsModelMixin
 class Category(IsAPrereqMixin, models.Model):
     """ Used to group quests into 'Campaigns'
     """
+    prereq_uses_num_required = False
+
     title = models.CharField(max_length=50, unique=True)
     icon = models.ImageField(upload_to='icons/', null=True, blank=True)
     active = models.BooleanField(
@@ -76,6 +78,28 @@ class Category(IsAPrereqMixin, models.Model):
 
         return quests.count() == submissions.count()
 
+    @classmethod
+    def prereq_counts_for_users(cls, user_ids, object_ids):
+        """ 1 for each (user, campaign) where the user has completed every active quest in the campaign """
+        quests_by_campaign = {campaign_id: set() for campaign_id in object_ids}
+        for quest_id, campaign_id in Quest.objects.get_active().filter(campaign_id__in=object_ids).values_list('id', 'campaign_id'):
+            quests_by_campaign[campaign_id].add(quest_id)
+
+        all_quest_ids = set().union(*quests_by_campaign.values())
+        completed = {user_id: set() for user_id in user_ids}
+        approved = QuestSubmission.objects.all_approved(active_semester_only=False).filter(
+            user_id__in=user_ids, quest_id__in=all_quest_ids
+        )
+        for user_id, quest_id in approved.order_by().values_list('user_id', 'quest_id').distinct():
+            completed[user_id].add(quest_id)
+
+        return {
+            (user_id, campaign_id): 1
+            for user_id, quest_ids in completed.items()
+            for campaign_id, campaign_quest_ids in quests_by_campaign.items()
+            if campaign_quest_ids <= quest_ids
+        }
+
     @staticmethod
     def autocomplete_search_fields():  # for grapelli prereq selection
         return ("title__icontains",)
@@ -225,16 +249,13 @@ class QuestQuerySet(models.QuerySet):
         """ If there are blocking quests or blocking subs in progress, only return blocking quests.
         Otherwise, return full qs """
         blocking_quests = self.filter(blocking=True)
-        if user:
-            # Check the student's submissions in progress.
-            blocking_subs_in_progress = QuestSubmission.objects.all_not_completed(user=user, blocking=False).filter(quest__blocking=True)  # noqa
-        else:
-            blocking_subs_in_progress = False
+        if blocking_quests.exists():
+            return blocking_quests
 
-        if blocking_quests or blocking_subs_in_progress:
+        # Check the student's submissions in progress.
+        if user and QuestSubmission.objects.all_not_completed(user=user, blocking=False).filter(quest__blocking=True).exists():
             return blocking_quests
-        else:
-            return self
+        return self
 
     def datetime_available(self):
         now_local = timezone.now().astimezone(timezone.get_default_timezone())
@@ -289,8 +310,10 @@ class QuestQuerySet(models.QuerySet):
         :param user:
         :return: A queryset of the prerequisite's that have been met so far
         """
-        pk_met_list = self.get_pk_met_list(user) or [0]
-        return self.filter(pk__in=pk_met_list)
+        if not PrereqAllConditionsMet.objects.filter(user=user, model_name=Quest.get_model_name()).exists():
+            from prerequisites.tasks import update_quest_conditions_for_user
+            update_quest_conditions_for_user(user.id)
+        return self.filter(pk__in=PrereqAllConditionsMet.objects.met_ids(user, Quest.get_model_name()))
 
     def not_in_progress_completed_or_cooldown(self, user):
         """filter the queryset to remove quests that are:
@@ -300,77 +323,13 @@ class QuestQuerySet(models.QuerySet):
           4. completed and repeatable and max repeats reached this semester
           5. completed and repeatable and max all time repeats reached (for repeatable_per_semester=False)
 
-          These need to be grouped together, so that we can start with a queryset that removes all inprogress submissions first
-          and don't have to worry about them when considering repeats, which are more complicated.
+          All five conditions are calculated from a single aggregate of the user's submissions grouped by quest
+          (see QuestSubmissionQuerySet.unavailable_quest_ids()), which is excluded as a subquery.
         """
-
-        # Condition 1: remove inprogress submissions
-        # remember qs is a queryset of Quest objects, not QuestSubmission objects.
-        qs = self.not_in_progress(user)
-
-        # This is completed submissions and quests ALL TIME, not just current semester
-        completed_subs_all_time = QuestSubmission.objects.all_completed(user=user, active_semester_only=False)
-        completed_quests_all_time = qs.filter(pk__in=completed_subs_all_time.values_list('quest__id', flat=True))
-
-        # This is completed submissions THIS SEMESTER ONLY
-        completed_subs_current = QuestSubmission.objects.all_completed(user=user)
-        completed_quests_current = qs.filter(pk__in=completed_subs_current.values_list('quest__id', flat=True))
-
-        # Condition 2: remove completed submissions that are not repeatable
-        subs_to_exclude_2 = completed_subs_all_time.filter(Q(quest__max_repeats=0) & Q(quest__repeat_per_semester=False))
-        quests_to_exclude = subs_to_exclude_2.values_list('quest__id', flat=True)
-
-        qs = qs.exclude(pk__in=quests_to_exclude)
-
-        # Condition 3: remove completed submissions that are repeatable, but still in cooldown
-
-        # Calculate the cooldown expression based on hours_between_repeats
-        current_time = timezone.now()
-        cooldown_time = ExpressionWrapper(
-            current_time - F('hours_between_repeats') * timezone.timedelta(hours=1),
-            output_field=DateTimeField()
-        )
-
-        # start with completed subs this semester (already filtered our non-repeatable)
-        # annotate the latest `first_time_completed` for submissions of this quest
-        # so we can use that time to determine if cooldown is complete
-        cooldown_quests = completed_quests_current.annotate(
-            latest_submission_time=Max(
-                'questsubmission__first_time_completed',
-                filter=Q(questsubmission__user_id=user.id)
-            )
+        submissions = QuestSubmission.objects.get_queryset(
+            exclude_archived_quests=False, exclude_quests_not_visible_to_students=False, include_related=False
         )
-        # Quests in cooldown will have latest_submission_time > now - hours_between_repeats
-        # (cooldown_time = now - hours_between_repeats)
-        cooldown_quests = cooldown_quests.filter(latest_submission_time__gt=cooldown_time)
-
-        qs = qs.exclude(pk__in=cooldown_quests)
-
-        # CONDITION 4: remove completed and repeatable and max repeats reached this semester
-        max_repeats_this_sem = completed_quests_current.annotate(
-            submission_count=Count(
-                'questsubmission',
-                filter=Q(questsubmission__user_id=user.id)
-            )
-        )
-        # need to account for max_repeats=-1 (unlimited repeats), don't remove those
-        max_repeats_this_sem = max_repeats_this_sem.filter(~Q(max_repeats=-1) & Q(submission_count__gt=F('max_repeats')))
-
-        qs = qs.exclude(pk__in=max_repeats_this_sem)
-
-        # CONDITION 5: remove completed and repeatable and max all-time repeats reached (for repeatable_per_semester=False)
-        max_repeats_all_time = completed_quests_all_time.filter(repeat_per_semester=False).annotate(
-            submission_count=Count(
-                'questsubmission',
-                filter=Q(questsubmission__user_id=user.id)
-            )
-        )
-        # need to account for max_repeats=-1 (unlimited repeats), don't remove those
-        max_repeats_all_time = max_repeats_all_time.filter(~Q(max_repeats=-1) & Q(submission_count__gt=F('max_repeats')))
-
-        qs = qs.exclude(pk__in=max_repeats_all_time)
-
-        return qs
+        return self.exclude(pk__in=submissions.unavailable_quest_ids(user))
 
     def not_in_progress(self, user):
         """
@@ -392,7 +351,11 @@ class QuestQuerySet(models.QuerySet):
             from prerequisites.tasks import update_quest_conditions_for_user
             pk_met_list = update_quest_conditions_for_user(user.id)
             pk_met_list = PrereqAllConditionsMet.objects.get(id=pk_met_list)
-        return json.loads(pk_met_list.ids)
+        return pk_met_list.get_ids()
+
+
+# The evaluated result of QuestManager.get_available_list()
+AvailableQuests = namedtuple('AvailableQuests', ['quests', 'count', 'blocked'])
 
 
 class QuestManager(models.Manager):
@@ -429,6 +392,30 @@ class QuestManager(models.Manager):
         qs = self.get_active().get_conditions_met(user).available_without_course()
         return qs.not_in_progress_completed_or_cooldown(user)
 
+    def get_available_list(self, user, remove_hidden=True, without_course=False):
+        """ The same quests as get_available() (or get_available_without_course()), but evaluated with a single query:
+        whether the user has a blocking quest in progress is annotated on each row, so blocking (8) and hidden quests
+        are handled in python instead of with more queries on the result.
+
+        :return: AvailableQuests(quests, count, blocked), where blocked is True if only blocking quests are included
+        """
+        qs = self.get_active().select_related('campaign').get_conditions_met(user)
+        if without_course:
+            quests = list(qs.available_without_course().not_in_progress_completed_or_cooldown(user))
+            return AvailableQuests(quests, len(quests), False)
+
+        blocking_subs_in_progress = QuestSubmission.objects.all_not_completed(user=user).filter(quest__blocking=True)
+        qs = qs.not_in_progress_completed_or_cooldown(user).annotate(blocking_sub_in_progress=Exists(blocking_subs_in_progress))
+        quests = list(qs)
+
+        blocked = any(quest.blocking or quest.blocking_sub_in_progress for quest in quests)
+        if blocked:
+            quests = [quest for quest in quests if quest.blocking]
+        if remove_hidden:
+            hidden_quest_ids = {str(quest_id) for quest_id in user.profile.get_hidden_quests_as_list()}
+            quests = [quest for quest in quests if str(quest.id) not in hidden_quest_ids]
+        return AvailableQuests(quests, len(quests), blocked)
+
     def all_drafts(self, user):
         qs = self.get_queryset().filter(visible_to_students=False)
 
@@ -564,6 +551,14 @@ class Quest(IsAPrereqMixin, HasPrereqsMixin, TagsModelMixin, XPItem):
         # print("num_approved: " + str(num_approved) + "/" + str(num_required))
         return num_approved >= num_required
 
+    @classmethod
+    def prereq_counts_for_users(cls, user_ids, object_ids):
+        """ Number of approved submissions per (user, quest), same submissions as condition_met_as_prerequisite() """
+        submissions = QuestSubmission.objects.get_queryset(include_related=False).approved()
+        submissions = submissions.filter(user_id__in=user_ids, quest_id__in=object_ids)
+        rows = submissions.order_by().values_list('user_id', 'quest_id').annotate(count=Count('id'))
+        return {(user_id, quest_id): count for user_id, quest_id, count in rows}
+
     def is_editable(self, user):
         if user.is_staff:
             return True
@@ -651,6 +646,43 @@ class QuestSubmissionQuerySet(models.query.QuerySet):
 
             return self.filter(pk__in=pk_sub_list)
 
+    def unavailable_quest_ids(self, user):
+        """ The ids of quests the user can't start right now because of their submissions, with one grouped aggregate
+        over the user's submissions per quest (see QuestQuerySet.not_in_progress_completed_or_cooldown()):
+          1. in progress (any semester)
+          2. completed and not repeatable
+          3. completed this semester and still in cooldown, i.e. a submission was first completed less than
+             hours_between_repeats ago
+          4. completed this semester and max repeats reached
+          5. completed and max all time repeats reached (for repeat_per_semester=False)
+
+        Note that repeats are counted from all of the user's submissions of the quest, from any semester.
+        :return: a values queryset of quest ids, to be used as a subquery
+        """
+        cooldown_time = ExpressionWrapper(
+            timezone.now() - F('quest__hours_between_repeats') * timezone.timedelta(hours=1),
+            output_field=DateTimeField()
+        )
+        completed = Q(is_completed=True)
+        facts = self.filter(user=user).order_by().values('quest_id').annotate(
+            num_subs=Count('id'),
+            max_repeats=Max('quest__max_repeats'),
+            # in progress submissions only count for quests that are visible and not archived
+            in_progress=Count('id', filter=Q(is_completed=False, quest__visible_to_students=True, quest__archived=False)),
+            completed_not_repeatable=Count('id', filter=completed & Q(quest__max_repeats=0, quest__repeat_per_semester=False)),
+            completed_this_semester=Count('id', filter=completed & Q(semester_id=SiteConfig.get().active_semester_id)),
+            completed_not_per_semester=Count('id', filter=completed & Q(quest__repeat_per_semester=False)),
+            in_cooldown=Count('id', filter=Q(first_time_completed__gt=cooldown_time)),
+        )
+        max_repeats_reached = ~Q(max_repeats=-1) & Q(num_subs__gt=F('max_repeats'))
+        return facts.filter(
+            Q(in_progress__gt=0)  # 1
+            | Q(completed_not_repeatable__gt=0)  # 2
+            | Q(completed_this_semester__gt=0, in_cooldown__gt=0)  # 3
+            | Q(completed_this_semester__gt=0) & max_repeats_reached  # 4
+            | Q(completed_not_per_semester__gt=0) & max_repeats_reached  # 5
+        ).values('quest_id')
+
     def exclude_archived_quests(self):
         return self.exclude(quest__archived=True)
 
@@ -850,6 +882,46 @@ class QuestSubmissionManager(models.Manager):
 
         return total_xp
 
+    def calculate_xp_for_users(self, user_ids):
+        """
+        Same as calculate_xp(), but for many users at once, with a single query grouped by user and quest.
+        :return: a dict {user_id: xp}, users without any xp granting submissions are not included
+        """
+        submissions_qs = self.all_approved().filter(user_id__in=user_ids).grant_xp()
+        submissions_qs = submissions_qs.annotate(xp_earned=Greatest('quest__xp', 'xp_requested'))
+        submission_xps = submissions_qs.order_by().values('user', 'quest', 'quest__max_xp').annotate(xp_sum=Sum('xp_earned'))
+
+        xp_by_user_id = defaultdict(int)
+        for submission_xp in submission_xps:
+            if submission_xp['quest__max_xp'] == -1:  # no limit
+                xp_by_user_id[submission_xp['user']] += submission_xp['xp_sum']
+            else:
+                # Prevent xp going over the maximum gainable xp, same as calculate_xp_to_date()
+                xp_by_user_id[submission_xp['user']] += min(submission_xp['xp_sum'], submission_xp['quest__max_xp'] or 0)
+        return dict(xp_by_user_id)
+
+    def xp_events_for_users(self, user_ids):
+        """
+        The XP that each of the users' xp granting submissions added to their total when it was approved, used to build
+        XP over time series (see ProfileManager.xp_series_for_users()).  Submissions are walked in order of approval so
+        each quest's max_xp caps the running total the same way calculate_xp_to_date() does for any date.
+        :return: a list of (user_id, time_approved, xp) tuples, submissions without a time_approved are not included
+        """
+        submissions_qs = self.all_approved().filter(user_id__in=user_ids, time_approved__isnull=False).grant_xp()
+        submissions_qs = submissions_qs.annotate(xp_earned=Greatest('quest__xp', 'xp_requested'))
+        rows = submissions_qs.order_by('time_approved').values_list(
+            'user_id', 'quest_id', 'quest__max_xp', 'time_approved', 'xp_earned'
+        )
+
+        events = []
+        xp_sums = defaultdict(int)  # {(user_id, quest_id): uncapped xp so far}
+        for user_id, quest_id, max_xp, time_approved, xp_earned in rows:
+            previous_xp = xp_sums[user_id, quest_id] if max_xp == -1 else min(xp_sums[user_id, quest_id], max_xp or 0)
+            xp_sums[user_id, quest_id] += xp_earned
+            xp = xp_sums[user_id, quest_id] if max_xp == -1 else min(xp_sums[user_id, quest_id], max_xp or 0)
+            events.append((user_id, time_approved, xp - previous_xp))
+        return events
+
     def remove_in_progress(self):
         # In Progress Quests
         qs = self.all_not_completed(active_semester_only=False)
@@ -1,12 +1,15 @@
 from datetime import datetime, timedelta, timezone
 
 from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.utils.timezone import localtime
 # from django.test import tag
 from freezegun import freeze_time
 from model_bakery import baker
 
 from courses.models import Semester
+from prerequisites.tasks import update_quest_conditions_for_user
 from quest_manager.models import Quest, QuestSubmission
 from siteconfig.models import SiteConfig
 from django_tenants.test.cases import TenantTestCase
@@ -173,6 +176,8 @@ class QuestQuerysetTest(TenantTestCase):
 
 @freeze_time('2018-10-12 00:54:00', tz_offset=0)
 class QuestManagerTest(TenantTestCase):
+    # checking the prereq cache exists, and the available quests with all their facts
+    AVAILABLE_LIST_QUERY_CEILING = 2
 
     def setUp(self):
         # get a list all quests created in data migrations
@@ -497,6 +502,74 @@ class QuestManagerTest(TenantTestCase):
         # and just registered
         self.assertEqual(Quest.objects.get_available(new_student).count(), 2)
 
+    def assert_available_list_matches(self, user, remove_hidden=True):
+        expected = list(Quest.objects.get_available(user, remove_hidden))
+        available = Quest.objects.get_available_list(user, remove_hidden)
+        self.assertListEqual(available.quests, expected)
+        self.assertEqual(available.count, len(expected))
+        return available
+
+    def test_get_available_list(self):
+        """ QuestManager.get_available_list should evaluate the same quests as get_available, and the blocking state """
+        active_semester = self.make_test_quests_and_submissions_stack()
+        SiteConfig.get().set_active_semester(active_semester.id)
+
+        available = self.assert_available_list_matches(self.student)
+        self.assertTrue(available.blocked)
+
+        # Start the blocking quest, nothing should be available
+        blocking_quest = Quest.objects.get(name='Quest-blocking')
+        blocking_sub = baker.make(QuestSubmission, quest=blocking_quest, user=self.student, semester=active_semester)
+        available = self.assert_available_list_matches(self.student)
+        self.assertTrue(available.blocked)
+        self.assertEqual(available.count, 0)
+
+        blocking_sub.mark_completed()
+        available = self.assert_available_list_matches(self.student)
+        self.assertFalse(available.blocked)
+
+        self.student.profile.hide_quest(Quest.objects.get(name='Quest-not-started').id)
+        self.assertEqual(self.assert_available_list_matches(self.student).count, available.count - 1)
+        self.assertEqual(self.assert_available_list_matches(self.student, remove_hidden=False).count, available.count)
+
+    def test_get_available_list__without_course(self):
+        quest = baker.make(Quest, name='Quest-outside-course', available_outside_course=True)
+        update_quest_conditions_for_user(self.student.id)
+
+        available = Quest.objects.get_available_list(self.student, without_course=True)
+        self.assertListEqual(available.quests, list(Quest.objects.get_available_without_course(self.student)))
+        self.assertIn(quest, available.quests)
+
+    def test_get_available_list__query_count(self):
+        """ Regression benchmark: the number of queries should not grow with the number of quests or submissions """
+        active_semester = baker.make(Semester)
+        SiteConfig.get().set_active_semester(active_semester.id)
+
+        def make_quests_and_submissions(num_quests):
+            for quest in baker.make(Quest, max_repeats=3, _quantity=num_quests):
+                sub = baker.make(QuestSubmission, quest=quest, user=self.student, semester=active_semester)
+                sub.mark_completed()
+            update_quest_conditions_for_user(self.student.id)
+
+        make_quests_and_submissions(2)
+        Quest.objects.get_available_list(self.student)  # warm up the SiteConfig cache
+        with CaptureQueriesContext(connection) as few:
+            available = Quest.objects.get_available_list(self.student)
+        self.assertEqual(available.count, 3)
+
+        make_quests_and_submissions(20)
+        with CaptureQueriesContext(connection) as many:
+            available = Quest.objects.get_available_list(self.student)
+        # the quests are repeatable, and the 'Welcome to ByteDeck!' quest is also available
+        self.assertEqual(available.count, 23)
+
+        def statements(context):
+            # django-tenants sets the search path before queries, those don't count
+            return [query['sql'] for query in context.captured_queries if not query['sql'].startswith('SET search_path')]
+
+        self.assertEqual(len(statements(many)), len(statements(few)))
+        self.assertLessEqual(len(statements(many)), self.AVAILABLE_LIST_QUERY_CEILING, statements(many))
+
     def make_test_quests_and_submissions_stack(self):
         """  Creates 6 quests with related submissions
         Quest                   sub     .completed   .semester
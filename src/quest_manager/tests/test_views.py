@@ -1637,15 +1637,16 @@ class QuestListViewTest(ViewTestUtilsMixin, TenantTestCase):
         self.client.force_login(self.test_student)
         student_response = self.client.get(reverse('quests:available'))
 
-        # get queryset from view context and order it as intended
+        # get quests from view context and order them as intended
+        # (staff get a queryset, students an already evaluated list)
         for response in [staff_response, student_response]:
-            displayed_order = response.context['available_quests']
+            displayed_order = [quest.id for quest in response.context['available_quests']]
 
             # proper quest ordering is pulled directly from the parent model XPItem's "ordering" meta value
-            intended_order = displayed_order.order_by(*XPItem._meta.ordering)
+            intended_order = Quest.objects.filter(id__in=displayed_order).order_by(*XPItem._meta.ordering)
 
             # assert ordered view is unchanged from displayed view
-            self.assertQuerysetEqual(displayed_order, intended_order)
+            self.assertListEqual(displayed_order, list(intended_order.values_list('id', flat=True)))
 
     def test_context_correct_tab_types(self):
         """ Checks each possible tab for student and teacher individually if it can be activated
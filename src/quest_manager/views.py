@@ -467,10 +467,9 @@ def quest_list(request, quest_id=None, template="quest_manager/quests.html"):
             )
         )
     else:
-        if request.user.profile.has_current_course:
-            available_quests = Quest.objects.get_available(request.user, remove_hidden)
-        else:
-            available_quests = Quest.objects.get_available_without_course(request.user)
+        available_quests = Quest.objects.get_available_list(
+            request.user, remove_hidden, without_course=not request.user.profile.has_current_course
+        ).quests
 
     in_progress_submissions = QuestSubmission.objects.all_not_completed(
         request.user, blocking=True
@@ -1,3 +1,4 @@
+import threading
 from copy import copy
 from allauth.socialaccount.models import SocialApp
 from allauth.socialaccount.providers.google.provider import GoogleProvider
@@ -12,6 +13,7 @@ from django.shortcuts import get_object_or_404
 from django.templatetags.static import static
 from django.conf import settings
 
+from celery.signals import task_postrun, task_prerun
 from django_tenants.utils import get_public_schema_name, schema_context
 from redis import exceptions as redis_exceptions
 
@@ -20,6 +22,59 @@ from utilities.models import RestrictedFileField
 User = get_user_model()
 
 
+class SiteConfigRequestCache(threading.local):
+    """
+    Memoizes SiteConfig.get() for the duration of a request (see SiteConfigCacheMiddleware) or a celery task,
+    so the SiteConfig is only fetched from the cache once per scope instead of on every call.
+    Outside of a scope SiteConfig.get() goes to the cache every time, as before.
+
+    Entries are keyed by SiteConfig.cache_key(), so switching schemas within a scope is safe, and they are
+    dropped by invalidate_siteconfig_cache_signal.  The counters show how a scope used the caches.
+    """
+
+    def __init__(self):
+        self.depth = 0
+        self.configs = {}
+        self.reset_counts()
+
+    def reset_counts(self):
+        self.memo_hits = 0  # served from this memo
+        self.cache_hits = 0  # round trips to the cache (redis)
+        self.db_hits = 0  # cache misses, fetched from the database
+
+    @property
+    def active(self):
+        return self.depth > 0
+
+    def start(self):
+        """ Starts a scope, scopes can be nested (e.g. an eager celery task inside a request) """
+        if self.depth == 0:
+            self.configs = {}
+            self.reset_counts()
+        self.depth += 1
+
+    def stop(self):
+        self.depth = max(self.depth - 1, 0)
+        if self.depth == 0:
+            self.configs = {}
+
+    def get(self, key):
+        return self.configs.get(key) if self.active else None
+
+    def set(self, key, siteconfig):
+        if self.active:
+            self.configs[key] = siteconfig
+
+    def delete(self, key):
+        self.configs.pop(key, None)
+
+    def counts(self):
+        return {'memo_hits': self.memo_hits, 'cache_hits': self.cache_hits, 'db_hits': self.db_hits}
+
+
+siteconfig_request_cache = SiteConfigRequestCache()
+
+
 def get_default_deck_owner():
     """
         This is run once during site initialization
@@ -348,12 +403,21 @@ class SiteConfig(models.Model):
         """
 
         if connection.schema_name != get_public_schema_name():
-            siteconfig = cache.get(cls.cache_key())
+            key = cls.cache_key()
+            siteconfig = siteconfig_request_cache.get(key)
+            if siteconfig:
+                siteconfig_request_cache.memo_hits += 1
+                return siteconfig
+
+            siteconfig = cache.get(key)
+            siteconfig_request_cache.cache_hits += 1
 
             if not siteconfig:
                 siteconfig = cls.objects.select_related('deck_ai', 'active_semester').get()
-                cache.set(cls.cache_key(), siteconfig, 3600)
+                siteconfig_request_cache.db_hits += 1
+                cache.set(key, siteconfig, 3600)
 
+            siteconfig_request_cache.set(key, siteconfig)
             return siteconfig
 
         return None
@@ -367,8 +431,15 @@ def invalidate_siteconfig_cache_signal(sender, instance, **kwargs):
     Whenever a `SiteConfig`, `Semester`, or `User` object is saved, we should invalidate the SiteConfig cache.
     """
 
+    key = SiteConfig.cache_key()
+
+    # the memoized config for this request/task might outlive the one in the cache
+    memo_config = siteconfig_request_cache.get(key)
+    if memo_config and instance in (memo_config, memo_config.active_semester, memo_config.deck_ai):
+        siteconfig_request_cache.delete(key)
+
     try:
-        config = cache.get(SiteConfig.cache_key())
+        config = cache.get(key)
     except redis_exceptions.ConnectionError:
         # create_superuser is being called via manage.py initdb
         # This just prevents it from throwing an error when redis is not running
@@ -381,6 +452,18 @@ def invalidate_siteconfig_cache_signal(sender, instance, **kwargs):
     for obj in (config, config.active_semester, config.deck_ai):
         # Only invalidate the cache when the instance we updated is the current one set in SiteConfig
         if instance == obj:
-            cache.delete(SiteConfig.cache_key())
+            cache.delete(key)
+            siteconfig_request_cache.delete(key)
             break
     # cache.delete(SiteConfig.cache_key())
+
+
+@task_prerun.connect(dispatch_uid="siteconfig.models.start_siteconfig_request_cache")
+def start_siteconfig_request_cache(**kwargs):
+    """ Memoize SiteConfig.get() for the duration of each celery task, like SiteConfigCacheMiddleware does for requests """
+    siteconfig_request_cache.start()
+
+
+@task_postrun.connect(dispatch_uid="siteconfig.models.stop_siteconfig_request_cache")
+def stop_siteconfig_request_cache(**kwargs):
+    siteconfig_request_cache.stop()
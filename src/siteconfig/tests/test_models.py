@@ -8,10 +8,11 @@ from django.contrib.auth import get_user_model
 from django.conf import settings
 
 from django_tenants.test.cases import TenantTestCase
+from django_tenants.test.client import TenantClient
 from freezegun import freeze_time
 from model_bakery import baker
 
-from siteconfig.models import SiteConfig, get_default_deck_owner
+from siteconfig.models import SiteConfig, get_default_deck_owner, siteconfig_request_cache
 
 
 User = get_user_model()
@@ -137,3 +138,63 @@ class SiteConfigModelTest(TenantTestCase):
 
         self.assertNotEqual(get_default_deck_owner(), old_owner_pk)
         self.assertEqual(get_default_deck_owner(), User.objects.last().pk)  # since it gets created it should be at the back. Assume sorted by pk
+
+
+class SiteConfigRequestCacheTest(TenantTestCase):
+    """ Tests for memoizing SiteConfig.get() within a request or celery task """
+
+    def setUp(self):
+        cache.clear()
+        siteconfig_request_cache.start()
+
+    def tearDown(self):
+        siteconfig_request_cache.stop()
+        cache.clear()
+
+    def test_get_is_memoized(self):
+        """ Only the first call in a scope goes to the cache (and the database, if it isn't cached yet) """
+        config = SiteConfig.get()
+        self.assertIs(SiteConfig.get(), config)
+        self.assertIs(SiteConfig.get(), config)
+        self.assertEqual(siteconfig_request_cache.counts(), {'memo_hits': 2, 'cache_hits': 1, 'db_hits': 1})
+
+    def test_not_memoized_outside_scope(self):
+        siteconfig_request_cache.stop()
+        SiteConfig.get()
+        SiteConfig.get()
+        self.assertEqual(siteconfig_request_cache.cache_hits, 2)
+
+    def test_nested_scope_keeps_memo(self):
+        """ e.g. an eager celery task run from within a request """
+        config = SiteConfig.get()
+        siteconfig_request_cache.start()
+        siteconfig_request_cache.stop()
+        self.assertIs(SiteConfig.get(), config)
+
+    def test_key_is_schema_aware(self):
+        SiteConfig.get()
+        self.assertIsNone(siteconfig_request_cache.get('some_other_schema-siteconfig'))
+        self.assertIsNotNone(siteconfig_request_cache.get(SiteConfig.cache_key()))
+
+    def test_invalidated_by_save(self):
+        """ invalidate_siteconfig_cache_signal drops the memoized config """
+        config = SiteConfig.get()
+        config.site_name = 'New Name'
+        config.save()
+        self.assertIsNone(siteconfig_request_cache.get(SiteConfig.cache_key()))
+        self.assertEqual(SiteConfig.get().site_name, 'New Name')
+
+    def test_invalidated_by_active_semester_change(self):
+        config = SiteConfig.get()
+        new_semester = baker.make('courses.Semester')
+        config.set_active_semester(new_semester)
+        self.assertEqual(SiteConfig.get().active_semester, new_semester)
+
+    def test_middleware_counts_header(self):
+        """ With DEBUG on, the response shows how the SiteConfig caches were used by the request """
+        siteconfig_request_cache.stop()
+        client = TenantClient(self.tenant)
+        with self.settings(DEBUG=True):
+            response = client.get(reverse('home'))
+        self.assertIn('memo_hits=', response['X-SiteConfig-Cache'])
+        self.assertFalse(siteconfig_request_cache.active)
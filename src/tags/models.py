@@ -1,9 +1,13 @@
+from collections import defaultdict
+
 from django.apps import apps
-from django.db import models
-from django.db.models import Sum
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.db import connection, models
+from django.db.models import Q, Sum
 from django.db.models.functions import Greatest
 
-from taggit.models import Tag
+from taggit.models import Tag, TaggedItem
 from taggit.managers import TaggableManager
 
 from siteconfig.models import SiteConfig
@@ -153,6 +157,195 @@ def total_xp_by_tags(user, tags):
     return get_quest_submission_total_xp(user, tags) + get_badge_assertion_total_xp(user, tags)
 
 
+class UserTagXP:
+    """
+    A user's XP broken down by tag, for get_user_tags_and_xp() and the tag chart.
+
+    The user's submissions, assertions and their tags are loaded with one query each, then the xp of every tag and of
+    every item is worked out in memory, applying each quest's max_xp once.  The same rules as the queryset functions
+    above are followed:
+      - a user's tags come from the quests they have approved submissions for this semester, and from any badges
+        they have been granted
+      - xp is counted from this semester's completed, approved, xp granting submissions and assertions
+
+    Results are cached per user until their submissions or assertions change (see tags.signals), or until any quest,
+    badge or tag changes.
+    """
+
+    def __init__(self, user):
+        # get models through here to prevent circular imports
+        QuestSubmission = apps.get_model("quest_manager", "QuestSubmission")
+        BadgeAssertion = apps.get_model("badges", "BadgeAssertion")
+
+        self.semester_id = SiteConfig.get().active_semester_id
+
+        # ordered by quest the same way as the tag chart always was, then by ordinal for the max_xp cutoff
+        submissions = QuestSubmission.objects.all_approved(user, active_semester_only=True).annotate(
+            xp_earned=Greatest('quest__xp', 'xp_requested')
+        ).order_by('quest__sort_order', 'quest__date_expired', 'quest__time_expired', 'quest__name', 'quest_id', 'ordinal')
+        submissions = list(submissions.values(
+            'id', 'quest_id', 'quest__name', 'quest__max_xp', 'ordinal', 'xp_earned', 'is_completed', 'do_not_grant_xp'
+        ))
+        assertions = BadgeAssertion.objects.filter(user=user).order_by('badge_id', 'ordinal')
+        assertions = list(assertions.values('id', 'badge_id', 'badge__name', 'badge__xp', 'ordinal', 'semester_id', 'do_not_grant_xp'))
+
+        quest_type = ContentType.objects.get_for_model(apps.get_model("quest_manager", "Quest"))
+        badge_type = ContentType.objects.get_for_model(apps.get_model("badges", "Badge"))
+        tagged_items = TaggedItem.objects.filter(
+            Q(content_type=quest_type, object_id__in={sub['quest_id'] for sub in submissions}) |
+            Q(content_type=badge_type, object_id__in={assertion['badge_id'] for assertion in assertions})
+        ).select_related('tag').order_by('tag_id')
+
+        self.tags = {}  # {tag_id: Tag}
+        self.quest_tag_ids = defaultdict(set)  # {quest_id: {tag_id, ...}}
+        self.badge_tag_ids = defaultdict(set)  # {badge_id: {tag_id, ...}}
+        for tagged_item in tagged_items:
+            self.tags[tagged_item.tag_id] = tagged_item.tag
+            if tagged_item.content_type_id == quest_type.id:
+                self.quest_tag_ids[tagged_item.object_id].add(tagged_item.tag_id)
+            else:
+                self.badge_tag_ids[tagged_item.object_id].add(tagged_item.tag_id)
+
+        # only the items that earn xp, and only if they have tags
+        self.submissions = [
+            sub for sub in submissions
+            if sub['is_completed'] and not sub['do_not_grant_xp'] and self.quest_tag_ids.get(sub['quest_id'])
+        ]
+        self.assertions = [
+            assertion for assertion in assertions
+            if assertion['semester_id'] == self.semester_id and not assertion['do_not_grant_xp']
+            and self.badge_tag_ids.get(assertion['badge_id'])
+        ]
+
+        # xp by tag, with each quest's xp capped at its max_xp
+        quest_xp = defaultdict(int)
+        for sub in self.submissions:
+            quest_xp[sub['quest_id'], sub['quest__max_xp']] += sub['xp_earned']
+
+        self.xp_by_tag_id = dict.fromkeys(self.tags, 0)
+        for (quest_id, max_xp), xp in quest_xp.items():
+            if max_xp != -1:  # no limit
+                xp = min(xp, max_xp or 0)
+            for tag_id in self.quest_tag_ids[quest_id]:
+                self.xp_by_tag_id[tag_id] += xp
+        for assertion in self.assertions:
+            for tag_id in self.badge_tag_ids[assertion['badge_id']]:
+                self.xp_by_tag_id[tag_id] += assertion['badge__xp'] or 0
+
+    @classmethod
+    def version_key(cls):
+        return f'{connection.schema_name}-tag-xp-version'
+
+    @classmethod
+    def cache_key(cls, user_id):
+        return f'{connection.schema_name}-tag-xp-{cache.get_or_set(cls.version_key(), 0, None)}-user-{user_id}'
+
+    @classmethod
+    def for_user(cls, user):
+        key = cls.cache_key(user.id)
+        tag_xp = cache.get(key)
+        if tag_xp is None or tag_xp.semester_id != SiteConfig.get().active_semester_id:
+            tag_xp = cls(user)
+            cache.set(key, tag_xp, 60 * 60 * 24)
+        return tag_xp
+
+    @classmethod
+    def invalidate_user(cls, user_id):
+        cache.delete(cls.cache_key(user_id))
+
+    @classmethod
+    def invalidate_users(cls, user_ids):
+        cache.delete_many([cls.cache_key(user_id) for user_id in user_ids])
+
+    @classmethod
+    def invalidate_all(cls):
+        """ Quests, badges or tags changed, so every user's breakdown might be out of date """
+        try:
+            cache.incr(cls.version_key())
+        except ValueError:  # the version was never set, so nothing is cached yet
+            pass
+
+    def tags_and_xp(self):
+        """ :return: list[tuple[Tag, int]] sorted by xp in descending order, see get_user_tags_and_xp() """
+        tag_info_tuple = [(tag, self.xp_by_tag_id[tag_id]) for tag_id, tag in self.tags.items()]
+        return sorted(tag_info_tuple, key=lambda tag_tuple: tag_tuple[1])[::-1]
+
+    def quest_dataset(self, tag_names):
+        """ The chart.js dataset of each submission of a quest tagged with any of the tag names, see
+        courses.views.Ajax_TagChart.get_quest_dataset() """
+        tag_ids_by_name = {tag.name: tag_id for tag_id, tag in self.tags.items()}
+        wanted_tag_ids = {tag_ids_by_name[name] for name in tag_names if name in tag_ids_by_name}
+
+        submissions_by_quest = defaultdict(list)
+        for sub in self.submissions:
+            if self.quest_tag_ids[sub['quest_id']] & wanted_tag_ids:
+                submissions_by_quest[sub['quest_id']].append(sub)
+
+        # change xp_earned or remove submissions if they go over max_xp.  Once a submission reaches the cutoff,
+        # the submissions after it would earn 0 xp so they're left out
+        kept = {}  # {submission id: xp earned}
+        for quest_id, subs in submissions_by_quest.items():
+            max_xp = subs[0]['quest__max_xp']
+            if max_xp == -1:  # no limit
+                kept.update((sub['id'], sub['xp_earned']) for sub in subs)
+                continue
+            if max_xp < -1:  # not a valid limit, these were never shown
+                continue
+            current_xp_total = 0
+            for sub in subs:
+                if sub['xp_earned'] + current_xp_total > max_xp:
+                    kept[sub['id']] = max_xp - current_xp_total
+                    break
+                kept[sub['id']] = sub['xp_earned']
+                current_xp_total += sub['xp_earned']
+
+        kept_per_quest = defaultdict(int)
+        for sub in self.submissions:
+            if sub['id'] in kept:
+                kept_per_quest[sub['quest_id']] += 1
+
+        submission_dataset = []
+        for sub in self.submissions:
+            if sub['id'] not in kept:
+                continue
+            quest_tags = {self.tags[tag_id].name for tag_id in self.quest_tag_ids[sub['quest_id']]}
+            xp_in_tag = [kept[sub['id']] if tag in quest_tags else 0 for tag in tag_names]
+
+            # account for ordinal in name
+            name = sub['quest__name']
+            if kept_per_quest[sub['quest_id']] > 1:
+                name += f" ({sub['ordinal']})"
+
+            submission_dataset.append({'name': name, 'dataset': xp_in_tag})
+
+        return submission_dataset
+
+    def badge_dataset(self, tag_names):
+        """ The chart.js dataset of each assertion of a badge tagged with any of the tag names, see
+        courses.views.Ajax_TagChart.get_badge_dataset() """
+        assertions = [
+            assertion for assertion in self.assertions
+            if {self.tags[tag_id].name for tag_id in self.badge_tag_ids[assertion['badge_id']]} & set(tag_names)
+        ]
+        assertions_per_badge = defaultdict(int)
+        for assertion in assertions:
+            assertions_per_badge[assertion['badge_id']] += 1
+
+        assertion_dataset = []
+        for assertion in assertions:
+            badge_tags = {self.tags[tag_id].name for tag_id in self.badge_tag_ids[assertion['badge_id']]}
+            xp_in_tag = [assertion['badge__xp'] if tag in badge_tags else 0 for tag in tag_names]
+
+            # account for ordinal in name
+            name = assertion['badge__name']
+            if assertions_per_badge[assertion['badge_id']] > 1:
+                name += f" ({assertion['ordinal']})"
+
+            assertion_dataset.append({'name': name, 'dataset': xp_in_tag})
+
+        return assertion_dataset
+
+
 def get_user_tags_and_xp(user):
     """
     returns a list of tuples containing a tag object and how much xp it has.
@@ -167,16 +360,7 @@ def get_user_tags_and_xp(user):
     Returns:
         list[tuple[Tag, int]]: sorted list of tuples containing tag and int objects
     """
-    tag_info_tuple = []
-
-    # append tag object and tag xp to tag_info_tuple
-    user_related_tags = get_tags_from_user(user)
-    for tag in user_related_tags:
-        total_xp = total_xp_by_tags(user, [tag])
-        tag_info_tuple.append((tag, total_xp))
-
-    # sort by total xp (descending order) then return
-    return sorted(tag_info_tuple, key=lambda tag_tuple: tag_tuple[1])[::-1]
+    return UserTagXP.for_user(user).tags_and_xp()
 
 
 class TagsModelMixin(models.Model):
@@ -0,0 +1,30 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from taggit.models import Tag, TaggedItem
+
+from badges.models import Badge, BadgeAssertion
+from quest_manager.models import Quest, QuestSubmission
+from tags.models import UserTagXP
+
+
+@receiver([post_save, post_delete], sender=QuestSubmission)
+@receiver([post_save, post_delete], sender=BadgeAssertion)
+def invalidate_user_tag_xp(sender, instance, **kwargs):
+    """ The user's xp by tag changed """
+    UserTagXP.invalidate_user(instance.user_id)
+
+
+@receiver([post_save, post_delete], sender=Quest)
+@receiver([post_save, post_delete], sender=Badge)
+@receiver([post_save, post_delete], sender=Tag)
+def invalidate_all_tag_xp(sender, **kwargs):
+    """ An item's xp or a tag's name changed, which could affect any user's xp by tag """
+    UserTagXP.invalidate_all()
+
+
+@receiver(m2m_changed, sender=TaggedItem)
+def invalidate_all_tag_xp_on_tagging(sender, action, **kwargs):
+    """ Tags were added to or removed from an item """
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        UserTagXP.invalidate_all()
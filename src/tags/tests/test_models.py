@@ -1,13 +1,15 @@
 from django_tenants.test.cases import TenantTestCase
 from django.contrib.auth import get_user_model
+from django.db import connection
 from django.db.utils import ProgrammingError
+from django.test.utils import CaptureQueriesContext
 
 from model_bakery import baker
 
 from taggit.models import Tag
 from tags.models import (
     total_xp_by_tags, get_tags_from_user, get_user_tags_and_xp, get_quest_submission_by_tag, get_badge_assertion_by_tags,
-    get_quest_submission_total_xp, get_badge_assertion_total_xp,
+    get_quest_submission_total_xp, get_badge_assertion_total_xp, UserTagXP,
 )
 from siteconfig.models import SiteConfig
 from quest_manager.models import Quest, QuestSubmission
@@ -701,3 +703,83 @@ class Tag_total_xp_by_tags_and_quest_badges_total_xp_Tests(TagHelper, TenantTest
         calculated_xp = total_xp_by_tags(self.user, ["TAG"])
         expected_xp = sum(xp_list[i] * quantity_list[i] for i in range(len(xp_list)))
         self.assertEqual(calculated_xp, expected_xp)
+
+
+class UserTagXPTests(TagHelper, TenantTestCase):
+    """
+        Specialized TestClass for the UserTagXP aggregation used by get_user_tags_and_xp and the tag chart
+    """
+
+    def setUp(self):
+        self.user = baker.make(User)
+
+        # capped at 25 xp: 10 + 10 + 5, and the 4th submission is left out
+        self.capped_quest, subs = self.create_quest_and_submissions(10, 4)
+        for ordinal, sub in enumerate(subs, start=1):
+            sub.ordinal = ordinal
+            sub.save()
+        self.capped_quest.max_xp = 25
+        self.capped_quest.save()
+        self.capped_quest.tags.add('capped', 'shared')
+
+        self.quest, _ = self.create_quest_and_submissions(7)
+        self.quest.tags.add('shared')
+
+        # tag shows up, but no xp: not granting xp
+        quest, subs = self.create_quest_and_submissions(100)
+        QuestSubmission.objects.filter(id=subs[0].id).update(do_not_grant_xp=True)
+        quest.tags.add('no xp')
+
+        self.badge, _ = self.create_badge_and_assertions(3, 2)
+        self.badge.tags.add('shared', 'badge')
+
+    def test_same_as_total_xp_by_tags(self):
+        tags_and_xp = get_user_tags_and_xp(self.user)
+
+        self.assertSetEqual({tag for tag, _ in tags_and_xp}, set(get_tags_from_user(self.user)))
+        for tag, xp in tags_and_xp:
+            self.assertEqual(xp, total_xp_by_tags(self.user, [tag]))
+        self.assertListEqual([(tag.name, xp) for tag, xp in tags_and_xp], [('shared', 38), ('capped', 25), ('badge', 6), ('no xp', 0)])
+
+    def test_datasets(self):
+        tag_names = ['shared', 'capped', 'badge', 'no xp']
+        tag_xp = UserTagXP.for_user(self.user)
+
+        quest_dataset = {item['name']: item['dataset'] for item in tag_xp.quest_dataset(tag_names)}
+        name = self.capped_quest.name
+        self.assertDictEqual(quest_dataset, {
+            f'{name} (1)': [10, 10, 0, 0],
+            f'{name} (2)': [10, 10, 0, 0],
+            f'{name} (3)': [5, 5, 0, 0],
+            self.quest.name: [7, 0, 0, 0],
+        })
+        self.assertListEqual(tag_xp.badge_dataset(tag_names), [
+            {'name': f'{self.badge.name} (1)', 'dataset': [3, 0, 3, 0]},
+            {'name': f'{self.badge.name} (1)', 'dataset': [3, 0, 3, 0]},
+        ])
+
+    def test_queries_do_not_depend_on_number_of_tags(self):
+        def count_queries():
+            UserTagXP.invalidate_user(self.user.id)
+            with CaptureQueriesContext(connection) as context:
+                get_user_tags_and_xp(self.user)
+            return len(context)
+
+        queries = count_queries()
+        for index in range(10):
+            quest, _ = self.create_quest_and_submissions(index)
+            quest.tags.add(f'more-{index}')
+        self.assertEqual(count_queries(), queries)
+
+    def test_cached_until_submissions_change(self):
+        get_user_tags_and_xp(self.user)
+        with CaptureQueriesContext(connection) as context:
+            get_user_tags_and_xp(self.user)
+        self.assertEqual(len([query for query in context if not query['sql'].startswith('SET search_path')]), 0)
+
+        # a new submission, then a new tag on an existing quest
+        quest, _ = self.create_quest_and_submissions(4)
+        quest.tags.add('new')
+        self.assertIn(('new', 4), [(tag.name, xp) for tag, xp in get_user_tags_and_xp(self.user)])
+        self.quest.tags.add('new')
+        self.assertIn(('new', 11), [(tag.name, xp) for tag, xp in get_user_tags_and_xp(self.user)])
@@ -139,7 +139,9 @@ class TenantAdmin(PublicSchemaOnlyAdminAccessMixin, admin.ModelAdmin):
     delete_selected_confirmation_template = 'admin/tenant/tenant/delete_selected_confirmation.html'
     delete_confirmation_template = 'admin/tenant/tenant/delete_confirmation.html'
 
-    actions = ['message_unverified', 'message_verified', 'enable_google_signin', 'disable_google_signin']
+    actions = [
+        'message_unverified', 'message_verified', 'enable_google_signin', 'disable_google_signin', 'update_cached_fields'
+    ]
 
     @admin.display(description="owner full name")
     def owner_full_name_text(self, obj):
@@ -157,22 +159,14 @@ class TenantAdmin(PublicSchemaOnlyAdminAccessMixin, admin.ModelAdmin):
         return obj.owner_email_cached
     owner_email_text.admin_order_field = "owner_email_cached"
 
-    @admin.display(description="email verified", boolean=True)
+    @admin.display(description="email verified", boolean=True, ordering="owner_email_verified_cached")
     def owner_email_verified_boolean(self, obj):
         """
         Returns `True` (green), if at least one verified email address was found, otherwise `False`.
         """
         if obj.schema_name == get_public_schema_name():
             return  # skip public schema
-
-        with tenant_context(obj):
-            owner = SiteConfig.get().deck_owner
-            # get the email address, but only primary and verified
-            for primary_email_address in EmailAddress.objects.filter(user=owner, primary=True, verified=True):
-                # make sure it's primary email for real
-                if primary_email_address.email == user_email(owner):
-                    return True
-        return False
+        return obj.owner_email_verified_cached
 
     @admin.display(description="owner email (DEPRECATED)")
     def owner_email_deprecated(self, obj):
@@ -214,17 +208,6 @@ class TenantAdmin(PublicSchemaOnlyAdminAccessMixin, admin.ModelAdmin):
             del actions["delete_selected"]
         return actions
 
-    def get_queryset(self, request):
-        qs = super().get_queryset(request)
-        # Update cached fields
-        #
-        # FIX: reduce number of SQL queries by triggering this only when Tenant (and/or related) objects are changed
-        for tenant in qs:
-            if tenant.name != get_public_schema_name():
-                with tenant_context(tenant):
-                    tenant.update_cached_fields()
-        return qs
-
     def delete_model(self, request, obj):
         # for reference: https://django-tenants.readthedocs.io/en/stable/use.html#deleting-a-tenant
         obj.delete(force_drop=False)  # delete model, but *DO NOT* drop schema
@@ -317,6 +300,24 @@ class TenantAdmin(PublicSchemaOnlyAdminAccessMixin, admin.ModelAdmin):
 
         return self.render_delete_form(request, context)
 
+    @admin.action(description="Update the cached fields of the selected tenant(s) now")
+    def update_cached_fields(self, request, queryset):
+        """
+        The cached fields are updated in the background (see tenant.tasks.update_cached_fields_on_all_schemas),
+        this updates them right away for the selected tenants.
+        """
+        queryset = queryset.exclude(schema_name=get_public_schema_name())
+        for tenant in queryset:
+            with tenant_context(tenant):
+                tenant.update_cached_fields()
+
+        updated_count = len(queryset)
+        self.message_user(request, ngettext(
+            "The cached fields of %d tenant were updated successfully",
+            "The cached fields of %d tenants were updated successfully",
+            updated_count,
+        ) % updated_count, messages.SUCCESS)
+
     @admin.action(description="Send an email message to *all* owners for the selected tenant(s)")
     def message_unverified(modeladmin, request, queryset):
         """Send an email message to *all* owners for selected tenant(s)."""
@@ -446,6 +447,7 @@ class TenantAdmin(PublicSchemaOnlyAdminAccessMixin, admin.ModelAdmin):
                     config._propagate_google_provider()
                     config.enable_google_signin = True
                     config.save()
+                tenant.update_cached_fields()
 
                 tenant_domain = tenant.get_primary_domain()
                 uri = request.build_absolute_uri().replace(Site.objects.get_current().domain, tenant_domain.domain)
@@ -474,6 +476,7 @@ class TenantAdmin(PublicSchemaOnlyAdminAccessMixin, admin.ModelAdmin):
                 config = SiteConfig.get()
                 config.enable_google_signin = False
                 config.save()
+                tenant.update_cached_fields()
 
         disabled_count = queryset.count()
         self.message_user(request, ngettext(
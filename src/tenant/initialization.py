@@ -4,7 +4,11 @@ I found data migrations to cause too many problems, and they  got in the way squ
 among other issues
 """
 
+import hashlib
+import json
 import os
+from datetime import date
+from functools import lru_cache
 
 from django.conf import settings
 
@@ -12,13 +16,16 @@ from django.contrib.auth import get_user_model
 from django.contrib.staticfiles import finders
 from django.core.files import File
 from django.db import connection
+from django.db.migrations.loader import MigrationLoader
 from django.urls import reverse
-from django_tenants.utils import get_public_schema_name
+from django_tenants.clone import CloneSchema
+from django_tenants.utils import get_public_schema_name, schema_context
 
-from courses.models import Grade, Rank, Course, Block, MarkRange
+from courses.models import Grade, Rank, Course, Block, MarkRange, Semester, default_end_date
 from quest_manager.models import Quest, Category
 from badges.models import Badge, BadgeType, BadgeRarity
 from prerequisites.models import Prereq
+from prerequisites.tasks import suppress_tasks
 from siteconfig.models import SiteConfig
 from tenant.models import Tenant
 from utilities.models import MenuItem
@@ -49,6 +56,84 @@ def load_initial_tenant_data():
     create_orientation_campaign()
 
 
+@lru_cache(maxsize=None)
+def migrations_version():
+    """
+    :return: a hash of the latest migration of each app.  Loading the migration graph is slow, and the migrations don't
+     change while the process is running, so it's only done once.
+    """
+    leaf_nodes = sorted(MigrationLoader(None, ignore_no_migrations=True).graph.leaf_nodes())
+    return hashlib.md5(json.dumps(leaf_nodes).encode()).hexdigest()
+
+
+def template_schema_is_ready():
+    """
+    Whether new tenants can be cloned from the TENANT_TEMPLATE_SCHEMA, see build_template_schema().  It must exist and
+    have been built with the current migrations, otherwise new tenants are migrated and initialized from scratch.
+    """
+    template = settings.TENANT_TEMPLATE_SCHEMA
+    if not template:
+        return False
+
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT to_regproc('public.clone_schema') IS NOT NULL")
+        if not cursor.fetchone()[0]:
+            return False
+        # see build_template_schema(), no row if the schema doesn't exist
+        cursor.execute("SELECT obj_description(oid, 'pg_namespace') FROM pg_namespace WHERE nspname = %s", [template])
+        row = cursor.fetchone()
+
+    return row is not None and row[0] == migrations_version()
+
+
+def build_template_schema(verbosity=0):
+    """
+    (Re)builds the TENANT_TEMPLATE_SCHEMA that new tenants are cloned from.  It's created and initialized the same way as
+    a tenant, with load_initial_tenant_data(), but its Tenant object is then deleted, so it isn't a deck.
+    """
+    template = settings.TENANT_TEMPLATE_SCHEMA
+
+    with schema_context(get_public_schema_name()):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DROP SCHEMA IF EXISTS "{template}" CASCADE')
+        # the postgres function that clones schemas, otherwise it's created the first time it's used, and that
+        # commits the transaction that the new tenant is being created in
+        CloneSchema()._create_clone_schema_function()
+
+        # the template doesn't exist now, so this is created from scratch.  Its Tenant is deleted right away, so the
+        # tasks sent by the initial data's signals would fail
+        tenant = Tenant(schema_name=template, name=template)
+        with suppress_tasks():
+            tenant.save(verbosity=verbosity)
+        tenant.delete(force_drop=False)
+
+        # it was migrated to the latest migrations, so it can be used until there are new ones
+        with connection.cursor() as cursor:
+            cursor.execute(f'COMMENT ON SCHEMA "{template}" IS %s', [migrations_version()])
+
+
+def clone_template_schema(schema_name):
+    """
+    Creates the schema by copying the tables and data of the TENANT_TEMPLATE_SCHEMA, including its applied migrations.
+    Call patch_cloned_tenant_data() in the new schema afterwards.
+    """
+    CloneSchema().clone_schema(settings.TENANT_TEMPLATE_SCHEMA, schema_name)
+
+
+def patch_cloned_tenant_data():
+    """
+    Used instead of load_initial_tenant_data() for tenants cloned from the template schema, to update the initial data
+    that is different for each tenant.  The Site's domain is updated by handle_tenant_site_domain_update().
+    """
+
+    if connection.schema_name == get_public_schema_name():
+        return
+
+    set_default_site_names(SiteConfig.get())
+    # the initial semester starts on the day the tenant is created, not when the template was built
+    Semester.objects.update(first_day=date.today(), last_day=default_end_date())
+
+
 def set_initial_icons(object_list):
     """
     Sets the icons for a list of objects.  Each object's model must have `name` and `icon` fields.
@@ -115,6 +200,11 @@ def create_users():
 def create_site_config_object():
     """ Create the single SiteConfig object for this tenant and provide sensible defaults"""
     config = SiteConfig.objects.create()
+    set_default_site_names(config)
+
+
+def set_default_site_names(config):
+    """ Names the site after the tenant """
     name = Tenant.get().name.replace("_", " ").replace("-", " ").title()
     if name:
         config.site_name = f"{name} Deck"
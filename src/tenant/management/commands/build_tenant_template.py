@@ -0,0 +1,41 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+
+from tenant.initialization import build_template_schema, template_schema_is_ready
+from tenant.models import Tenant
+from utilities.metrics import QueryCounter
+
+
+class Command(BaseCommand):
+
+    help = 'Build the TENANT_TEMPLATE_SCHEMA that new tenants are cloned from.  Run this again after new migrations.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--benchmark', action='store_true',
+            help='Afterwards, compare the time it takes to create a tenant from scratch and by cloning the template.'
+        )
+
+    def handle(self, *args, **options):
+        if not settings.TENANT_TEMPLATE_SCHEMA:
+            raise CommandError('TENANT_TEMPLATE_SCHEMA is blank, so new tenants are always created from scratch.')
+
+        self.stdout.write(f'Building the `{settings.TENANT_TEMPLATE_SCHEMA}` schema...')
+        build_template_schema(verbosity=options['verbosity'])
+        if not template_schema_is_ready():
+            raise CommandError('The template schema is missing migrations.')
+        self.stdout.write(self.style.SUCCESS('New tenants will be cloned from it.'))
+
+        if options['benchmark']:
+            with override_settings(TENANT_TEMPLATE_SCHEMA=''):
+                self.benchmark('Created from scratch', 'benchmarkscratch')
+            self.benchmark('Cloned from the template', 'benchmarkclone')
+
+    def benchmark(self, description, name):
+        """ Creates a throwaway tenant, then deletes it and drops its schema """
+        tenant = Tenant(schema_name=name, name=name)
+        with QueryCounter() as counter:
+            tenant.save(verbosity=0)
+        tenant.delete(force_drop=True)
+        self.stdout.write(f'{description}: {counter.report(tenants=1)}')
@@ -0,0 +1,23 @@
+# Generated by Django 3.2.25 on 2026-10-17 22:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tenant', '0014_auto_20231116_0308'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tenant',
+            name='cached_fields_updated',
+            field=models.DateTimeField(blank=True, editable=False, help_text='The last time the cached fields were calculated, see tenant.tasks.update_cached_fields_on_all_schemas', null=True),
+        ),
+        migrations.AddField(
+            model_name='tenant',
+            name='owner_email_verified_cached',
+            field=models.BooleanField(default=False, editable=False, help_text="This is a cached field: whether the Deck Owner's primary email address has been verified."),
+        ),
+    ]
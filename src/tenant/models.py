@@ -3,13 +3,15 @@ from datetime import date
 
 from django.apps import apps
 from django.core.exceptions import ValidationError
-from django.db import models
+from django.db import connection, models
+from django.utils import timezone
 from django.utils.timezone import timedelta
 from django.contrib.auth import get_user_model
 
 from allauth.account.utils import user_email
 from allauth.account.models import EmailAddress
 from django_tenants.models import DomainMixin, TenantMixin
+from django_tenants.utils import schema_exists
 
 from hackerspace_online import settings
 
@@ -127,6 +129,16 @@ class Tenant(TenantMixin):
         default=False,
         help_text="This is a cached field: Whether Google signon has been enabled for this deck."
     )
+
+    owner_email_verified_cached = models.BooleanField(
+        default=False, editable=False,
+        help_text="This is a cached field: whether the Deck Owner's primary email address has been verified."
+    )
+
+    cached_fields_updated = models.DateTimeField(
+        blank=True, null=True, editable=False,
+        help_text="The last time the cached fields were calculated, see tenant.tasks.update_cached_fields_on_all_schemas"
+    )
     # END CALCULATED / CACHED FIELDS ##################################
 
     def __str__(self):
@@ -139,18 +151,48 @@ class Tenant(TenantMixin):
 
         super().save(*args, **kwargs)
 
+    def create_schema(self, check_if_exists=False, sync_schema=True, verbosity=1):
+        """
+        Clones the schema from the TENANT_TEMPLATE_SCHEMA when it's up to date (see tenant.initialization), which is much
+        faster than running all the migrations and creating the initial data.  Otherwise creates it from scratch.
+        """
+        from tenant.initialization import clone_template_schema, template_schema_is_ready
+
+        if not sync_schema or (check_if_exists and schema_exists(self.schema_name)) or not template_schema_is_ready():
+            return super().create_schema(check_if_exists, sync_schema, verbosity)
+
+        clone_template_schema(self.schema_name)
+        # so post_schema_sync receivers know the initial data is already there
+        self.cloned_from_template = True
+        connection.set_schema_to_public()
+        return True
+
+    CACHED_FIELDS = [
+        'owner_full_name_cached', 'owner_email_cached', 'owner_email_verified_cached', 'active_user_count',
+        'total_user_count', 'quest_count', 'last_staff_login', 'google_signon_enabled',
+    ]
+
     def update_cached_fields(self):
         """
-        Updates the cached fields for the tenant so Django Admin displays the latest values.
+        Updates the cached fields for the tenant so Django Admin displays the latest values.  Must be called within the
+        tenant's context.  Only the fields whose values changed are written, without sending any signals.
+
+        :return: a list of the names of the fields that changed
         """
-        self.owner_full_name_cached = self.get_owner_full_name_cached()
-        self.owner_email_cached = self.get_owner_email_cached()
-        self.active_user_count = self.get_active_user_count()
-        self.total_user_count = self.get_total_user_count()
-        self.quest_count = self.get_quest_count()
-        self.last_staff_login = self.get_last_staff_login()
-        self.google_signon_enabled = self.get_google_signon_enabled()
-        self.save()
+        stored = Tenant.objects.filter(pk=self.pk).values(*self.CACHED_FIELDS).first() or {}
+        changed = []
+        for field in self.CACHED_FIELDS:
+            value = getattr(self, f'get_{field}')()
+            setattr(self, field, value)
+            if field not in stored or stored[field] != value:
+                changed.append(field)
+
+        self.cached_fields_updated = timezone.now()
+        Tenant.objects.filter(pk=self.pk).update(
+            cached_fields_updated=self.cached_fields_updated,
+            **{field: getattr(self, field) for field in changed},
+        )
+        return changed
 
     def get_owner_full_name_cached(self):
         """
@@ -177,6 +219,20 @@ class Tenant(TenantMixin):
                 email = owner.email
         return email
 
+    def get_owner_email_verified_cached(self):
+        """
+        Returns whether the SiteConfig().deck_owner's primary email address has been verified.
+        """
+        SiteConfig = apps.get_model('siteconfig', 'SiteConfig')
+        owner = SiteConfig.get().deck_owner
+
+        # get the email address, but only primary and verified
+        for primary_email_address in EmailAddress.objects.filter(user=owner, primary=True, verified=True):
+            # make sure it's primary email for real
+            if primary_email_address.email == user_email(owner):
+                return True
+        return False
+
     def get_google_signon_enabled(self):
         """
         Returns whether Google signon has been enabled for this tenant by accessing the tenant's SiteConfig option
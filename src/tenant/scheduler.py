@@ -0,0 +1,127 @@
+"""
+Runs a task on every tenant's schema without starting them all at once.
+
+schedule_on_all_tenants() spreads the start times over a window, and tasks with TenantMaintenanceTask as their base
+only run TENANT_TASKS_CONCURRENCY at a time across all schemas, with a low priority, so they never take up all the
+workers that interactive tasks (e.g. recalculating a user's available quests) need.
+
+    @app.task(base=TenantMaintenanceTask, name='myapp.tasks.nightly_cleanup_on_schema')
+    def nightly_cleanup_on_schema():
+        ...
+
+    schedule_on_all_tenants(nightly_cleanup_on_schema)
+"""
+import logging
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django_tenants.utils import get_public_schema_name, get_tenant_model, schema_context, tenant_context
+
+from tenant_schemas_celery.task import TenantTask
+
+logger = logging.getLogger(__name__)
+
+# With the redis broker lower numbers are consumed first, and tasks sent without a priority get 0
+PRIORITY_INTERACTIVE = 0
+PRIORITY_MAINTENANCE = 9
+
+
+def schedule_on_all_tenants(task, args_for_tenant=None, window=None, priority=PRIORITY_MAINTENANCE):
+    """
+    Sends the task to each tenant's schema (except public), with their start times spread evenly over the window.
+
+    :param task: the celery task to run on each schema
+    :param args_for_tenant: optional function that returns the task's args for a tenant
+    :param window: seconds to spread the tasks over, defaults to TENANT_TASKS_WINDOW
+    :param priority: see PRIORITY_INTERACTIVE and PRIORITY_MAINTENANCE
+    :return: the number of schemas the task was scheduled on
+    """
+    window = settings.TENANT_TASKS_WINDOW if window is None else window
+    tenants = list(get_tenant_model().objects.exclude(schema_name=get_public_schema_name()).order_by('id'))
+
+    for index, tenant in enumerate(tenants):
+        with tenant_context(tenant):
+            task.apply_async(
+                args=args_for_tenant(tenant) if args_for_tenant else None,
+                countdown=window * index / len(tenants),
+                priority=priority,
+                queue='default',
+            )
+
+    return len(tenants)
+
+
+def slot_key(slot):
+    return f'{connection.schema_name}-tenant-tasks-slot-{slot}'
+
+
+def duration_key(task_name, schema_name):
+    return f'{connection.schema_name}-tenant-task-duration-{task_name}-{schema_name}'
+
+
+def acquire_slot(owner):
+    """
+    Takes one of the TENANT_TASKS_CONCURRENCY slots, each one is a cache key that expires after TENANT_TASKS_SLOT_TIMEOUT
+    on its own, so the slot of a worker that died without releasing it is freed without affecting the others.
+    :param owner: identifies the task holding the slot, e.g. its id
+    :return: the slot's key, or None if they are all taken
+    """
+    # the same keys for all schemas
+    with schema_context(get_public_schema_name()):
+        for slot in range(settings.TENANT_TASKS_CONCURRENCY):
+            if cache.add(slot_key(slot), owner, settings.TENANT_TASKS_SLOT_TIMEOUT):
+                return slot_key(slot)
+        return None
+
+
+def release_slot(key, owner):
+    with schema_context(get_public_schema_name()):
+        # unless it expired while the task was running and another task took it
+        if cache.get(key) == owner:
+            cache.delete(key)
+
+
+def record_duration(task_name, schema_name, seconds):
+    with schema_context(get_public_schema_name()):
+        cache.set(duration_key(task_name, schema_name), round(seconds, 3), None)
+
+
+def get_durations(task_name):
+    """ :return: dict of schema name: how many seconds the task took the last time it ran on that schema """
+    schema_names = get_tenant_model().objects.exclude(
+        schema_name=get_public_schema_name()
+    ).values_list('schema_name', flat=True)
+    with schema_context(get_public_schema_name()):
+        keys = {duration_key(task_name, schema_name): schema_name for schema_name in schema_names}
+        return {keys[key]: seconds for key, seconds in cache.get_many(list(keys)).items()}
+
+
+class TenantMaintenanceTask(TenantTask):
+    """
+    Base for tasks that are run on every schema, see schedule_on_all_tenants().  At most TENANT_TASKS_CONCURRENCY of
+    these run at once on the workers across all schemas, the others are retried after TENANT_TASKS_RETRY_DELAY seconds.
+    The duration on each schema is recorded, see get_durations().
+    """
+    abstract = True
+    max_retries = None  # keep waiting for a slot
+
+    def __call__(self, *args, **kwargs):
+        # eager tasks run in the caller's process, so they don't take up a worker
+        slot = None
+        if not self.request.is_eager:
+            slot = acquire_slot(self.request.id)
+            if slot is None:
+                raise self.retry(countdown=settings.TENANT_TASKS_RETRY_DELAY)
+
+        schema_name = connection.schema_name
+        start = time.perf_counter()
+        try:
+            return super().__call__(*args, **kwargs)
+        finally:
+            if slot:
+                release_slot(slot, self.request.id)
+            seconds = time.perf_counter() - start
+            record_duration(self.name, schema_name, seconds)
+            logger.info(f"Task {self.name} on schema {schema_name} took {seconds:.3f} sec.")
@@ -3,12 +3,15 @@ from django.db import connection
 
 from django_tenants.utils import get_public_schema_name
 
-from .initialization import load_initial_tenant_data
+from .initialization import load_initial_tenant_data, patch_cloned_tenant_data
 
 
 def initialize_tenant_with_data(sender, tenant, **kwargs):
     connection.set_tenant(tenant)
-    load_initial_tenant_data()
+    if getattr(tenant, 'cloned_from_template', False):
+        patch_cloned_tenant_data()
+    else:
+        load_initial_tenant_data()
 
 
 def tenant_save_callback(sender, instance, **kwargs):
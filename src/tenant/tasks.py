@@ -1,10 +1,14 @@
 from django.conf import settings
 from django.core.mail import EmailMultiAlternatives
+from django.db import connection
 from django.template.loader import get_template
 
 from hackerspace_online.celery import app
 from utilities.html import textify
 
+from .models import Tenant
+from .scheduler import TenantMaintenanceTask, schedule_on_all_tenants
+
 
 @app.task(name="tenant.tasks.send_email_message")
 def send_email_message(subject, message, recipient_list, **kwargs):
@@ -24,3 +28,25 @@ def send_email_message(subject, message, recipient_list, **kwargs):
     )
     email.attach_alternative(msg, "text/html")
     email.send()
+
+
+@app.task(name="tenant.tasks.update_cached_fields_on_all_schemas")
+def update_cached_fields_on_all_schemas():
+    """
+    Dispatcher task that calls update_cached_fields_on_schema for each schema, so the Django Admin's tenant list
+    only needs to read the cached fields
+    """
+    num_schemas = schedule_on_all_tenants(update_cached_fields_on_schema)
+
+    return f"Scheduled update_cached_fields_on_schema for {num_schemas} schemas"
+
+
+@app.task(base=TenantMaintenanceTask, name="tenant.tasks.update_cached_fields_on_schema")
+def update_cached_fields_on_schema():
+    """
+    Recalculates the cached fields of the current schema's tenant, see Tenant.update_cached_fields()
+    """
+    tenant = Tenant.objects.get(schema_name=connection.schema_name)
+    changed = tenant.update_cached_fields()
+
+    return f"Updated cached fields of {tenant.schema_name}: {', '.join(changed) or 'no changes'}"
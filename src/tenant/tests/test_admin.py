@@ -13,9 +13,11 @@ from django.contrib.auth.models import Permission
 from django.contrib.auth import get_user_model
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.sites.models import Site
+from django.db import connection
 from django.http import HttpResponse
 from django.template.response import TemplateResponse
 from django.test import RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
 # from django.core.exceptions import ValidationError
 from django.urls import path, reverse
 from django.utils import timezone
@@ -148,6 +150,11 @@ class PublicTenantTestAdminPublic(TenantTestCase):
                 email_address.verified = True
                 email_address.save()
 
+        # the tenant list only shows the cached fields, which are updated in the background
+        for tenant in (self.tenant, self.extra_tenant):
+            with tenant_context(tenant):
+                tenant.update_cached_fields()
+
         self.client = TenantClient(self.public_tenant)
 
     def test_owner_full_name_text_column(self):
@@ -277,6 +284,44 @@ class PublicTenantTestAdminPublic(TenantTestCase):
         # confirm the search returned zero objects (by full name)
         self.assertContains(response, "0 result")
 
+    def test_changelist_reads_cached_fields(self):
+        """ The tenant list doesn't calculate the cached fields, so it doesn't need more queries for more tenants """
+        with tenant_context(self.public_tenant):
+            self.client.force_login(self.superuser)
+        url = reverse("admin:{}_{}_changelist".format("tenant", "tenant"))
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as few:
+            self.client.get(url)
+
+        Tenant.objects.bulk_create([Tenant(schema_name=f"another{i}", name=f"another{i}") for i in range(3)])
+        with CaptureQueriesContext(connection) as many:
+            response = self.client.get(url)
+
+        self.assertContains(response, "another2")
+        self.assertEqual(len(few), len(many))
+
+    def test_update_cached_fields_action(self):
+        with tenant_context(self.extra_tenant):
+            config = SiteConfig.get()
+            config.deck_owner.first_name = "Taylor"
+            config.deck_owner.last_name = "Swift"
+            config.deck_owner.save()
+
+        with tenant_context(self.public_tenant):
+            self.client.force_login(self.superuser)
+        url = reverse("admin:{}_{}_changelist".format("tenant", "tenant"))
+        response = self.client.get(url)
+        self.assertContains(response, "John Doe")
+        self.assertNotContains(response, "Taylor Swift")
+
+        action_data = {
+            ACTION_CHECKBOX_NAME: [self.extra_tenant.pk],
+            "action": "update_cached_fields",
+            "index": 0,
+        }
+        response = self.client.post(url, action_data, follow=True)
+        self.assertContains(response, "Taylor Swift")
+
     @patch("tenant.admin.messages.add_message")
     def test_enable_google_signin_admin_without_config(self, mock_add_message):
         """
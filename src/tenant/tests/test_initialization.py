@@ -1,10 +1,21 @@
+from datetime import date
+from unittest.mock import patch
+
 from django_tenants.test.cases import TenantTestCase
+from django_tenants.utils import get_public_schema_name, schema_context, tenant_context
 from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.contrib.sites.models import Site
+from django.db import connection
+from django.test import override_settings
+from model_bakery import baker
 
 from badges.models import Badge, BadgeRarity, BadgeType
-from courses.models import Block, Course, Grade, MarkRange, Rank
+from courses.models import Block, Course, Grade, MarkRange, Rank, Semester
 from quest_manager.models import Category, Quest
+from siteconfig.models import SiteConfig
+from tenant.initialization import build_template_schema, template_schema_is_ready
+from tenant.models import Tenant
 from utilities.models import MenuItem
 
 
@@ -170,3 +181,50 @@ class TenantInitializationTest(TenantTestCase):
         self.assertTrue(site_config is not None)
         self.assertEqual(site_config.site_name, "My Byte Deck")
         self.assertEqual(site_config.site_name_short, "Deck")
+
+
+class TenantTemplateTest(TenantTestCase):
+
+    def drop_schema(self, schema_name):
+        with schema_context(get_public_schema_name()):
+            with connection.cursor() as cursor:
+                cursor.execute(f'DROP SCHEMA IF EXISTS "{schema_name}" CASCADE')
+
+    def delete_tenant(self, tenant):
+        with schema_context(get_public_schema_name()):
+            # tables with deferred foreign key checks can't be dropped in the same transaction until they're done
+            with connection.cursor() as cursor:
+                cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+            tenant.delete(force_drop=True)
+
+    def test_tenant_cloned_from_template(self):
+        """ New tenants are cloned from the template schema once it's built, with the same initial data """
+        with override_settings(TENANT_TEMPLATE_SCHEMA="test_template"):
+            # so the test can be run again with --keepdb
+            self.addCleanup(self.drop_schema, "test_template")
+            self.assertFalse(template_schema_is_ready())
+            with patch('tenant_schemas_celery.task.TenantTask.apply_async') as apply_async:
+                with self.captureOnCommitCallbacks(execute=True):
+                    build_template_schema()
+            apply_async.assert_not_called()
+            self.assertTrue(template_schema_is_ready())
+            # there's a new migration
+            with patch('tenant.initialization.migrations_version', return_value='newer'):
+                self.assertFalse(template_schema_is_ready())
+            self.assertFalse(Tenant.objects.filter(schema_name="test_template").exists())
+
+            with schema_context(get_public_schema_name()):
+                tenant = Tenant(schema_name="cloned", name="cloned")
+                tenant.save(verbosity=0)
+            self.addCleanup(self.delete_tenant, tenant)
+            self.assertTrue(tenant.cloned_from_template)
+
+        with tenant_context(tenant):
+            self.assertEqual(SiteConfig.get().site_name, "Cloned Deck")
+            self.assertEqual(Site.objects.get().domain, tenant.get_primary_domain().domain)
+            self.assertEqual(Semester.objects.get().first_day, date.today())
+            self.assertEqual(Quest.objects.count(), 6)
+            self.assertTrue(Badge.objects.filter(name="ByteDeck Proficiency").exists())
+            self.assertTrue(User.objects.filter(username=settings.TENANT_DEFAULT_OWNER_USERNAME).exists())
+            # the sequences were cloned too
+            self.assertIsNotNone(baker.make(Quest).pk)
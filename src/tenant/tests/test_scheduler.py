@@ -0,0 +1,121 @@
+from unittest.mock import patch
+
+from celery.exceptions import Retry
+from freezegun import freeze_time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.test import override_settings
+
+from django_tenants.test.cases import TenantTestCase
+from django_tenants.utils import get_public_schema_name, schema_context
+
+from profile_manager.tasks import invalidate_profile_xp_cache_on_schema
+from tenant import scheduler
+from tenant.models import Tenant
+
+
+@override_settings(TENANT_TASKS_CONCURRENCY=2)
+class TenantSchedulerTests(TenantTestCase):
+
+    def setUp(self):
+        self.clear_slots()
+
+    def tearDown(self):
+        self.clear_slots()
+
+    def clear_slots(self):
+        with schema_context(get_public_schema_name()):
+            cache.delete_many([scheduler.slot_key(slot) for slot in range(settings.TENANT_TASKS_CONCURRENCY)])
+
+    def test_schedule_on_all_tenants(self):
+        """ Start times are spread over the window, with a low priority """
+        # bulk_create doesn't create the schemas
+        Tenant.objects.bulk_create([Tenant(name="second", schema_name="second"), Tenant(name="third", schema_name="third")])
+
+        schemas = []
+        with patch.object(invalidate_profile_xp_cache_on_schema, 'apply_async',
+                          side_effect=lambda **kwargs: schemas.append(connection.schema_name)) as apply_async:
+            num_schemas = scheduler.schedule_on_all_tenants(invalidate_profile_xp_cache_on_schema, window=300)
+
+        self.assertEqual(num_schemas, 3)
+        self.assertEqual(schemas, [self.tenant.schema_name, "second", "third"])
+        self.assertEqual([call.kwargs['countdown'] for call in apply_async.call_args_list], [0, 100, 200])
+        for call in apply_async.call_args_list:
+            self.assertEqual(call.kwargs['priority'], scheduler.PRIORITY_MAINTENANCE)
+        self.assertEqual(connection.schema_name, self.tenant.schema_name)
+
+    def test_slots(self):
+        first = scheduler.acquire_slot('first')
+        self.assertIsNotNone(first)
+        self.assertIsNotNone(scheduler.acquire_slot('second'))
+        self.assertIsNone(scheduler.acquire_slot('third'))
+
+        scheduler.release_slot(first, 'first')
+        self.assertEqual(scheduler.acquire_slot('third'), first)
+
+    def test_release_expired_slot(self):
+        """ A slot that expired and was taken by another task isn't released by the task that had it before """
+        first = scheduler.acquire_slot('first')
+        with schema_context(get_public_schema_name()):
+            cache.delete(first)
+        self.assertEqual(scheduler.acquire_slot('second'), first)
+
+        scheduler.release_slot(first, 'first')
+        with schema_context(get_public_schema_name()):
+            self.assertEqual(cache.get(first), 'second')
+
+    @override_settings(TENANT_TASKS_SLOT_TIMEOUT=100, TENANT_TASKS_RETRY_DELAY=10)
+    def test_leaked_slots_expire(self):
+        """ Slots of tasks whose worker died are freed after the timeout, even while other tasks keep retrying """
+        task = invalidate_profile_xp_cache_on_schema
+        with freeze_time('2024-01-01 00:00:00') as frozen_time:
+            # never released
+            scheduler.acquire_slot('dead')
+            scheduler.acquire_slot('also dead')
+
+            task.push_request(is_eager=False, id='waiting')
+            try:
+                with patch.object(task, 'retry', side_effect=Retry()) as retry:
+                    for _ in range(9):
+                        with self.assertRaises(Retry):
+                            task()
+                        frozen_time.tick(settings.TENANT_TASKS_RETRY_DELAY)
+                self.assertEqual(retry.call_count, 9)
+
+                frozen_time.tick(settings.TENANT_TASKS_RETRY_DELAY)
+                self.assertTrue(task().startswith("Successfully invalidated"))
+            finally:
+                task.pop_request()
+
+    def test_broker_redelivers_after_the_window(self):
+        """ Tasks waiting for their countdown aren't delivered again before they run """
+        visibility_timeout = settings.CELERY_BROKER_TRANSPORT_OPTIONS['visibility_timeout']
+        self.assertGreater(visibility_timeout, settings.TENANT_TASKS_WINDOW + settings.TENANT_TASKS_RETRY_DELAY)
+
+    def test_maintenance_task_records_duration(self):
+        task_result = invalidate_profile_xp_cache_on_schema.apply()
+
+        self.assertTrue(task_result.successful())
+        durations = scheduler.get_durations(invalidate_profile_xp_cache_on_schema.name)
+        self.assertIn(self.tenant.schema_name, durations)
+
+    def test_maintenance_task_slots(self):
+        """ On a worker the task takes a slot while it runs, or is retried later if they're all taken """
+        task = invalidate_profile_xp_cache_on_schema
+        task.push_request(is_eager=False)
+        try:
+            with patch('tenant.scheduler.release_slot') as release_slot:
+                task()
+            release_slot.assert_called_once()
+
+            self.clear_slots()
+            scheduler.acquire_slot('first')
+            scheduler.acquire_slot('second')
+            with patch.object(task, 'retry', side_effect=Retry()) as retry:
+                with self.assertRaises(Retry):
+                    task()
+            retry.assert_called_once()
+        finally:
+            task.pop_request()
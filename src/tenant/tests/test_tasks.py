@@ -1,6 +1,9 @@
 from django.core import mail
 
 from django_tenants.test.cases import TenantTestCase
+from model_bakery import baker
+
+from quest_manager.models import Quest
 
 from tenant import tasks
 
@@ -29,3 +32,17 @@ class TenantTasksTests(TenantTestCase):
         self.assertEqual(mail.outbox[0].subject, "O hi, World!")
         # john doe was first in a list of recipients (BCC)
         self.assertIn("john@doe.com", mail.outbox[0].bcc)
+
+    def test_update_cached_fields_on_schema(self):
+        """ Only the cached fields that changed are written """
+        self.tenant.update_cached_fields()
+        baker.make(Quest, archived=False)
+
+        task_result = tasks.update_cached_fields_on_schema.apply()
+
+        self.assertTrue(task_result.successful())
+        self.assertIn("quest_count", task_result.result)
+        self.assertNotIn("total_user_count", task_result.result)
+        self.tenant.refresh_from_db()
+        self.assertEqual(self.tenant.quest_count, Quest.objects.filter(archived=False).count())
+        self.assertIsNotNone(self.tenant.cached_fields_updated)
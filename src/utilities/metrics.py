@@ -0,0 +1,54 @@
+"""
+Lightweight timing and query counting utilities, used by celery tasks to report their throughput.
+"""
+import time
+
+from django.db import connections, DEFAULT_DB_ALIAS
+
+
+class QueryCounter:
+    """
+    Context manager that times a block of code and counts the SQL queries it executes.
+    Unlike `connection.queries` this also works when DEBUG is False, i.e. inside celery workers.
+
+        with QueryCounter() as counter:
+            do_stuff()
+        counter.report(users=len(users))
+        # {'users': 1500, 'seconds': 3.21, 'queries': 42, 'users_per_sec': 467.3, 'queries_per_user': 0.03}
+    """
+
+    def __init__(self, using=DEFAULT_DB_ALIAS):
+        self.using = using
+        self.queries = 0
+        self.seconds = 0.0
+        self._start = None
+        self._wrapper = None
+
+    def __call__(self, execute, sql, params, many, context):
+        self.queries += 1
+        return execute(sql, params, many, context)
+
+    def __enter__(self):
+        self._wrapper = connections[self.using].execute_wrapper(self)
+        self._wrapper.__enter__()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.seconds = time.perf_counter() - self._start
+        self._wrapper.__exit__(exc_type, exc_value, traceback)
+
+    def report(self, **counts):
+        """
+        :param counts: what was processed, e.g. users=1500
+        :return: a json serializable dict with the counts, the time and the number of queries, plus the rate and
+         queries per item for each count, e.g. users_per_sec and queries_per_user.
+        """
+        report = dict(counts)
+        report['seconds'] = round(self.seconds, 3)
+        report['queries'] = self.queries
+        for name, count in counts.items():
+            singular = name[:-1] if name.endswith('s') else name
+            report[f'{name}_per_sec'] = round(count / self.seconds, 1) if self.seconds else None
+            report[f'queries_per_{singular}'] = round(self.queries / count, 2) if count else None
+        return report